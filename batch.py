@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Set, Tuple
+from openai import OpenAI
+from core.clients import get_openai_client
+from core.embeddings import get_embeddings
+from core.metrics import add_tokens, count_tokens, metrics
+from core.session import SessionStore
+from core.utils import env_choice, estimate_tokens
+from main import (
+    CLASSIFIER_MODES,
+    _classify_group,
+    _classify_locally,
+    _run_turn,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Question(NamedTuple):
+    line: int
+    record: dict
+    text: str
+
+
+class _Prepared(NamedTuple):
+    question: _Question
+    embedding: Optional[List[float]]
+    intent: Optional[str]
+    shared_tokens: dict
+    group_seconds: float
+
+
+def _completed_lines(output: Path, retry_errors: bool) -> Set[int]:
+    # The output is the checkpoint; a line cut short by a crash is dropped
+    if not output.exists():
+        return set()
+    data = output.read_bytes()
+    if data and not data.endswith(b"\n"):
+        with open(output, "r+b") as f:
+            f.truncate(data.rfind(b"\n") + 1)
+        data = data[: data.rfind(b"\n") + 1]
+
+    done: Set[int] = set()
+    kept: List[bytes] = []
+    for raw in data.splitlines(keepends=True):
+        try:
+            result = json.loads(raw)
+        except ValueError:
+            result = None
+        if not isinstance(result, dict) or not isinstance(result.get("line"), int):
+            kept.append(raw)
+            continue
+        if result.get("error") and retry_errors:
+            continue
+        done.add(result["line"])
+        kept.append(raw)
+
+    # Error records being retried are removed, so each line keeps a single record
+    if len(kept) < len(data.splitlines()):
+        partial = output.with_name(output.name + ".tmp")
+        partial.write_bytes(b"".join(kept))
+        os.replace(partial, output)
+    return done
+
+
+def _read_questions(path: Path, skip: Set[int]) -> Iterator[_Question]:
+    # Objects carry the text in "question" (or "message"); any other fields are echoed back
+    with open(path, encoding="utf-8") as f:
+        for line, raw in enumerate(f, start=1):
+            if line in skip or not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                record = {}
+            if isinstance(record, str):
+                record = {"question": record}
+            elif not isinstance(record, dict):
+                record = {}
+            text = record.get("question") or record.get("message") or ""
+            yield _Question(line, record, text.strip() if isinstance(text, str) else "")
+
+
+def _groups(questions: Iterator[_Question], size: int) -> Iterator[List[_Question]]:
+    group: List[_Question] = []
+    for question in questions:
+        group.append(question)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+async def _prepare_group(client: OpenAI, group: List[_Question]) -> List[_Prepared]:
+    # One embeddings request and one classifier call for the whole group
+    started = time.perf_counter()
+    texts = [q.text for q in group]
+    asked = [i for i, text in enumerate(texts) if text]
+    embeddings: List[Optional[List[float]]] = [None] * len(group)
+    try:
+        vectors = await asyncio.to_thread(
+            get_embeddings, client, [texts[i] for i in asked]
+        )
+        for i, vector in zip(asked, vectors):
+            embeddings[i] = vector
+    except Exception as ex:
+        logger.warning(f"Batched embeddings failed ({ex}), embedding one by one")
+
+    intents: List[Optional[str]] = [None] * len(group)
+    if env_choice("CLASSIFIER_MODE", "llm", CLASSIFIER_MODES) == "local":
+        for i in asked:
+            intents[i] = await _classify_locally(client, embeddings[i])
+    unresolved = [i for i in asked if intents[i] is None]
+    classify_tokens = 0
+    if len(unresolved) > 1:
+        try:
+            found, classify_tokens = await _classify_group(
+                [texts[i] for i in unresolved]
+            )
+            for i, intent in zip(unresolved, found):
+                intents[i] = intent
+        except Exception as ex:
+            logger.warning(
+                f"Grouped classification failed ({ex}), classifying one by one"
+            )
+
+    elapsed = time.perf_counter() - started
+    classify_share = classify_tokens // max(1, len(unresolved))
+    prepared = []
+    for i, question in enumerate(group):
+        shared = {}
+        if embeddings[i] is not None:
+            shared["embed"] = estimate_tokens(question.text)
+        if classify_tokens and i in unresolved:
+            shared["classify_batch"] = classify_share
+        prepared.append(_Prepared(question, embeddings[i], intents[i], shared, elapsed))
+    return prepared
+
+
+async def _answer(sessions: SessionStore, client: OpenAI, item: _Prepared) -> dict:
+    question = item.question
+    result = {**question.record, "line": question.line}
+    if not question.text:
+        result["error"] = "no question text"
+        return result
+
+    # Every question is answered in a fresh session
+    session = sessions.session()
+    started = time.perf_counter()
+    with count_tokens() as tokens:
+        for stage, value in item.shared_tokens.items():
+            add_tokens(stage, value)
+        try:
+            result["answer"] = await _run_turn(
+                session, question.text, client, item.embedding, item.intent
+            )
+        except Exception as ex:
+            result["error"] = f"{type(ex).__name__}: {ex}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    result["group_seconds"] = round(item.group_seconds, 3)
+    result["tokens"] = {**tokens, "total": sum(tokens.values())}
+    return result
+
+
+async def run_batch(
+    input_path: Path,
+    output_path: Path,
+    client: OpenAI,
+    sessions: SessionStore,
+    concurrency: int = 8,
+    group_size: int = 32,
+    retry_errors: bool = False,
+) -> Tuple[int, int]:
+    done = _completed_lines(output_path, retry_errors)
+    if done:
+        logger.info(f"Resuming: {len(done)} line(s) already done")
+    slots = asyncio.Semaphore(max(1, concurrency))
+    running: Set[asyncio.Task] = set()
+    answered = failed = 0
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        async def run(item: _Prepared) -> None:
+            nonlocal answered, failed
+            try:
+                result = await _answer(sessions, client, item)
+            finally:
+                slots.release()
+            # Written as soon as it is ready, so completion order may differ from input order
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            failed += "error" in result
+            answered += "error" not in result
+            metrics.inc(
+                "batch_items_total", result="error" if "error" in result else "ok"
+            )
+
+        # The next group is prepared while the previous one is still being answered
+        for group in _groups(_read_questions(input_path, done), max(1, group_size)):
+            for item in await _prepare_group(client, group):
+                await slots.acquire()
+                task = asyncio.create_task(run(item))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            logger.info(f"Batch: {answered} answered, {failed} failed")
+        await asyncio.gather(*running)
+    return answered, failed
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Answer a JSONL file of questions and stream the answers to JSONL."
+    )
+    parser.add_argument("input", type=Path)
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--group-size", type=int, default=32)
+    parser.add_argument(
+        "--retry-errors",
+        action="store_true",
+        help="answer lines that failed in an earlier run again",
+    )
+    parser.add_argument(
+        "--session-db", help="keep the batch sessions here instead of a temporary file"
+    )
+    args = parser.parse_args(argv)
+
+    client = get_openai_client()
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="batch-") as tmp:
+        sessions = SessionStore(args.session_db or os.path.join(tmp, "sessions.db"))
+        answered, failed = asyncio.run(
+            run_batch(
+                args.input,
+                args.output,
+                client,
+                sessions,
+                args.concurrency,
+                args.group_size,
+                args.retry_errors,
+            )
+        )
+    logger.info(
+        f"Done. {answered} answered, {failed} failed "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
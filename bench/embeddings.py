@@ -0,0 +1,258 @@
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Set, Tuple
+import numpy as np
+from core.clients import get_openai_client
+from core.embeddings import EMBEDDING_DIMENSIONS, get_embeddings
+from core.presets import ALLOWED_NAMESPACES
+from retrieval.index import index_manager
+from retrieval.local_index import LocalIndex
+from retrieval.quantize import QUANTIZATION_MODES, code_width
+
+
+_FETCH_BATCH = 100
+_UPSERT_BATCH = 1000
+
+
+def _field(record, name: str):
+    if isinstance(record, dict):
+        return record.get(name)
+    return getattr(record, name, None)
+
+
+def _pinecone_vectors(
+    index, namespace: str, limit: int
+) -> Tuple[List[str], np.ndarray]:
+    # Serverless indexes list ids page by page; the values come from fetch
+    ids: List[str] = []
+    for page in index.list(namespace=namespace):
+        ids.extend(page)
+        if len(ids) >= limit:
+            break
+    ids = ids[:limit]
+
+    kept: List[str] = []
+    vectors: List[List[float]] = []
+    for start in range(0, len(ids), _FETCH_BATCH):
+        batch = ids[start : start + _FETCH_BATCH]
+        records = _field(index.fetch(ids=batch, namespace=namespace), "vectors") or {}
+        for vector_id in batch:
+            values = _field(records.get(vector_id), "values")
+            if values:
+                kept.append(vector_id)
+                vectors.append(list(values))
+    return kept, np.asarray(vectors, dtype=np.float32)
+
+
+def _load_vectors(namespace: str, limit: int) -> Tuple[List[str], np.ndarray]:
+    index = index_manager.get()
+    if index is None:
+        raise RuntimeError("No vector index is configured")
+    if isinstance(index, LocalIndex):
+        ids, matrix = index.export(namespace)
+        return ids[:limit], matrix[:limit]
+    return _pinecone_vectors(index, namespace, limit)
+
+
+def _shorten(matrix: np.ndarray, dimensions: int) -> np.ndarray:
+    # Same truncate-and-renormalize as shorten_embedding, for whole matrices
+    short = np.array(matrix[:, :dimensions], dtype=np.float32)
+    norms = np.linalg.norm(short, axis=1, keepdims=True)
+    return short / np.where(norms == 0, 1.0, norms)
+
+
+def _read_questions(path: Path) -> List[str]:
+    # Plain text lines, JSON strings, or objects with "question" (or "message")
+    questions = []
+    for raw in path.read_text(encoding="utf-8").splitlines():
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            record = raw
+        if isinstance(record, dict):
+            record = record.get("question") or record.get("message") or ""
+        if isinstance(record, str) and record.strip():
+            questions.append(record.strip())
+    return questions
+
+
+def _ground_truth(
+    corpus: np.ndarray, queries: np.ndarray, k: int, own_rows: Optional[np.ndarray]
+) -> List[Set[int]]:
+    # Exact top-k at the stored precision; a query taken from the corpus skips itself
+    scores = _shorten(queries, corpus.shape[1]) @ _shorten(corpus, corpus.shape[1]).T
+    if own_rows is not None:
+        scores[np.arange(len(queries)), own_rows] = -np.inf
+    k = min(k, corpus.shape[0] - (own_rows is not None))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def _build_index(
+    root: Path, namespace: str, ids: Sequence[str], matrix: np.ndarray
+) -> LocalIndex:
+    index = LocalIndex(root)
+    for start in range(0, len(ids), _UPSERT_BATCH):
+        index.upsert(
+            namespace=namespace,
+            vectors=[
+                {"id": ids[i], "values": matrix[i].tolist()}
+                for i in range(start, min(len(ids), start + _UPSERT_BATCH))
+            ],
+        )
+    return index
+
+
+def _bytes_per_vector(mode: str, dimensions: int) -> int:
+    # What first-pass scoring reads per vector; full precision is kept for rescoring
+    if mode == "off":
+        return dimensions * 4
+    if mode == "int8":
+        return code_width(mode, dimensions) + 4
+    return code_width(mode, dimensions)
+
+
+def _evaluate(
+    index: LocalIndex,
+    namespace: str,
+    ids: Sequence[str],
+    queries: np.ndarray,
+    own_rows: Optional[np.ndarray],
+    truth: List[Set[int]],
+    mode: str,
+    k: int,
+    rescore_factor: int,
+) -> dict:
+    rows_by_id = {vector_id: row for row, vector_id in enumerate(ids)}
+    extra = 1 if own_rows is not None else 0
+    # The first query builds the codes, so it is not timed
+    index.query(
+        namespace=namespace,
+        vector=queries[0].tolist(),
+        top_k=k + extra,
+        quantization=mode,
+        rescore_factor=rescore_factor,
+    )
+
+    latencies: List[float] = []
+    recalls: List[float] = []
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        result = index.query(
+            namespace=namespace,
+            vector=query.tolist(),
+            top_k=k + extra,
+            include_metadata=False,
+            quantization=mode,
+            rescore_factor=rescore_factor,
+        )
+        latencies.append(time.perf_counter() - started)
+        found = [rows_by_id[m["id"]] for m in result["matches"]]
+        if own_rows is not None:
+            found = [row for row in found if row != own_rows[i]]
+        expected = truth[i]
+        recalls.append(len(expected & set(found[:k])) / max(1, len(expected)))
+
+    p50, p95 = np.percentile(np.asarray(latencies) * 1000, [50, 95])
+    return {
+        "quantization": mode,
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "query_ms": {"p50": round(float(p50), 3), "p95": round(float(p95), 3)},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure recall@k and query latency of shortened and quantized embeddings against stored namespaces."
+    )
+    parser.add_argument("--namespaces", nargs="+", default=ALLOWED_NAMESPACES)
+    parser.add_argument(
+        "--dimensions", nargs="+", type=int, default=[256, 512, EMBEDDING_DIMENSIONS]
+    )
+    parser.add_argument(
+        "--quantization",
+        nargs="+",
+        choices=QUANTIZATION_MODES,
+        default=QUANTIZATION_MODES,
+    )
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument(
+        "--queries", type=int, default=200, help="stored vectors sampled as queries"
+    )
+    parser.add_argument(
+        "--questions", type=Path, help="embed these questions as queries instead"
+    )
+    parser.add_argument("--max-vectors", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args(argv)
+
+    question_vectors: Optional[np.ndarray] = None
+    if args.questions:
+        texts = _read_questions(args.questions)
+        question_vectors = np.asarray(
+            get_embeddings(get_openai_client(), texts), dtype=np.float32
+        )
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="rag-embeddings-") as tmp:
+        for namespace in args.namespaces:
+            ids, corpus = _load_vectors(namespace, args.max_vectors)
+            if len(ids) < 2:
+                results.append({"namespace": namespace, "vectors": len(ids)})
+                continue
+            stored = corpus.shape[1]
+            if question_vectors is not None:
+                queries, own_rows = _shorten(question_vectors, stored), None
+            else:
+                rows = random.Random(args.seed).sample(
+                    range(len(ids)), min(args.queries, len(ids))
+                )
+                own_rows = np.asarray(rows)
+                queries = corpus[own_rows]
+            truth = _ground_truth(corpus, queries, args.k, own_rows)
+
+            for dimensions in sorted(set(args.dimensions)):
+                if dimensions > stored:
+                    # Vectors stored shortened cannot be widened again
+                    continue
+                root = Path(tmp) / f"{namespace}-{dimensions}"
+                index = _build_index(root, namespace, ids, _shorten(corpus, dimensions))
+                short_queries = _shorten(queries, dimensions)
+                for mode in args.quantization:
+                    results.append(
+                        {
+                            "namespace": namespace,
+                            "vectors": len(ids),
+                            "dimensions": dimensions,
+                            "bytes_per_vector": _bytes_per_vector(mode, dimensions),
+                            **_evaluate(
+                                index,
+                                namespace,
+                                ids,
+                                short_queries,
+                                own_rows,
+                                truth,
+                                mode,
+                                args.k,
+                                args.rescore_factor,
+                            ),
+                        }
+                    )
+
+    config = {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()}
+    report = {"config": config, "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
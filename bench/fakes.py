@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import types
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from core.presets import ALLOWED_NAMESPACES
+from core.utils import estimate_tokens
+
+
+_BATCH_CHUNK = re.compile(r'<chunk id="(\d+)">\n(.*?)\n</chunk>', re.DOTALL)
+_SINGLE_CHUNK = re.compile(r"<chunk>\n(.*?)\n</chunk>", re.DOTALL)
+_QUERY = re.compile(r'<query id="(\d+)">\n(.*?)\n</query>', re.DOTALL)
+_FILLER = "the guest service team confirms details on request".split()
+
+
+class FakeServiceError(Exception):
+    # Carries the HTTP status the real clients would report
+    def __init__(self, message: str, status: int) -> None:
+        super().__init__(message)
+        self.status = status
+        self.status_code = status
+
+
+class ServiceModel:
+    # Log-normal latency, a requests-per-minute limit and a random failure rate
+    def __init__(
+        self,
+        name: str,
+        median_ms: float,
+        sigma: float = 0.4,
+        rpm: int = 0,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.name = name
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.rpm = rpm
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window: List[float] = []
+        self.requests = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def _admit(self, input_tokens: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            if self.rpm > 0:
+                self._window = [t for t in self._window if now - t < 60.0]
+                if len(self._window) >= self.rpm:
+                    self.rate_limited += 1
+                    raise FakeServiceError(f"{self.name}: rate limit exceeded", 429)
+                self._window.append(now)
+            if self._random.random() < self.failure_rate:
+                self.failures += 1
+                raise FakeServiceError(f"{self.name}: internal error", 500)
+            self.input_tokens += input_tokens
+            delay = self.median_ms * self._random.lognormvariate(0.0, self.sigma)
+        return delay / 1000
+
+    def _produced(self, output_tokens: int) -> None:
+        with self._lock:
+            self.output_tokens += output_tokens
+
+    def call(self, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        time.sleep(self._admit(input_tokens))
+        self._produced(output_tokens)
+
+    async def acall(self, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        await asyncio.sleep(self._admit(input_tokens))
+        self._produced(output_tokens)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "failures": self.failures,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+def fake_embedding(text: str, dimensions: int) -> List[float]:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+
+def _usage(prompt_tokens: int, completion_tokens: int):
+    return types.SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=types.SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _situated_reply(messages: Sequence[dict], response_format: Optional[dict]) -> str:
+    prompt = messages[-1]["content"]
+    if response_format and response_format.get("type") == "json_object":
+        chunks = [
+            {"id": int(chunk_id), "situated": f"Synthetic context : {text}"}
+            for chunk_id, text in _BATCH_CHUNK.findall(prompt)
+        ]
+        return json.dumps({"chunks": chunks})
+    found = _SINGLE_CHUNK.search(prompt)
+    if found:
+        return f"Synthetic context : {found.group(1)}"
+    # Document summaries
+    return " ".join(_FILLER * 20)
+
+
+class _Completions:
+    def __init__(self, service: ServiceModel) -> None:
+        self.service = service
+
+    def _reply(self, messages: Sequence[dict], kwargs: dict):
+        prompt_tokens = sum(estimate_tokens(str(m.get("content"))) for m in messages)
+        content = _situated_reply(messages, kwargs.get("response_format"))
+        return prompt_tokens, content
+
+    @staticmethod
+    def _response(content: str, prompt_tokens: int, completion_tokens: int):
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=message)],
+            usage=_usage(prompt_tokens, completion_tokens),
+        )
+
+    def create(self, *, model: str, messages: Sequence[dict], **kwargs):
+        prompt_tokens, content = self._reply(messages, kwargs)
+        completion_tokens = estimate_tokens(content)
+        self.service.call(prompt_tokens, completion_tokens)
+        return self._response(content, prompt_tokens, completion_tokens)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, *, model: str, messages: Sequence[dict], **kwargs):
+        prompt_tokens, content = self._reply(messages, kwargs)
+        completion_tokens = estimate_tokens(content)
+        await self.service.acall(prompt_tokens, completion_tokens)
+        return self._response(content, prompt_tokens, completion_tokens)
+
+
+class _Embeddings:
+    def __init__(self, service: ServiceModel) -> None:
+        self.service = service
+
+    def create(self, *, model: str, input, dimensions: int = 1536, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        self.service.call(sum(estimate_tokens(t) for t in texts))
+        data = [
+            types.SimpleNamespace(index=i, embedding=fake_embedding(t, dimensions))
+            for i, t in enumerate(texts)
+        ]
+        return types.SimpleNamespace(data=data)
+
+
+class FakeOpenAI:
+    # Stands in for OpenAI: chat completions and embeddings with modelled latency
+    def __init__(self, chat: ServiceModel, embeddings: ServiceModel) -> None:
+        self.api_key = "offline"
+        self.organization = None
+        self.base_url = "http://offline.invalid/v1"
+        self.chat_service = chat
+        self.chat = types.SimpleNamespace(completions=_Completions(chat))
+        self.embeddings = _Embeddings(embeddings)
+
+    def as_async(self, **kwargs) -> "FakeAsyncOpenAI":
+        return FakeAsyncOpenAI(self.chat_service)
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, chat: ServiceModel) -> None:
+        self.chat = types.SimpleNamespace(completions=_AsyncCompletions(chat))
+
+
+def _fake_intent(text: str) -> str:
+    choices = ALLOWED_NAMESPACES + ["other_unrelated"]
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest()
+    return choices[int.from_bytes(digest, "little") % len(choices)]
+
+
+class FakeRunner:
+    # Stands in for agents.Runner; replies depend only on the agent name and input
+    def __init__(self, service: ServiceModel, answer_tokens: int = 120) -> None:
+        self.service = service
+        self.answer_tokens = answer_tokens
+
+    def _output(self, agent, text: str) -> str:
+        if agent.name == "Classifier":
+            return _fake_intent(text)
+        if agent.name == "BatchClassifier":
+            queries = _QUERY.findall(text)
+            labels = [_fake_intent(query) for _, query in queries]
+            return json.dumps(
+                {
+                    "queries": [
+                        {"id": int(query_id), "category": label}
+                        for (query_id, _), label in zip(queries, labels)
+                    ]
+                }
+            )
+        if agent.name == "Enhancer":
+            return text
+        words = self.answer_tokens * 3 // 4
+        return " ".join(_FILLER[i % len(_FILLER)] for i in range(words))
+
+    async def run(self, agent, input, session=None, run_config=None, **kwargs):
+        text = str(input)
+        history: List[dict] = []
+        if session is not None:
+            history = await session.get_items()
+            if run_config is not None and run_config.session_input_callback:
+                history = run_config.session_input_callback(history, [])
+        instructions = agent.instructions if isinstance(agent.instructions, str) else ""
+        prompt_tokens = estimate_tokens(instructions) + estimate_tokens(text)
+        prompt_tokens += sum(estimate_tokens(json.dumps(item)) for item in history)
+        output = self._output(agent, text)
+        completion_tokens = estimate_tokens(output)
+        await self.service.acall(prompt_tokens, completion_tokens)
+        if session is not None:
+            await session.add_items(
+                [
+                    {"role": "user", "content": text},
+                    {"role": "assistant", "content": output},
+                ]
+            )
+        usage = types.SimpleNamespace(total_tokens=prompt_tokens + completion_tokens)
+        return types.SimpleNamespace(
+            final_output=output,
+            context_wrapper=types.SimpleNamespace(usage=usage),
+        )
+
+
+class FakePineconeIndex:
+    # In-memory PineconeIndex with modelled request latency; cosine scores
+    def __init__(self, service: ServiceModel) -> None:
+        self.service = service
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, dict]] = {}
+        self._matrices: Dict[str, tuple] = {}
+
+    def upsert(self, *, namespace: str, vectors: Sequence[dict]) -> dict:
+        self.service.call()
+        with self._lock:
+            records = self._records.setdefault(namespace, {})
+            for vector in vectors:
+                records[vector["id"]] = vector
+            self._matrices.pop(namespace, None)
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, *, ids: Sequence[str], namespace: str) -> dict:
+        self.service.call()
+        with self._lock:
+            records = self._records.get(namespace, {})
+            for vector_id in ids:
+                records.pop(vector_id, None)
+            self._matrices.pop(namespace, None)
+        return {}
+
+    def _matrix(self, namespace: str) -> tuple:
+        with self._lock:
+            cached = self._matrices.get(namespace)
+            if cached is None:
+                records = list(self._records.get(namespace, {}).values())
+                matrix = np.asarray([r["values"] for r in records], dtype=np.float32)
+                if len(records):
+                    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+                cached = self._matrices[namespace] = (records, matrix)
+            return cached
+
+    def query(
+        self,
+        *,
+        namespace: str,
+        vector: Sequence[float],
+        top_k: int,
+        include_values: bool = False,
+        include_metadata: bool = True,
+        sparse_vector: Optional[dict] = None,
+        **kwargs,
+    ) -> dict:
+        self.service.call()
+        records, matrix = self._matrix(namespace)
+        if not records:
+            return {"matches": []}
+        scores = matrix @ np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-scores)[:top_k]
+        matches = []
+        for row in top.tolist():
+            match = {"id": records[row]["id"], "score": float(scores[row])}
+            if include_metadata:
+                match["metadata"] = records[row].get("metadata")
+            if include_values:
+                match["values"] = records[row]["values"]
+            matches.append(match)
+        return {"matches": matches}
+
+    def describe_index_stats(self) -> dict:
+        with self._lock:
+            return {
+                "namespaces": {
+                    ns: {"vector_count": len(records)}
+                    for ns, records in self._records.items()
+                }
+            }
@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from bench.fakes import FakeOpenAI, FakePineconeIndex, FakeRunner, ServiceModel
+
+
+_TOPICS = [
+    "Checkout is at {n}:00 and late checkout until {m}:00 costs {p} euros.",
+    "Room {n}{c} has a balcony, a minibar and a rain shower.",
+    "The spa opens at {n}:30 and the sauna stays warm until {m}:00.",
+    "Breakfast is served from {n}:00 on the {c} floor terrace for {p} euros.",
+    "Pets up to {n} kg are welcome for a fee of {p} euros per night.",
+    "The shuttle to the old town leaves every {n} minutes from gate {c}.",
+    "Parking in garage level {n} costs {p} euros per day with valet service.",
+    "Cancellations made {n} days before arrival are refunded except {p} euros.",
+]
+_QUESTIONS = [
+    "What time is checkout?",
+    "Can I bring my dog?",
+    "When does the spa open?",
+    "How much is breakfast?",
+    "Is there a shuttle to the old town?",
+    "Where can I park my car?",
+    "What is the cancellation policy?",
+    "Which rooms have a balcony?",
+]
+
+
+def _write_corpus(path: Path, chunks: int, seed: int) -> None:
+    # About 2000 characters per chunk, written as short paragraphs
+    rng = random.Random(seed)
+    lines: List[str] = []
+    size = 0
+    while size < chunks * 2000:
+        sentences = [
+            rng.choice(_TOPICS).format(
+                n=rng.randint(1, 12),
+                m=rng.randint(13, 23),
+                p=rng.randint(5, 90),
+                c=rng.choice("abcdef"),
+            )
+            for _ in range(rng.randint(3, 6))
+        ]
+        line = " ".join(sentences)
+        lines.append(line)
+        size += len(line) + 1
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": round(p50, 4), "p95": round(p95, 4), "p99": round(p99, 4)}
+
+
+def _service_delta(services: List[ServiceModel], before: dict) -> dict:
+    delta = {}
+    for service in services:
+        now = service.stats()
+        delta[service.name] = {k: v - before[service.name][k] for k, v in now.items()}
+    return delta
+
+
+def _snapshot(services: List[ServiceModel]) -> dict:
+    return {service.name: service.stats() for service in services}
+
+
+def _load_app(workdir: Path, index: FakePineconeIndex, client: FakeOpenAI, runner):
+    # main opens its databases relative to the working directory, so they land in the scratch directory
+    os.chdir(workdir)
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ["VECTOR_BACKEND"] = "local"
+    os.environ["LOCAL_INDEX_DIR"] = str(workdir / "local_index")
+    main = importlib.import_module("main")
+    uploader = importlib.import_module("ingest.uploader")
+    index_module = importlib.import_module("retrieval.index")
+
+    index_module.index_manager.close()
+    index_module._build_index = lambda pool_size: index
+    main.Runner = runner
+    uploader.AsyncOpenAI = client.as_async
+    return main, uploader
+
+
+def _bench_ingest(
+    uploader, client, index, services, workdir: Path, size: int, namespace: str
+) -> dict:
+    path = workdir / f"corpus_{size}.txt"
+    _write_corpus(path, size, seed=size)
+    os.environ["INGEST_CACHE_DB"] = str(workdir / f"ingest_cache_{size}.db")
+    stored_before = (
+        index.describe_index_stats()["namespaces"]
+        .get(namespace, {})
+        .get("vector_count", 0)
+    )
+    before = _snapshot(services)
+    started = time.perf_counter()
+    log = uploader.uploader(namespace, [str(path)], client)
+    elapsed = time.perf_counter() - started
+    stored = (
+        index.describe_index_stats()["namespaces"]
+        .get(namespace, {})
+        .get("vector_count", 0)
+    )
+    chunks = stored - stored_before
+    return {
+        "corpus_chunks": size,
+        "upserted": chunks,
+        "wall_seconds": round(elapsed, 3),
+        "chunks_per_second": round(chunks / elapsed, 2) if elapsed > 0 else 0.0,
+        "log": log.splitlines()[-1] if log else "",
+        "services": _service_delta(services, before),
+    }
+
+
+async def _bench_turns(
+    main, client, services, workdir: Path, turns: int, concurrency: int
+) -> dict:
+    # Each simulated user keeps one session and asks its share of the questions in turn
+    store = main.SessionStore(str(workdir / f"sessions_{concurrency}.db"))
+    latencies: List[float] = []
+    failures: List[str] = []
+
+    async def user(worker: int) -> None:
+        session = store.session()
+        for turn in range(worker, turns, concurrency):
+            question = _QUESTIONS[turn % len(_QUESTIONS)]
+            started = time.perf_counter()
+            try:
+                await main._run_turn(session, question, client)
+            except Exception as ex:
+                failures.append(f"{type(ex).__name__}: {ex}")
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    before = _snapshot(services)
+    started = time.perf_counter()
+    await asyncio.gather(*(user(w) for w in range(min(concurrency, turns))))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "turns": turns,
+        "completed": len(latencies),
+        "failed": len(failures),
+        "errors": sorted(set(failures))[:5],
+        "turn_seconds": _percentiles(latencies),
+        "turns_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "services": _service_delta(services, before),
+    }
+
+
+def _compare(baseline: dict, results: dict) -> List[str]:
+    lines = []
+    old_ingest = {r["corpus_chunks"]: r for r in baseline.get("ingest", [])}
+    for run in results["ingest"]:
+        old = old_ingest.get(run["corpus_chunks"])
+        if old and old["chunks_per_second"]:
+            change = run["chunks_per_second"] / old["chunks_per_second"] - 1
+            lines.append(
+                f"ingest {run['corpus_chunks']} chunks: "
+                f"{run['chunks_per_second']} chunks/s ({change:+.1%})"
+            )
+    old_turns = {r["concurrency"]: r for r in baseline.get("turns", [])}
+    for run in results["turns"]:
+        old = old_turns.get(run["concurrency"])
+        if not old:
+            continue
+        for name in ("p50", "p95", "p99"):
+            new_value = run["turn_seconds"][name]
+            old_value = old["turn_seconds"][name]
+            if new_value is not None and old_value:
+                lines.append(
+                    f"turns x{run['concurrency']} {name}: {new_value:.3f}s "
+                    f"({new_value / old_value - 1:+.1%})"
+                )
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark chat turns and ingestion offline against modelled OpenAI and Pinecone services."
+    )
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--corpus-chunks", nargs="+", type=int, default=[20, 100])
+    parser.add_argument("--namespace", default="hotel_policies")
+    parser.add_argument("--llm-ms", type=float, default=400.0)
+    parser.add_argument("--embed-ms", type=float, default=80.0)
+    parser.add_argument("--index-ms", type=float, default=30.0)
+    parser.add_argument(
+        "--sigma", type=float, default=0.4, help="log-normal latency spread"
+    )
+    parser.add_argument("--llm-rpm", type=int, default=0, help="0 for no limit")
+    parser.add_argument("--embed-rpm", type=int, default=0)
+    parser.add_argument("--index-rpm", type=int, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument(
+        "--compare", type=Path, help="earlier results file to report changes against"
+    )
+    args = parser.parse_args(argv)
+
+    output = args.output.resolve()
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    llm = ServiceModel(
+        "llm", args.llm_ms, args.sigma, args.llm_rpm, args.failure_rate, args.seed
+    )
+    embeddings = ServiceModel(
+        "embeddings",
+        args.embed_ms,
+        args.sigma,
+        args.embed_rpm,
+        args.failure_rate,
+        args.seed + 1,
+    )
+    vector_index = ServiceModel(
+        "index",
+        args.index_ms,
+        args.sigma,
+        args.index_rpm,
+        args.failure_rate,
+        args.seed + 2,
+    )
+    services = [llm, embeddings, vector_index]
+    client = FakeOpenAI(llm, embeddings)
+    index = FakePineconeIndex(vector_index)
+    runner = FakeRunner(llm, args.answer_tokens)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+        workdir = Path(tmp)
+        try:
+            app, uploader = _load_app(workdir, index, client, runner)
+            ingest = [
+                _bench_ingest(
+                    uploader, client, index, services, workdir, size, args.namespace
+                )
+                for size in args.corpus_chunks
+            ]
+            turns = [
+                asyncio.run(
+                    _bench_turns(app, client, services, workdir, args.turns, level)
+                )
+                for level in args.concurrency
+            ]
+        finally:
+            os.chdir(cwd)
+
+    config = {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()}
+    results = {"config": config, "ingest": ingest, "turns": turns}
+    output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(json.dumps(results, indent=2))
+    if baseline is not None:
+        print("\n".join(_compare(baseline, results)))
+
+
+if __name__ == "__main__":
+    main()
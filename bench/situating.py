@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+from openai import OpenAI
+from core.clients import get_openai_client
+from ingest.chunker import iter_file_chunks
+from ingest.uploader import FALLBACK_PREFIX, _SituatePrompts, _situate_chunks
+
+
+class _UsageRecorder:
+    # Wraps chat.completions.create and sums the token usage it reports
+    def __init__(self, client: OpenAI) -> None:
+        self._create = client.chat.completions.create
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        client.chat.completions.create = self.create
+
+    def create(self, *args, **kwargs):
+        response = self._create(*args, **kwargs)
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+            self.cached_tokens += getattr(details, "cached_tokens", 0) or 0
+        return response
+
+    def restore(self, client: OpenAI) -> None:
+        client.chat.completions.create = self._create
+
+
+def _run(
+    client: OpenAI, path: Path, strategy: str, batch_size: int, limit: int
+) -> dict:
+    os.environ["SITUATE_STRATEGY"] = strategy
+    os.environ["SITUATE_BATCH_SIZE"] = str(batch_size)
+    # Async mode situates through its own AsyncOpenAI client, which the recorder misses
+    os.environ["INGEST_MODE"] = "threads"
+    spans = list(iter_file_chunks(path))
+    pieces = [span.text for span in spans]
+    recorder = _UsageRecorder(client)
+    started = time.perf_counter()
+    try:
+        selected = pieces[:limit] if limit > 0 else pieces
+        prompts = _SituatePrompts(client, path, selected)
+        situated = list(_situate_chunks(client, prompts, range(len(selected))))
+    finally:
+        recorder.restore(client)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "strategy": strategy,
+        "batch_size": batch_size,
+        "file": path.name,
+        "chunks": len(situated),
+        "fallbacks": sum(s.startswith(FALLBACK_PREFIX) for s in situated),
+        "requests": recorder.requests,
+        "prompt_tokens": recorder.prompt_tokens,
+        "cached_prompt_tokens": recorder.cached_tokens,
+        "completion_tokens": recorder.completion_tokens,
+        "prompt_tokens_per_chunk": (
+            recorder.prompt_tokens / len(situated) if situated else 0.0
+        ),
+        "wall_seconds": round(elapsed, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare situating strategies and batch sizes on token usage and wall time."
+    )
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        default=["full", "window"],
+        choices=["full", "window"],
+    )
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1])
+    parser.add_argument(
+        "--limit", type=int, default=0, help="situate only the first N chunks per file"
+    )
+    args = parser.parse_args(argv)
+
+    client = get_openai_client()
+    results = [
+        _run(client, path, strategy, batch_size, args.limit)
+        for path in args.files
+        for strategy in args.strategies
+        for batch_size in args.batch_sizes
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
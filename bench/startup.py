@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = ("gradio", "agents", "openai", "pinecone", "numpy")
+# Imports must not depend on credentials, so they are removed from the child environment
+_SECRETS = ("OPENAI_API_KEY", "PINECONE_API_KEY", "PINECONE_INDEX")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _measure(module: str, env: dict) -> dict:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            _PROBE.format(module=module, heavy=HEAVY_MODULES),
+        ],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    # Lines read "import time: self | cumulative | name", nested imports indented two spaces
+    # per level; the direct imports of the probed module are the ones worth reporting
+    top = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        if name.startswith("   ") and not name.startswith("     "):
+            top.append((int(parts[1]), name.strip()))
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    probe["slowest"] = [
+        {"module": name, "seconds": round(us / 1e6, 3)}
+        for us, name in sorted(top, reverse=True)[:5]
+    ]
+    return probe
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure cold import time of the app's entry points in fresh interpreters."
+    )
+    parser.add_argument(
+        "modules", nargs="*", default=["headless", "main", "ingest.uploader"]
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.0,
+        help="fail when a median exceeds this many seconds",
+    )
+    parser.add_argument(
+        "--forbid",
+        nargs="*",
+        default=["gradio"],
+        help="modules the entry points must not load",
+    )
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args(argv)
+
+    env = {k: v for k, v in os.environ.items() if k not in _SECRETS}
+    results = []
+    failed = False
+    for module in args.modules:
+        runs = [_measure(module, env) for _ in range(max(1, args.runs))]
+        median = statistics.median(run["seconds"] for run in runs)
+        forbidden = sorted(set(args.forbid) & set(runs[-1]["loaded"]))
+        over_budget = args.budget > 0 and median > args.budget
+        failed = failed or over_budget or bool(forbidden)
+        results.append(
+            {
+                "module": module,
+                "median_seconds": round(median, 3),
+                "min_seconds": round(min(run["seconds"] for run in runs), 3),
+                "loaded": runs[-1]["loaded"],
+                "forbidden_loaded": forbidden,
+                "over_budget": over_budget,
+                "slowest_imports": runs[-1]["slowest"],
+            }
+        )
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    print(text)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
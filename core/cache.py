@@ -0,0 +1,158 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from core.utils import env_float, env_int
+
+
+# Follow-up questions whose meaning comes from earlier turns: phrases that point
+# back, or a pronoun before anything it could refer to, as in "how much is it?"
+_HISTORY_REFERENCE = re.compile(
+    r"\b(what about|how about|and for|the same|same as|the previous|previously|"
+    r"earlier|above|again|anything else|you said|you mentioned)\b",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"[a-z']+")
+_PRONOUNS = frozenset(
+    "it its that this those these they them their he she his her".split()
+)
+# Question and auxiliary words that can come before a leading pronoun
+_LEAD_WORDS = frozenset(
+    "what when where which who why how much many long time and but so then also "
+    "ok okay is are was were do does did can could will would should may "
+    "please tell me about for".split()
+)
+
+
+class SemanticAnswerCache:
+    # Answers keyed by namespace and query-embedding similarity, LRU + TTL bounded
+    def __init__(self, max_entries: int, ttl_seconds: float, threshold: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, Tuple[str, np.ndarray, str, float]]" = (
+            OrderedDict()
+        )
+        self._matrices: Dict[str, Tuple[List[int], np.ndarray]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "SemanticAnswerCache":
+        return cls(
+            max_entries=env_int("ANSWER_CACHE_SIZE", 0),
+            ttl_seconds=env_float("ANSWER_CACHE_TTL", 3600.0),
+            threshold=env_float("ANSWER_CACHE_THRESHOLD", 0.95),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _matrix(self, namespace: str) -> Tuple[List[int], np.ndarray]:
+        cached = self._matrices.get(namespace)
+        if cached is None:
+            ids = [i for i, e in self._entries.items() if e[0] == namespace]
+            vectors = [self._entries[i][1] for i in ids]
+            matrix = np.stack(vectors) if vectors else np.empty((0, 0), np.float32)
+            cached = (ids, matrix)
+            self._matrices[namespace] = cached
+        return cached
+
+    def _remove(self, entry_id: int) -> None:
+        namespace = self._entries.pop(entry_id)[0]
+        self._matrices.pop(namespace, None)
+
+    def get(self, namespace: str, embedding: Sequence[float]) -> Optional[str]:
+        q = _normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            ids, matrix = self._matrix(namespace)
+            if len(ids) == 0 or matrix.shape[1] != q.shape[0]:
+                self.counters["misses"] += 1
+                return None
+            scores = matrix @ q
+            for pos in np.argsort(-scores):
+                if scores[pos] < self.threshold:
+                    break
+                entry_id = ids[int(pos)]
+                _, _, answer, created = self._entries[entry_id]
+                if now - created > self.ttl_seconds:
+                    continue
+                self._entries.move_to_end(entry_id)
+                self.counters["hits"] += 1
+                return answer
+
+            expired = [i for i in ids if now - self._entries[i][3] > self.ttl_seconds]
+            for entry_id in expired:
+                self._remove(entry_id)
+            self.counters["expirations"] += len(expired)
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, namespace: str, embedding: Sequence[float], answer: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[self._next_id] = (
+                namespace,
+                _normalize(embedding),
+                answer,
+                time.monotonic(),
+            )
+            self._next_id += 1
+            self._matrices.pop(namespace, None)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+
+    def bypass(self) -> None:
+        with self._lock:
+            self.counters["bypasses"] += 1
+
+    def invalidate(self, namespace: str) -> None:
+        with self._lock:
+            stale = [i for i, e in self._entries.items() if e[0] == namespace]
+            for entry_id in stale:
+                self._remove(entry_id)
+            self._matrices.pop(namespace, None)
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            }
+
+
+def depends_on_history(text: str) -> bool:
+    if _HISTORY_REFERENCE.search(text):
+        return True
+    for word in _WORD.findall(text.lower()):
+        if word in _PRONOUNS:
+            return True
+        if word not in _LEAD_WORDS:
+            return False
+    return False
+
+
+def _normalize(embedding: Sequence[float]) -> np.ndarray:
+    v = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+answer_cache = SemanticAnswerCache.from_env()
@@ -0,0 +1,84 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from openai import OpenAI
+from core.embeddings import get_embeddings
+from core.presets import INTENT_EXAMPLES
+
+
+class PrototypeClassifier:
+    # Nearest-prototype intent classifier over query embeddings
+    def __init__(self, examples: Dict[str, List[str]] = INTENT_EXAMPLES) -> None:
+        self.examples = examples
+        self.labels: List[str] = list(examples)
+        self._prototypes: Optional[np.ndarray] = None
+        self._owners: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def build(self, client: OpenAI, index: object = None) -> None:
+        texts: List[str] = []
+        owners: List[int] = []
+        for i, label in enumerate(self.labels):
+            texts.append(label.replace("_", " "))
+            owners.append(i)
+            for example in self.examples[label]:
+                texts.append(example)
+                owners.append(i)
+
+        vectors = get_embeddings(client, texts)
+        centroid = getattr(index, "centroid", None)
+        if callable(centroid):
+            for i, label in enumerate(self.labels):
+                vector = centroid(label)
+                # Namespaces storing shortened vectors cannot join full-width prototypes
+                if vector and len(vector) == len(vectors[0]):
+                    vectors.append(vector)
+                    owners.append(i)
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+
+        order = np.argsort(np.asarray(owners), kind="stable")
+        self._prototypes = matrix[order]
+        self._owners = np.asarray(owners)[order]
+
+    def ensure(self, client: OpenAI, index: object = None) -> None:
+        if self._prototypes is not None:
+            return
+        with self._lock:
+            if self._prototypes is None:
+                self.build(client, index)
+
+    @property
+    def ready(self) -> bool:
+        return self._prototypes is not None
+
+    def rank(self, embedding: List[float]) -> List[str]:
+        order = np.argsort(-self.scores(embedding), kind="stable")
+        return [self.labels[int(i)] for i in order]
+
+    def scores(self, embedding: List[float]) -> np.ndarray:
+        assert self._prototypes is not None and self._owners is not None
+        q = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if norm > 0:
+            q = q / norm
+        sims = self._prototypes @ q
+        starts = np.flatnonzero(np.r_[True, self._owners[1:] != self._owners[:-1]])
+        return np.maximum.reduceat(sims, starts)
+
+    def classify(
+        self, embedding: List[float], min_margin: float
+    ) -> Tuple[Optional[str], float]:
+        label_scores = self.scores(embedding)
+        if len(label_scores) < 2:
+            return self.labels[int(np.argmax(label_scores))], float("inf")
+        second, best = np.argpartition(label_scores, -2)[-2:]
+        margin = float(label_scores[best] - label_scores[second])
+        if margin < min_margin:
+            return None, margin
+        return self.labels[int(best)], margin
+
+
+intent_classifier = PrototypeClassifier()
@@ -0,0 +1,27 @@
+import os
+import threading
+from typing import Optional
+from openai import AsyncOpenAI, OpenAI
+
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+
+
+def get_openai_client() -> OpenAI:
+    # Built on first use, so importing the app or tooling needs no credentials
+    global _client
+    with _client_lock:
+        if _client is None:
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                raise RuntimeError(
+                    "Missing required environment variable(s): OPENAI_API_KEY"
+                )
+            # core.ratelimit is the only retry layer: SDK retries would bypass the
+            # shared limiter, its 429 throttling and Retry-After handling
+            _client = OpenAI(api_key=api_key, max_retries=0)
+            from agents import set_default_openai_client
+
+            set_default_openai_client(AsyncOpenAI(api_key=api_key, max_retries=0))
+        return _client
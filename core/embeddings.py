@@ -1,11 +1,100 @@
-from typing import List
+import functools
+from typing import Iterator, List, Sequence
+import numpy as np
 from openai import OpenAI
+from core.ratelimit import BACKGROUND, INTERACTIVE, call_with_retry, get_limiter
+from core.utils import env_int, estimate_tokens, namespace_env
 
 
-def get_embedding(client: OpenAI, text: str) -> List[float]:
-    emb = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text,
-        dimensions=1536,
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+
+# OpenAI accepts up to 2048 inputs and 300k tokens per embeddings request
+MAX_BATCH_ITEMS = 512
+MAX_BATCH_TOKENS = 250_000
+
+
+def embedding_dimensions(namespace: str) -> int:
+    # Width stored in a namespace, e.g. EMBEDDING_DIMENSIONS_HOTEL_POLICIES=256
+    default = env_int("EMBEDDING_DIMENSIONS", EMBEDDING_DIMENSIONS)
+    dimensions = env_int(namespace_env("EMBEDDING_DIMENSIONS", namespace), default)
+    return min(EMBEDDING_DIMENSIONS, max(1, dimensions))
+
+
+def shorten_embedding(embedding: Sequence[float], dimensions: int) -> List[float]:
+    # text-embedding-3 vectors keep their meaning when truncated and renormalized,
+    # so one full-width embedding serves every namespace
+    if len(embedding) <= dimensions:
+        return list(embedding)
+    vector = np.asarray(embedding[:dimensions], dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector /= norm
+    return vector.tolist()
+
+
+def get_embedding(
+    client: OpenAI, text: str, priority: str = INTERACTIVE
+) -> List[float]:
+    emb = call_with_retry(
+        get_limiter("embeddings"),
+        lambda: client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=text,
+            dimensions=EMBEDDING_DIMENSIONS,
+        ),
+        estimate_tokens(text),
+        priority,
     )
     return emb.data[0].embedding
+
+
+def _pack_batches(
+    texts: Sequence[str], max_items: int, max_tokens: int
+) -> Iterator[List[int]]:
+    batch: List[int] = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _embed_batch(client: OpenAI, inputs: List[str]) -> List[List[float]]:
+    emb = client.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=inputs,
+        dimensions=EMBEDDING_DIMENSIONS,
+    )
+    data = sorted(emb.data, key=lambda d: d.index)
+    if len(data) != len(inputs):
+        raise RuntimeError(
+            f"Embedding response has {len(data)} item(s), expected {len(inputs)}"
+        )
+    return [d.embedding for d in data]
+
+
+def get_embeddings(
+    client: OpenAI,
+    texts: Sequence[str],
+    max_items: int = MAX_BATCH_ITEMS,
+    max_tokens: int = MAX_BATCH_TOKENS,
+    priority: str = BACKGROUND,
+) -> List[List[float]]:
+    results: List[List[float]] = [[] for _ in texts]
+    for batch in _pack_batches(texts, max_items, max_tokens):
+        inputs = [texts[i] for i in batch]
+        vectors = call_with_retry(
+            get_limiter("embeddings"),
+            functools.partial(_embed_batch, client, inputs),
+            sum(estimate_tokens(text) for text in inputs),
+            priority,
+        )
+        for i, vector in zip(batch, vectors):
+            results[i] = vector
+    return results
@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+from core.utils import env_float, env_int
+
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+METRIC_PREFIX = "rag_"
+
+T = TypeVar("T")
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+logger = logging.getLogger(__name__)
+
+# Per-stage token tally of the current task and the tasks it starts, see count_tokens
+_token_tally: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    "token_tally", default=None
+)
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th observation; None past the last bucket
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+class _Span:
+    # Labels may be filled in while the span runs, e.g. the intent once it is known
+    def __init__(self, metrics: "Metrics", name: str, labels: Dict[str, str]) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> Dict[str, str]:
+        self.started = time.perf_counter()
+        return self.labels
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.metrics.observe(
+            self.name, time.perf_counter() - self.started, **self.labels
+        )
+
+
+class Metrics:
+    # In-process histograms and counters behind one lock; cheap enough to stay on
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: Dict[_Key, _Histogram] = {}
+        self._counters: Dict[_Key, float] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, object]) -> _Key:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                buckets = TOKEN_BUCKETS if name.endswith("_tokens") else LATENCY_BUCKETS
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        if not amount:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def span(self, name: str, **labels) -> _Span:
+        return _Span(self, name, {k: str(v) for k, v in labels.items()})
+
+    def timed(self, items: Iterable[T], name: str, **labels) -> Iterator[T]:
+        # Times how long each item of a lazy iterable takes to produce
+        iterator = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - started, **labels)
+            yield item
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            histograms = [
+                (key, h.count, h.total, [h.quantile(q) for q in (0.5, 0.95, 0.99)])
+                for key, h in self._histograms.items()
+            ]
+            counters = list(self._counters.items())
+
+        stats: dict = {"histograms": {}, "counters": {}}
+        for (name, labels), count, total, (p50, p95, p99) in sorted(histograms):
+            stats["histograms"].setdefault(name, []).append(
+                {
+                    "labels": dict(labels),
+                    "count": count,
+                    "sum": total,
+                    "mean": total / count if count else 0.0,
+                    "p50": p50,
+                    "p95": p95,
+                    "p99": p99,
+                }
+            )
+        for (name, labels), value in sorted(counters):
+            stats["counters"].setdefault(name, []).append(
+                {"labels": dict(labels), "value": value}
+            )
+        return stats
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            histograms = [
+                (key, h.buckets, list(h.counts), h.total, h.count)
+                for key, h in self._histograms.items()
+            ]
+            counters = list(self._counters.items())
+
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), buckets, counts, total, count in sorted(histograms):
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip((*buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = _format_labels(labels + (("le", str(bound)),))
+                lines.append(f"{metric}_bucket{le} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+        for (name, labels), value in sorted(counters):
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"time": time.time(), **self.snapshot()}, f)
+        os.replace(tmp, path)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def count_tokens() -> Iterator[Dict[str, int]]:
+    # Attributes token usage to one unit of work, e.g. a single question of a batch
+    tally: Dict[str, int] = {}
+    token = _token_tally.set(tally)
+    try:
+        yield tally
+    finally:
+        _token_tally.reset(token)
+
+
+def add_tokens(stage: str, tokens: int) -> None:
+    tally = _token_tally.get()
+    if tally is not None:
+        tally[stage] = tally.get(stage, 0) + tokens
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] == "/metrics":
+            body = metrics.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path.split("?")[0] == "/stats":
+            body = json.dumps(metrics.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        return
+
+
+def start_metrics_exporter() -> Optional[ThreadingHTTPServer]:
+    # METRICS_PORT serves /metrics and /stats; METRICS_FILE is rewritten every METRICS_INTERVAL
+    server = None
+    port = env_int("METRICS_PORT", 0)
+    if port > 0:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        threading.Thread(
+            target=server.serve_forever, name="metrics-http", daemon=True
+        ).start()
+        logger.info(f"Metrics served on port {port}")
+
+    path = os.environ.get("METRICS_FILE")
+    if path:
+        interval = max(1.0, env_float("METRICS_INTERVAL", 15.0))
+
+        def write_forever() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    metrics.write_json(path)
+                except OSError as ex:
+                    logger.warning(f"Writing {path} failed: {ex}")
+
+        threading.Thread(target=write_forever, name="metrics-file", daemon=True).start()
+    return server
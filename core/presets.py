@@ -1,5 +1,4 @@
-from typing import Dict
-from agents import RunConfig
+from typing import Dict, List, Optional, Sequence, Tuple
 
 
 ENHANCER_PROMPTS: Dict[str, str] = {
@@ -37,6 +36,14 @@ INSTRUCTION_CLASSIFIER = (
     "Return ONLY the category name, without any explanation or additional text."
 )
 
+INSTRUCTION_CLASSIFIER_BATCH = (
+    "You are an expert at classifying hotel-related queries.\n"
+    "Classify every given query into exactly one of the following categories: "
+    "general_hotel_information, room_services, hotel_policies, local_hotel_information, hotel_facilities, other_unrelated.\n"
+    'Respond with JSON only: {"queries": [{"id": <query id>, "category": "<category name>"}, ...]}, '
+    "with exactly one entry per query, in the order the queries were given."
+)
+
 SITUATE_SYSTEM_PROMPT = (
     "You generate a single, succinct line that situates a chunk within its full document "
     "to improve search retrieval. Output must be strictly: [succinct context] : [original chunk or corrected version]. "
@@ -46,6 +53,62 @@ SITUATE_SYSTEM_PROMPT = (
     "Do not add any explanations beyond the required output."
 )
 
+# Labeled queries used to build local classifier prototypes
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    "general_hotel_information": [
+        "Tell me about the hotel",
+        "How many stars does the hotel have?",
+        "What is the hotel's phone number?",
+        "When was the hotel built?",
+    ],
+    "room_services": [
+        "Can I order room service at night?",
+        "How do I request extra towels?",
+        "Is housekeeping daily?",
+        "Can I get breakfast delivered to my room?",
+    ],
+    "hotel_policies": [
+        "What time is checkout?",
+        "Are pets allowed?",
+        "What is the cancellation policy?",
+        "Is smoking allowed in the rooms?",
+    ],
+    "local_hotel_information": [
+        "What restaurants are near the hotel?",
+        "How far is the airport?",
+        "What attractions are nearby?",
+        "Is there a pharmacy close to the hotel?",
+    ],
+    "hotel_facilities": [
+        "What are the pool hours?",
+        "Does the hotel have a gym?",
+        "Is there free parking?",
+        "Do you have a spa?",
+    ],
+    "other_unrelated": [
+        "Write me a poem about the sea",
+        "What is the capital of France?",
+        "Help me fix my Python code",
+        "Who won the football match yesterday?",
+    ],
+}
+
+SITUATE_BATCH_SYSTEM_PROMPT = (
+    "You situate several chunks of a document at once to improve search retrieval. "
+    "For every chunk, write a single line: [succinct context] : [original chunk or corrected version]. "
+    "If a chunk contains an incomplete number, percentage, or entity, correct it using the document. "
+    "If a sentence is cut off, reconstruct only what is necessary for clarity. "
+    "If a chunk is part of a table, include the complete table entry. "
+    'Respond with JSON only: {"chunks": [{"id": <chunk id>, "situated": "<line>"}, ...]}, '
+    "with exactly one entry per chunk, in the order the chunks were given."
+)
+
+SUMMARIZE_DOCUMENT_PROMPT = (
+    "You summarize documents so that individual chunks of them can later be situated for search retrieval. "
+    "Write a dense summary of at most 200 words covering the document's subject, structure, "
+    "key entities, numbers and policies. Do not add any explanations beyond the summary."
+)
+
 ALLOWED_NAMESPACES = [
     "general_hotel_information",
     "room_services",
@@ -54,11 +117,11 @@ ALLOWED_NAMESPACES = [
     "hotel_facilities",
 ]
 
-# Keep last 5 turns (10 messages) in session history
-SESSION_RUN_CONFIG = RunConfig(
-    session_input_callback=lambda history_items, new_items: (history_items + new_items)[
-        -10:
-    ]
+HISTORY_SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a hotel guest and an assistant. "
+    "Merge the previous summary with the new messages into one updated summary of at most 150 words. "
+    "Keep facts the guest shared, their requests and preferences, and answers they were given. "
+    "Provide ONLY the summary without any explanation."
 )
 
 
@@ -83,8 +146,81 @@ def build_situated_chunk_instructions(document_text: str, chunk: str) -> str:
     )
 
 
+def build_situated_chunk_window_instructions(
+    summary: str, before: str, chunk: str, after: str
+) -> str:
+    # Summary first: the stable prefix lets the provider cache it across chunks
+    return (
+        "<document_summary>\n"
+        f"{summary.strip()}\n</document_summary>\n\n"
+        "Here is the text right before the chunk:\n\n"
+        "<before>\n"
+        f"{before.strip()}\n</before>\n\n"
+        "Here is the chunk we want to situate within the overall document:\n\n"
+        "<chunk>\n"
+        f"{chunk.strip()}\n</chunk>\n\n"
+        "Here is the text right after the chunk:\n\n"
+        "<after>\n"
+        f"{after.strip()}\n</after>\n\n"
+        "Please:\n"
+        "- Provide a short and succinct context to situate this chunk within the document for improved search retrieval.\n"
+        "- Return the original chunk exactly as provided unless a correction is necessary.\n"
+        "- If the chunk contains an incomplete number, percentage, or entity, correct it using the surrounding text.\n"
+        "- If part of a sentence is cut off, reconstruct the missing words only if necessary for clarity.\n"
+        "- If the chunk is part of a table, include the complete table entry to maintain data integrity\n"
+        "- Do not add any additional explanations or formatting beyond the required output.\n\n"
+        "Fill in the following format:\n"
+        "[succinct context] : [original chunk or corrected version if necessary]"
+    )
+
+
+def build_situated_batch_instructions(
+    chunks: Sequence[Tuple[int, str]],
+    document_text: Optional[str] = None,
+    summary: str = "",
+    before: str = "",
+    after: str = "",
+) -> str:
+    # Either the full document, or the window strategy's summary and neighbours
+    if document_text is not None:
+        context = f"<document>\n{document_text.strip()}\n</document>\n\n"
+        trailer = ""
+    else:
+        context = (
+            f"<document_summary>\n{summary.strip()}\n</document_summary>\n\n"
+            "Here is the text right before the first chunk:\n\n"
+            f"<before>\n{before.strip()}\n</before>\n\n"
+        )
+        trailer = (
+            "Here is the text right after the last chunk:\n\n"
+            f"<after>\n{after.strip()}\n</after>\n\n"
+        )
+    pieces = "".join(
+        f'<chunk id="{chunk_id}">\n{text.strip()}\n</chunk>\n\n'
+        for chunk_id, text in chunks
+    )
+    return (
+        f"{context}"
+        "Here are the chunks we want to situate within the overall document:\n\n"
+        f"{pieces}"
+        f"{trailer}"
+        "Please, for every chunk:\n"
+        "- Provide a short and succinct context to situate the chunk within the document for improved search retrieval.\n"
+        "- Return the original chunk exactly as provided unless a correction is necessary.\n"
+        "- Do not merge, split, skip or reorder chunks.\n\n"
+        'Answer with JSON in the form {"chunks": [{"id": <chunk id>, "situated": "[succinct context] : [original chunk]"}]}'
+    )
+
+
 def build_answer_instructions(context: str) -> str:
     return (
         "Use the following context (delimited by <ctx></ctx>) and the chat history to answer the user query.\n"
         f"<ctx>\n{context}\n</ctx>"
     )
+
+
+def build_classifier_batch_input(queries: Sequence[Tuple[int, str]]) -> str:
+    return "".join(
+        f'<query id="{query_id}">\n{text.strip()}\n</query>\n\n'
+        for query_id, text in queries
+    ).rstrip()
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+from openai import APIConnectionError, APITimeoutError
+from core.metrics import metrics
+from core.utils import env_float, env_int
+
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+# Completion tokens charged per request until the real usage is known
+COMPLETION_ESTIMATE = 256
+RETRYABLE_STATUSES = (408, 409, 429)
+
+# Requests and tokens per minute for each OpenAI API; 0 disables a bucket
+_LIMIT_DEFAULTS = {"chat": (500, 200_000), "embeddings": (3_000, 1_000_000)}
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Checked while a call waits for quota, e.g. whether its upload job was cancelled
+_stop_check: ContextVar[Optional[Callable[[], bool]]] = ContextVar(
+    "ratelimit_stop_check", default=None
+)
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+@contextmanager
+def stop_waiting_when(should_stop: Callable[[], bool]) -> Iterator[None]:
+    # Calls made inside give up with RequestCancelled instead of waiting for quota
+    token = _stop_check.set(should_stop)
+    try:
+        yield
+    finally:
+        _stop_check.reset(token)
+
+
+def _raise_if_stopped() -> None:
+    should_stop = _stop_check.get()
+    if should_stop is not None and should_stop():
+        raise RequestCancelled("stopped while waiting for rate limit quota")
+
+
+class _Bucket:
+    def __init__(self, per_minute: float) -> None:
+        self.enabled = per_minute > 0
+        self.capacity = per_minute
+        self.limit = per_minute / 60.0
+        self.rate = self.limit
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount: float, floor: float) -> float:
+        # A request larger than the bucket waits for a full bucket rather than forever
+        amount = min(amount, self.capacity - floor)
+        short = amount + floor - self.level
+        return short / self.rate if short > 0 else 0.0
+
+    def adapt(self, factor: float) -> None:
+        self.rate = min(self.limit, max(self.limit * 0.1, self.rate * factor))
+
+
+class RateLimiter:
+    # Request and token buckets shared by every caller of one API.
+    # Background callers leave a reserve for interactive ones and wait while any is queued.
+    def __init__(self, name: str, rpm: float, tpm: float, reserve: float) -> None:
+        self.name = name
+        self.reserve = min(0.9, max(0.0, reserve))
+        self._requests = _Bucket(rpm)
+        self._tokens = _Bucket(tpm)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self._interactive_waiting = 0
+
+    def _try_acquire(self, tokens: int, priority: str) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            background = priority == BACKGROUND
+            if background and self._interactive_waiting:
+                return 0.05
+            delay = 0.0
+            for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+                if bucket.enabled:
+                    bucket.refill(now)
+                    floor = bucket.capacity * self.reserve if background else 0.0
+                    delay = max(delay, bucket.wait(amount, floor))
+            if delay > 0:
+                return delay
+            self._requests.level -= 1
+            self._tokens.level -= tokens
+            return 0.0
+
+    def _queued(self, priority: str, change: int) -> None:
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._interactive_waiting += change
+
+    def acquire(self, tokens: int, priority: str = INTERACTIVE) -> None:
+        started = time.perf_counter()
+        self._queued(priority, 1)
+        try:
+            _raise_if_stopped()
+            while (delay := self._try_acquire(tokens, priority)) > 0:
+                time.sleep(min(delay, 1.0))
+                _raise_if_stopped()
+        finally:
+            self._queued(priority, -1)
+        self._record_wait(priority, started)
+
+    async def aacquire(self, tokens: int, priority: str = INTERACTIVE) -> None:
+        started = time.perf_counter()
+        self._queued(priority, 1)
+        try:
+            _raise_if_stopped()
+            while (delay := self._try_acquire(tokens, priority)) > 0:
+                await asyncio.sleep(min(delay, 1.0))
+                _raise_if_stopped()
+        finally:
+            self._queued(priority, -1)
+        self._record_wait(priority, started)
+
+    def _record_wait(self, priority: str, started: float) -> None:
+        waited = time.perf_counter() - started
+        if waited > 0.001:
+            metrics.observe(
+                "rate_limit_wait_seconds", waited, api=self.name, priority=priority
+            )
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        # Corrects the token bucket with the real usage and lets a throttled rate recover
+        with self._lock:
+            if actual is not None and self._tokens.enabled:
+                self._tokens.level += estimated - actual
+            self._requests.adapt(1.02)
+            self._tokens.adapt(1.02)
+
+    def throttle(self, delay: float) -> None:
+        # A 429 pauses every caller and lowers the sustained rate until calls succeed again
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self._requests.adapt(0.7)
+            self._tokens.adapt(0.7)
+
+
+def _status(ex: Exception) -> Optional[int]:
+    return getattr(ex, "status_code", None) or getattr(ex, "status", None)
+
+
+def is_transient(ex: Exception) -> bool:
+    # Dropped connections, timeouts and retryable statuses; anything else is raised at once
+    if isinstance(
+        ex, (APIConnectionError, APITimeoutError, ConnectionError, TimeoutError)
+    ):
+        return True
+    status = _status(ex)
+    return isinstance(status, int) and (status in RETRYABLE_STATUSES or status >= 500)
+
+
+def _retry_after(ex: Exception) -> Optional[float]:
+    headers = getattr(getattr(ex, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
+
+
+def _retry_delay(ex: Exception, attempt: int) -> float:
+    hinted = _retry_after(ex)
+    if hinted is not None:
+        return hinted * (1 + 0.1 * random.random())
+    cap = min(
+        env_float("OPENAI_BACKOFF_MAX", 30.0),
+        env_float("OPENAI_BACKOFF_BASE", 1.0) * 2**attempt,
+    )
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+def _retry_in(limiter: RateLimiter, ex: Exception, attempt: int) -> float:
+    # Delay before the next attempt, or -1 to give up
+    last_attempt = max(1, env_int("OPENAI_MAX_ATTEMPTS", 5)) - 1
+    if attempt >= last_attempt or not is_transient(ex):
+        return -1.0
+    delay = _retry_delay(ex, attempt)
+    status = _status(ex)
+    if status == 429:
+        limiter.throttle(delay)
+    metrics.inc("api_retries_total", api=limiter.name, status=status or "error")
+    logger.warning(f"{limiter.name} request failed ({ex}), retrying in {delay:.1f}s")
+    return delay
+
+
+def call_with_retry(
+    limiter: RateLimiter,
+    fn: Callable[[], T],
+    tokens: int,
+    priority: str = INTERACTIVE,
+    usage: Optional[Callable[[T], Optional[int]]] = None,
+) -> T:
+    attempt = 0
+    while True:
+        limiter.acquire(tokens, priority)
+        try:
+            result = fn()
+        except Exception as ex:
+            delay = _retry_in(limiter, ex, attempt)
+            if delay < 0:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.settle(tokens, usage(result) if usage else None)
+        return result
+
+
+async def acall_with_retry(
+    limiter: RateLimiter,
+    fn: Callable[[], Awaitable[T]],
+    tokens: int,
+    priority: str = INTERACTIVE,
+    usage: Optional[Callable[[T], Optional[int]]] = None,
+    on_retry: Optional[Callable[[], None]] = None,
+) -> T:
+    attempt = 0
+    while True:
+        await limiter.aacquire(tokens, priority)
+        try:
+            result = await fn()
+        except Exception as ex:
+            delay = _retry_in(limiter, ex, attempt)
+            if delay < 0:
+                raise
+            if on_retry is not None:
+                on_retry()
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        limiter.settle(tokens, usage(result) if usage else None)
+        return result
+
+
+def response_tokens(response) -> Optional[int]:
+    return getattr(getattr(response, "usage", None), "total_tokens", None)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> RateLimiter:
+    # OPENAI_CHAT_RPM, OPENAI_CHAT_TPM, OPENAI_EMBEDDINGS_RPM, OPENAI_EMBEDDINGS_TPM
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            rpm, tpm = _LIMIT_DEFAULTS[name]
+            prefix = f"OPENAI_{name.upper()}"
+            limiter = _limiters[name] = RateLimiter(
+                name,
+                env_float(f"{prefix}_RPM", rpm),
+                env_float(f"{prefix}_TPM", tpm),
+                env_float("OPENAI_INTERACTIVE_RESERVE", 0.2),
+            )
+        return limiter
@@ -1,23 +1,349 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
 import uuid
-from typing import Optional
-from agents import SQLiteSession
+from typing import List, Optional, Tuple
+from agents import RunConfig, SessionABC, TResponseInputItem
+from core.utils import env_choice, env_float, env_int, estimate_tokens
 
 
-class ChatSession:
-    def __init__(self, session_db: str) -> None:
-        self.session_db = session_db
-        self.session: Optional[SQLiteSession] = None
+SESSION_HISTORY_MODES = ("full", "window")
 
-    def ensure(self) -> SQLiteSession:
-        if self.session is None:
-            session_id = uuid.uuid4().hex
-            self.session = SQLiteSession(session_id, db_path=self.session_db)
-        return self.session
 
-    def reset(self) -> None:
-        self.session = None
+class SessionStore:
+    # Conversation history shared by all users; one WAL connection per thread
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        self._cleanup_lock = threading.Lock()
+        self._last_cleanup = 0.0
+        conn = self._connect()
+        # Same tables as agents.SQLiteSession, so existing conversation.db files keep working
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS agent_sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS agent_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message_data TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (session_id) REFERENCES agent_sessions (session_id)
+                    ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS idx_agent_messages_session_id
+                ON agent_messages (session_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_agent_messages_session_order
+                ON agent_messages (session_id, id);
+            CREATE INDEX IF NOT EXISTS idx_agent_sessions_updated_at
+                ON agent_sessions (updated_at);
+            CREATE TABLE IF NOT EXISTS session_summaries (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                summarized_through INTEGER NOT NULL
+            );
+            """
+        )
 
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
 
-def reset_session(chat_session: ChatSession):
-    chat_session.reset()
-    return [], ""
+    def session(self, session_id: Optional[str] = None) -> "StoredSession":
+        self.maybe_cleanup()
+        window = None
+        if (
+            env_choice("SESSION_HISTORY_MODE", "full", SESSION_HISTORY_MODES)
+            == "window"
+        ):
+            window = max(2, env_int("SESSION_HISTORY_ITEMS", 20))
+        return StoredSession(session_id or uuid.uuid4().hex, self, window)
+
+    def load(self, session_id: str, limit: Optional[int]) -> List[TResponseInputItem]:
+        conn = self._connect()
+        if limit is None:
+            rows = conn.execute(
+                "SELECT message_data FROM agent_messages WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT message_data FROM agent_messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+            rows.reverse()
+
+        return _decode(rows)
+
+    def _summary(self, session_id: str) -> Tuple[str, int]:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT summary, summarized_through FROM session_summaries WHERE session_id = ?",
+                (session_id,),
+            )
+            .fetchone()
+        )
+        return (row[0], row[1]) if row else ("", 0)
+
+    def load_window(
+        self, session_id: str, limit: int
+    ) -> Tuple[str, List[TResponseInputItem]]:
+        # Rolling summary plus the newest items it does not cover yet
+        summary, through = self._summary(session_id)
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT message_data FROM agent_messages WHERE session_id = ? AND id > ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, through, limit),
+            )
+            .fetchall()
+        )
+        rows.reverse()
+        return summary, _decode(rows)
+
+    def unsummarized(
+        self, session_id: str, keep: int
+    ) -> Tuple[str, List[TResponseInputItem], int]:
+        # Items older than the newest `keep` that the summary does not cover yet
+        summary, through = self._summary(session_id)
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT id, message_data FROM agent_messages WHERE session_id = ? AND id > ? "
+                "ORDER BY id DESC LIMIT -1 OFFSET ?",
+                (session_id, through, keep),
+            )
+            .fetchall()
+        )
+        if not rows:
+            return summary, [], through
+        rows.reverse()
+        return summary, _decode([(data,) for _, data in rows]), rows[-1][0]
+
+    def save_summary(self, session_id: str, summary: str, through: int) -> None:
+        self._connect().execute(
+            "INSERT INTO session_summaries VALUES (?, ?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET "
+            "summary = excluded.summary, summarized_through = excluded.summarized_through",
+            (session_id, summary, through),
+        )
+
+    def save(self, session_id: str, items: List[TResponseInputItem]) -> None:
+        # A whole turn is written in one transaction
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO agent_sessions (session_id) VALUES (?) "
+                "ON CONFLICT (session_id) DO UPDATE SET updated_at = CURRENT_TIMESTAMP",
+                (session_id,),
+            )
+            conn.executemany(
+                "INSERT INTO agent_messages (session_id, message_data) VALUES (?, ?)",
+                [(session_id, json.dumps(item)) for item in items],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pop(self, session_id: str) -> Optional[TResponseInputItem]:
+        row = (
+            self._connect()
+            .execute(
+                "DELETE FROM agent_messages WHERE id = ("
+                "SELECT id FROM agent_messages WHERE session_id = ? ORDER BY id DESC LIMIT 1"
+                ") RETURNING message_data",
+                (session_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError:
+            return None
+
+    def clear(self, session_id: str) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM agent_messages WHERE session_id = ?", (session_id,)
+            )
+            conn.execute(
+                "DELETE FROM agent_sessions WHERE session_id = ?", (session_id,)
+            )
+            conn.execute(
+                "DELETE FROM session_summaries WHERE session_id = ?", (session_id,)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cleanup(self, ttl_seconds: float) -> Tuple[int, int]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cutoff = f"-{int(ttl_seconds)} seconds"
+            conn.execute(
+                "DELETE FROM session_summaries WHERE session_id IN ("
+                "SELECT session_id FROM agent_sessions WHERE updated_at < datetime('now', ?))",
+                (cutoff,),
+            )
+            messages = conn.execute(
+                "DELETE FROM agent_messages WHERE session_id IN ("
+                "SELECT session_id FROM agent_sessions WHERE updated_at < datetime('now', ?))",
+                (cutoff,),
+            ).rowcount
+            sessions = conn.execute(
+                "DELETE FROM agent_sessions WHERE updated_at < datetime('now', ?)",
+                (cutoff,),
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return sessions, messages
+
+    def maybe_cleanup(self) -> None:
+        # Idle sessions are expired at most once per SESSION_CLEANUP_INTERVAL
+        ttl = env_float("SESSION_TTL", 7 * 24 * 3600.0)
+        interval = env_float("SESSION_CLEANUP_INTERVAL", 600.0)
+        now = time.monotonic()
+        with self._cleanup_lock:
+            if ttl <= 0 or (self._last_cleanup and now - self._last_cleanup < interval):
+                return
+            self._last_cleanup = now
+        threading.Thread(
+            target=self.cleanup, args=(ttl,), name="session-cleanup", daemon=True
+        ).start()
+
+
+class StoredSession(SessionABC):
+    # Items added during a turn are buffered and written together by flush().
+    # With a window, the full history read by the Runner is the summary plus recent items.
+    def __init__(
+        self, session_id: str, store: SessionStore, window: Optional[int] = None
+    ) -> None:
+        self.session_id = session_id
+        self.store = store
+        self.window = window
+        self._pending: List[TResponseInputItem] = []
+
+    async def get_items(self, limit: Optional[int] = None) -> List[TResponseInputItem]:
+        if limit is None and self.window is not None:
+            summary, items = await asyncio.to_thread(
+                self.store.load_window, self.session_id, self.window
+            )
+            prefix = [summary_item(summary)] if summary else []
+            return prefix + items + list(self._pending)
+        if limit is not None and limit <= len(self._pending):
+            return list(self._pending[len(self._pending) - limit :])
+        stored_limit = None if limit is None else limit - len(self._pending)
+        stored = await asyncio.to_thread(self.store.load, self.session_id, stored_limit)
+        return stored + list(self._pending)
+
+    async def add_items(self, items: List[TResponseInputItem]) -> None:
+        self._pending.extend(items)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def discard_pending(self, keep: int) -> None:
+        # Drops items buffered by a run that failed and is about to be retried
+        del self._pending[keep:]
+
+    async def pop_item(self) -> Optional[TResponseInputItem]:
+        if self._pending:
+            return self._pending.pop()
+        return await asyncio.to_thread(self.store.pop, self.session_id)
+
+    async def clear_session(self) -> None:
+        self._pending = []
+        await asyncio.to_thread(self.store.clear, self.session_id)
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        items, self._pending = self._pending, []
+        await asyncio.to_thread(self.store.save, self.session_id, items)
+
+
+def _decode(rows: List[tuple]) -> List[TResponseInputItem]:
+    items = []
+    for (message_data,) in rows:
+        try:
+            items.append(json.loads(message_data))
+        except json.JSONDecodeError:
+            continue
+    return items
+
+
+def summary_item(summary: str) -> TResponseInputItem:
+    return {
+        "role": "developer",
+        "content": f"Summary of the earlier conversation:\n{summary}",
+    }
+
+
+def _item_tokens(item: TResponseInputItem) -> int:
+    content = item.get("content") if isinstance(item, dict) else None
+    return estimate_tokens(content if isinstance(content, str) else json.dumps(item))
+
+
+def _is_pinned(item: TResponseInputItem) -> bool:
+    return isinstance(item, dict) and item.get("role") == "developer"
+
+
+def fit_history_to_budget(
+    history_items: List[TResponseInputItem], new_items: List[TResponseInputItem]
+) -> List[TResponseInputItem]:
+    # Newest history first until SESSION_HISTORY_TOKENS; the summary is always kept
+    budget = env_int("SESSION_HISTORY_TOKENS", 2000)
+    pinned = [i for i in history_items if _is_pinned(i)]
+    budget -= sum(_item_tokens(i) for i in pinned)
+    kept: List[TResponseInputItem] = []
+    for item in reversed(history_items):
+        if _is_pinned(item):
+            continue
+        budget -= _item_tokens(item)
+        if budget < 0:
+            break
+        kept.append(item)
+    kept.reverse()
+    return pinned + kept + new_items
+
+
+# Keep last 5 turns (10 messages) in session history
+SESSION_RUN_CONFIG = RunConfig(
+    session_input_callback=lambda history_items, new_items: (history_items + new_items)[
+        -10:
+    ]
+)
+
+# Window mode: summary plus as many recent items as fit SESSION_HISTORY_TOKENS
+WINDOW_SESSION_RUN_CONFIG = RunConfig(session_input_callback=fit_history_to_budget)
+
+
+async def reset_session(session_id: Optional[str], store: SessionStore):
+    if session_id:
+        await asyncio.to_thread(store.clear, session_id)
+    return [], "", None
@@ -1,6 +1,11 @@
 import os
 import retrieval.models as models
-from typing import Optional, Sequence
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, rounded up
+    return len(text) // 4 + 1
 
 
 def _extract_page_content(meta: models.Metadata | None) -> Optional[str]:
@@ -13,24 +18,178 @@ def _extract_page_content(meta: models.Metadata | None) -> Optional[str]:
     return None
 
 
-def build_context(matches: Sequence[models.Match]) -> str:
-    parts: list[str] = []
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+
+class PackedContext(NamedTuple):
+    text: str
+    tokens: int
+    raw_tokens: int
+    matches: int
+    passages: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.raw_tokens - self.tokens)
+
+
+def _line_range(meta: dict) -> Optional[Tuple[int, int]]:
+    start, end = meta.get("loc.lines.from"), meta.get("loc.lines.to")
+    if isinstance(start, int) and isinstance(end, int):
+        return start, end
+    return None
+
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = text.lower().split()
+    return {tuple(words[i : i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _overlap(left: str, right: str, minimum: int = 20) -> int:
+    # Length of the longest end of left that right starts with, e.g. chunk overlap
+    probe = right[:minimum]
+    if len(probe) < minimum:
+        return 0
+    at = left.find(probe, max(0, len(left) - len(right)))
+    while at != -1:
+        if right.startswith(left[at:]):
+            return len(left) - at
+        at = left.find(probe, at + 1)
+    return 0
+
+
+def _merge_spans(passages: List[list]) -> List[list]:
+    # Passages are [score, file, (line_from, line_to), text]; same-file spans that
+    # overlap or touch become one passage. Line ranges only say where to look: a
+    # passage is dropped only when its text is already there, and overlapping text
+    # is kept once. Chunks of one long line share a range but not their text.
+    merged: List[list] = []
+    by_file: Dict[str, List[list]] = {}
+    for passage in passages:
+        if passage[1] is None:
+            merged.append(passage)
+        else:
+            by_file.setdefault(passage[1], []).append(passage)
+
+    for group in by_file.values():
+        group.sort(key=lambda p: p[2])
+        current = list(group[0])
+        for score, _, (start, end), text in group[1:]:
+            if start > current[2][1] + 1:
+                merged.append(current)
+                current = [score, current[1], (start, end), text]
+                continue
+            if current[3] in text:
+                current[3] = text
+            elif text not in current[3]:
+                shared = _overlap(current[3], text)
+                current[3] = (
+                    current[3] + text[shared:] if shared else f"{current[3]}\n{text}"
+                )
+            current[2] = (current[2][0], max(current[2][1], end))
+            current[0] = max(current[0], score)
+        merged.append(current)
+    return merged
+
+
+def pack_context(
+    matches: Sequence[models.Match],
+    token_budget: int = 0,
+    similarity: float = 0.8,
+) -> PackedContext:
+    passages: List[list] = []
     for m in matches:
         meta = m.get("metadata") if isinstance(m, dict) else None
         text = _extract_page_content(meta)
-        if text:
-            parts.append(text)
-    return "\n\n---\n\n".join(parts)
+        if not text:
+            continue
+        lines = _line_range(meta)
+        file = meta.get("file") if lines and isinstance(meta.get("file"), str) else None
+        passages.append([float(m.get("score") or 0.0), file, lines, text])
+    raw_tokens = sum(estimate_tokens(p[3]) for p in passages)
+
+    # Best passages first; one mostly covered by better passages is a near-duplicate
+    kept: List[list] = []
+    covered: Set[Tuple[str, ...]] = set()
+    for passage in sorted(_merge_spans(passages), key=lambda p: -p[0]):
+        shingles = _shingles(passage[3])
+        if len(shingles & covered) < similarity * len(shingles):
+            kept.append(passage)
+            covered |= shingles
+
+    parts: List[str] = []
+    used = 0
+    for passage in kept:
+        cost = estimate_tokens(passage[3])
+        if token_budget > 0 and used + cost > token_budget:
+            if not parts:
+                # Never return an empty context because the best passage is too long;
+                # it is cut at a word boundary to the longest text within the budget
+                cut = passage[3][: token_budget * 4 - 1]
+                if cut != passage[3] and " " in cut:
+                    cut = cut[: cut.rindex(" ")]
+                parts.append(cut.rstrip())
+                used = estimate_tokens(parts[0])
+            continue
+        parts.append(passage[3])
+        used += cost
+
+    text = CONTEXT_SEPARATOR.join(parts)
+    return PackedContext(
+        text=text,
+        tokens=used,
+        raw_tokens=raw_tokens,
+        matches=len(matches),
+        passages=len(parts),
+    )
+
+
+def build_context(matches: Sequence[models.Match], token_budget: int = 0) -> str:
+    return pack_context(matches, token_budget).text
+
+
+def env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} must be an integer, got {raw!r}") from exc
+
+
+def env_float(name: str, default: float) -> float:
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} must be a number, got {raw!r}") from exc
+
+
+def namespace_env(name: str, namespace: str) -> str:
+    # Name of the variable overriding a setting for one namespace
+    return f"{name}_{namespace.upper()}"
+
+
+def env_choice(name: str, default: str, choices: Sequence[str]) -> str:
+    value = (os.environ.get(name) or default).strip().lower()
+    if value not in choices:
+        joined = ", ".join(choices)
+        raise RuntimeError(f"{name} must be one of: {joined}, got {value!r}")
+    return value
 
 
 def ensure_environment_ready() -> None:
     missing = []
     if not os.environ.get("OPENAI_API_KEY"):
         missing.append("OPENAI_API_KEY")
-    if not os.environ.get("PINECONE_API_KEY"):
-        missing.append("PINECONE_API_KEY")
-    if not os.environ.get("PINECONE_INDEX"):
-        missing.append("PINECONE_INDEX")
+    if env_choice("VECTOR_BACKEND", "pinecone", ("pinecone", "local")) == "pinecone":
+        if not os.environ.get("PINECONE_API_KEY"):
+            missing.append("PINECONE_API_KEY")
+        if not os.environ.get("PINECONE_INDEX"):
+            missing.append("PINECONE_INDEX")
 
     if missing:
         joined = ", ".join(sorted(missing))
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+from core.clients import get_openai_client
+from core.metrics import metrics, start_metrics_exporter
+from core.session import SessionStore
+from core.utils import ensure_environment_ready
+from ingest.uploader import uploader
+from main import _run_turn
+from retrieval.index import index_manager
+
+
+# Serves chat turns and uploads over HTTP/JSON without loading Gradio
+MAX_BODY_BYTES = 10_000_000
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class HeadlessApp:
+    def __init__(self, session_db: str) -> None:
+        self.sessions = SessionStore(session_db)
+
+    async def chat(self, payload: dict) -> dict:
+        message = payload.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise ValueError("message is required")
+        session = self.sessions.session(payload.get("session_id") or None)
+        started = time.perf_counter()
+        answer = await _run_turn(session, message.strip(), get_openai_client())
+        return {
+            "session_id": session.session_id,
+            "answer": answer,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    async def upload(self, payload: dict) -> dict:
+        # Files arrive as {"name", "text"} objects; the server never reads caller-chosen paths
+        files = payload.get("files")
+        if not isinstance(files, list) or not files:
+            raise ValueError("files must be a non-empty list of {name, text} objects")
+        with tempfile.TemporaryDirectory(prefix="upload-") as tmp:
+            paths: List[str] = []
+            for pos, item in enumerate(files):
+                if not isinstance(item, dict) or not isinstance(item.get("text"), str):
+                    raise ValueError("every file needs a text field")
+                name = Path(str(item.get("name") or f"file{pos}.txt")).name
+                path = Path(tmp) / str(pos) / name
+                path.parent.mkdir()
+                path.write_text(item["text"], encoding="utf-8")
+                paths.append(str(path))
+            log = await asyncio.to_thread(
+                uploader, payload.get("namespace"), paths, get_openai_client()
+            )
+        return {"log": log}
+
+    async def reset(self, payload: dict) -> dict:
+        session_id = payload.get("session_id")
+        if not isinstance(session_id, str) or not session_id:
+            raise ValueError("session_id is required")
+        await asyncio.to_thread(self.sessions.clear, session_id)
+        return {"session_id": session_id}
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, str, str]:
+        if path == "/health":
+            return 200, "application/json", json.dumps({"status": "ok"})
+        if path == "/metrics":
+            return 200, "text/plain; version=0.0.4", metrics.render_prometheus()
+
+        handlers = {"/chat": self.chat, "/upload": self.upload, "/reset": self.reset}
+        handler = handlers.get(path)
+        if handler is None:
+            return _error(404, f"unknown path {path}")
+        if method != "POST":
+            return _error(405, f"{path} expects POST")
+        try:
+            payload = json.loads(body or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("body must be a JSON object")
+            result = await handler(payload)
+        except ValueError as ex:
+            return _error(400, str(ex))
+        except Exception as ex:
+            logger.exception(f"{path} failed")
+            return _error(500, str(ex))
+        return 200, "application/json", json.dumps(result)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # One request per connection, which is all the clients of this API need
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0].upper(), request_line[1].split("?")[0]
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY_BYTES:
+                status, content_type, text = _error(413, "request body too large")
+            else:
+                body = await reader.readexactly(length) if length else b""
+                status, content_type, text = await self.route(method, path, body)
+            data = text.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1")
+                + data
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def _error(status: int, message: str) -> Tuple[int, str, str]:
+    return status, "application/json", json.dumps({"error": message})
+
+
+async def _serve(host: str, port: int, session_db: str) -> None:
+    app = HeadlessApp(session_db)
+    server = await asyncio.start_server(app.handle, host, port)
+    logger.info(f"Headless API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Run chat turns and uploads without the Gradio UI."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="serve a JSON HTTP API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--session-db", default="conversation.db")
+    ask = commands.add_parser("ask", help="answer one message and print JSON")
+    ask.add_argument("message")
+    ask.add_argument("--session-id")
+    ask.add_argument("--session-db", default="conversation.db")
+    upload = commands.add_parser("upload", help="upload .txt files to a namespace")
+    upload.add_argument("namespace")
+    upload.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        ensure_environment_ready()
+        start_metrics_exporter()
+        if not index_manager.warm():
+            logger.warning("Vector index unavailable, answers will have no context")
+        asyncio.run(_serve(args.host, args.port, args.session_db))
+    elif args.command == "ask":
+        app = HeadlessApp(args.session_db)
+        payload = {"message": args.message, "session_id": args.session_id}
+        print(json.dumps(asyncio.run(app.chat(payload)), indent=2))
+    else:
+        print(uploader(args.namespace, args.files, get_openai_client()))
+
+
+if __name__ == "__main__":
+    main()
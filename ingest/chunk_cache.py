@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+
+def content_hash(text: str, size: int = 16) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=size).hexdigest()
+
+
+class ChunkCache:
+    # Situated chunks, their embeddings, the vectors stored per file and the BM25 terms
+    # each vector added to the namespace statistics, persisted in SQLite
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS situated_chunks (
+                    doc_hash TEXT NOT NULL,
+                    chunk_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (doc_hash, chunk_hash, model)
+                );
+                CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                    text_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (text_hash, model)
+                );
+                CREATE TABLE IF NOT EXISTS file_vectors (
+                    namespace TEXT NOT NULL,
+                    file TEXT NOT NULL,
+                    vector_id TEXT NOT NULL,
+                    line_from INTEGER NOT NULL,
+                    line_to INTEGER NOT NULL,
+                    PRIMARY KEY (namespace, file, vector_id)
+                );
+                CREATE TABLE IF NOT EXISTS vector_terms (
+                    namespace TEXT NOT NULL,
+                    vector_id TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    terms TEXT NOT NULL,
+                    PRIMARY KEY (namespace, vector_id)
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _query(self, sql: str, params: Sequence) -> List[tuple]:
+        with self._lock, self._connect() as conn:
+            return conn.execute(sql, tuple(params)).fetchall()
+
+    def _write(self, sql: str, rows: Sequence[tuple]) -> None:
+        if not rows:
+            return
+        with self._lock, self._connect() as conn:
+            conn.executemany(sql, rows)
+
+    def get_situated(
+        self, doc_hash: str, chunk_hashes: Sequence[str], model: str
+    ) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(chunk_hashes), 500):
+            part = chunk_hashes[start : start + 500]
+            marks = ",".join("?" * len(part))
+            found.update(
+                self._query(
+                    "SELECT chunk_hash, text FROM situated_chunks "
+                    f"WHERE doc_hash = ? AND model = ? AND chunk_hash IN ({marks})",
+                    [doc_hash, model, *part],
+                )
+            )
+        return found
+
+    def put_situated(
+        self, doc_hash: str, model: str, items: Sequence[Tuple[str, str]]
+    ) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO situated_chunks VALUES (?, ?, ?, ?)",
+            [(doc_hash, chunk_hash, model, text) for chunk_hash, text in items],
+        )
+
+    def get_embeddings(
+        self, texts: Sequence[str], model: str
+    ) -> List[Optional[List[float]]]:
+        hashes = [content_hash(text) for text in texts]
+        found: Dict[str, bytes] = {}
+        for start in range(0, len(hashes), 500):
+            part = hashes[start : start + 500]
+            marks = ",".join("?" * len(part))
+            found.update(
+                self._query(
+                    "SELECT text_hash, vector FROM chunk_embeddings "
+                    f"WHERE model = ? AND text_hash IN ({marks})",
+                    [model, *part],
+                )
+            )
+        return [
+            np.frombuffer(found[h], dtype=np.float32).tolist() if h in found else None
+            for h in hashes
+        ]
+
+    def put_embeddings(
+        self,
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        model: str,
+    ) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO chunk_embeddings VALUES (?, ?, ?)",
+            [
+                (content_hash(text), model, np.asarray(e, np.float32).tobytes())
+                for text, e in zip(texts, embeddings)
+            ],
+        )
+
+    def manifest(self, namespace: str, file: str) -> Dict[str, Tuple[int, int]]:
+        rows = self._query(
+            "SELECT vector_id, line_from, line_to FROM file_vectors "
+            "WHERE namespace = ? AND file = ?",
+            [namespace, file],
+        )
+        return {
+            vector_id: (line_from, line_to) for vector_id, line_from, line_to in rows
+        }
+
+    def record(
+        self, namespace: str, file: str, entries: Sequence[Tuple[str, int, int]]
+    ) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO file_vectors VALUES (?, ?, ?, ?, ?)",
+            [(namespace, file, *entry) for entry in entries],
+        )
+
+    def forget(self, namespace: str, file: str, vector_ids: Sequence[str]) -> None:
+        self._write(
+            "DELETE FROM file_vectors WHERE namespace = ? AND file = ? AND vector_id = ?",
+            [(namespace, file, vector_id) for vector_id in vector_ids],
+        )
+
+    def put_terms(
+        self, namespace: str, entries: Sequence[Tuple[str, Tuple[int, List[int]]]]
+    ) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO vector_terms VALUES (?, ?, ?, ?)",
+            [
+                (namespace, vector_id, length, json.dumps(terms))
+                for vector_id, (length, terms) in entries
+            ],
+        )
+
+    def pop_terms(
+        self, namespace: str, vector_ids: Sequence[str]
+    ) -> Dict[str, Tuple[int, List[int]]]:
+        found: Dict[str, Tuple[int, List[int]]] = {}
+        for start in range(0, len(vector_ids), 500):
+            part = vector_ids[start : start + 500]
+            marks = ",".join("?" * len(part))
+            rows = self._query(
+                "SELECT vector_id, length, terms FROM vector_terms "
+                f"WHERE namespace = ? AND vector_id IN ({marks})",
+                [namespace, *part],
+            )
+            for vector_id, length, terms in rows:
+                found[vector_id] = (length, json.loads(terms))
+        self._write(
+            "DELETE FROM vector_terms WHERE namespace = ? AND vector_id = ?",
+            [(namespace, vector_id) for vector_id in found],
+        )
+        return found
+
+
+_cache: Optional[ChunkCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_chunk_cache() -> ChunkCache:
+    global _cache
+    db_path = os.environ.get("INGEST_CACHE_DB") or "ingest_cache.db"
+    with _cache_lock:
+        if _cache is None or _cache.db_path != db_path:
+            _cache = ChunkCache(db_path)
+        return _cache
@@ -0,0 +1,173 @@
+import io
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional, TextIO
+
+
+BLOCK_SIZE = 1 << 20
+
+
+class ChunkSpan(NamedTuple):
+    text: str
+    start: int
+    end: int
+    line_from: int
+    line_to: int
+
+
+def _find_split_point(s: str, preferred_at: int) -> Optional[int]:
+    split_point = s.rfind("\n\n", 0, preferred_at)
+    if split_point != -1:
+        return split_point
+    split_point = s.rfind(". ", 0, preferred_at)
+    if split_point != -1:
+        return split_point + 1
+    split_point = s.rfind(" ", 0, preferred_at)
+    if split_point != -1:
+        return split_point
+    return None
+
+
+class _Buffer:
+    # Sliding window over the stripped text; offsets are relative to that text
+    def __init__(self, stream: TextIO, block_size: int) -> None:
+        self.stream = stream
+        self.block_size = block_size
+        self.text = ""
+        self.start = 0
+        self.content_end = 0
+        # Newlines counted so far, up to (excluding) line_pos
+        self.line_pos = 0
+        self.line_count = 0
+        self.eof = False
+        self._skip_leading_whitespace()
+
+    def _append(self, block: str) -> None:
+        if not block:
+            self.eof = True
+            return
+        self.text += block
+        stripped = block.rstrip()
+        if stripped:
+            self.content_end = (
+                self.start + len(self.text) - (len(block) - len(stripped))
+            )
+
+    def _skip_leading_whitespace(self) -> None:
+        while not self.eof:
+            block = self.stream.read(self.block_size)
+            stripped = block.lstrip()
+            skipped = len(block) - len(stripped)
+            self.line_count += block.count("\n", 0, skipped)
+            if not block:
+                self.eof = True
+            elif stripped:
+                self._append(stripped)
+                return
+
+    def fill(self, cursor: int, needed: int) -> Optional[int]:
+        # Returns the stripped text length once EOF is reached, None before that
+        while not self.eof:
+            if self.content_end > cursor + needed:
+                return None
+            self._append(self.stream.read(self.block_size))
+        return self.content_end
+
+    def slice(self, begin: int, end: int) -> str:
+        return self.text[begin - self.start : end - self.start]
+
+    def _advance_lines(self, pos: int) -> None:
+        if pos >= self.line_pos:
+            begin, end = self.line_pos - self.start, pos - self.start
+            self.line_count += self.text.count("\n", begin, end)
+        else:
+            begin, end = pos - self.start, self.line_pos - self.start
+            self.line_count -= self.text.count("\n", begin, end)
+        self.line_pos = pos
+
+    def line_of(self, index: int) -> int:
+        self._advance_lines(index + 1)
+        return self.line_count + 1
+
+    def discard_before(self, index: int) -> None:
+        # Compact only once most of the buffer is consumed to avoid O(n) copies per chunk
+        drop = index - self.start
+        if drop <= 0 or drop < len(self.text) // 2:
+            return
+        if self.line_pos < index:
+            self._advance_lines(index)
+        self.text = self.text[drop:]
+        self.start = index
+
+
+def iter_chunks(
+    stream: TextIO,
+    chunk_size: int = 2000,
+    overlap: int = 0,
+    block_size: int = BLOCK_SIZE,
+) -> Iterator[ChunkSpan]:
+    min_chunk_length = int(chunk_size * 0.5)
+    tail_threshold = int(chunk_size * 0.2)
+    if overlap >= min_chunk_length:
+        # The cursor could stop advancing at a split point mid-document
+        raise ValueError(
+            f"overlap ({overlap}) must be less than half of chunk_size ({chunk_size})"
+        )
+
+    buf = _Buffer(stream, max(block_size, chunk_size))
+    if not buf.text:
+        return
+
+    def span(text: str, start: int, end: int) -> ChunkSpan:
+        line_from = buf.line_of(start)
+        line_to = buf.line_of(max(end - 1, start))
+        return ChunkSpan(text, start, end, line_from, line_to)
+
+    cursor = 0
+    while True:
+        text_length = buf.fill(cursor, chunk_size + tail_threshold)
+        if text_length is not None and cursor >= text_length:
+            break
+
+        if text_length is None:
+            preferred_end = cursor + chunk_size
+        else:
+            preferred_end = min(cursor + chunk_size, text_length)
+        window = buf.slice(cursor, preferred_end)
+        relative_split = _find_split_point(window, len(window))
+        if relative_split is None or relative_split < min_chunk_length:
+            boundary = preferred_end
+        else:
+            boundary = cursor + relative_split
+
+        if text_length is not None:
+            boundary = min(boundary, text_length)
+        chunk_text = buf.slice(cursor, boundary).strip()
+        if chunk_text:
+            yield span(chunk_text, cursor, boundary)
+
+        next_cursor = max(0, boundary - overlap)
+        if text_length is not None and 0 < (text_length - next_cursor) < tail_threshold:
+            tail_text = buf.slice(next_cursor, text_length).strip()
+            if tail_text:
+                yield span(tail_text, next_cursor, text_length)
+            break
+        # The end is covered; an overlap past the tail threshold would chunk it forever
+        if text_length is not None and boundary >= text_length:
+            break
+
+        buf.discard_before(next_cursor)
+        cursor = next_cursor
+
+
+def iter_text_chunks(text: str, chunk_size: int = 2000, overlap: int = 0):
+    return iter_chunks(io.StringIO(text or ""), chunk_size, overlap)
+
+
+def iter_file_chunks(
+    path: Path, chunk_size: int = 2000, overlap: int = 0
+) -> Iterator[ChunkSpan]:
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            yield from iter_chunks(f, chunk_size, overlap)
+    except UnicodeDecodeError as exc:
+        raise RuntimeError(f"{path}: file must be UTF-8 encoded") from exc
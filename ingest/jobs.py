@@ -0,0 +1,294 @@
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from openai import OpenAI
+from core.cache import answer_cache
+from core.presets import ALLOWED_NAMESPACES
+from core.utils import env_int
+from ingest.uploader import _describe_result, _extract_upload_entry, _upsert_chunks
+
+
+# Job and file states; a job stays active while any of its files is queued or running
+ACTIVE_STATES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    # Ingestion jobs and per-file progress, persisted in SQLite
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS ingest_jobs (
+                    id TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS ingest_job_files (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    display_name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    chunks_done INTEGER NOT NULL DEFAULT 0,
+                    chunks_total INTEGER NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (job_id, position)
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock, self._connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def create(
+        self, job_id: str, namespace: str, files: List[Tuple[str, str, str, str]]
+    ) -> None:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO ingest_jobs VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, namespace, now, now),
+            )
+            conn.executemany(
+                "INSERT INTO ingest_job_files (job_id, position, path, display_name, status, message) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, pos, *entry) for pos, entry in enumerate(files)],
+            )
+
+    def job(self, job_id: str) -> Optional[sqlite3.Row]:
+        rows = self._execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def files(self, job_id: str) -> List[sqlite3.Row]:
+        return self._execute(
+            "SELECT * FROM ingest_job_files WHERE job_id = ? ORDER BY position",
+            (job_id,),
+        )
+
+    def set_job_status(self, job_id: str, status: str) -> None:
+        self._execute(
+            "UPDATE ingest_jobs SET status = ?, updated_at = ? WHERE id = ?",
+            (status, time.time(), job_id),
+        )
+
+    def start_job(self, job_id: str) -> None:
+        self._execute(
+            "UPDATE ingest_jobs SET status = 'running', updated_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+
+    def update_file(self, job_id: str, position: int, **fields) -> None:
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(
+            f"UPDATE ingest_job_files SET {columns} WHERE job_id = ? AND position = ?",
+            (*fields.values(), job_id, position),
+        )
+
+    def unfinished(self) -> List[sqlite3.Row]:
+        return self._execute(
+            "SELECT f.job_id, f.position FROM ingest_job_files f "
+            "JOIN ingest_jobs j ON j.id = f.job_id "
+            "WHERE j.status IN ('queued', 'running') AND f.status IN ('queued', 'running') "
+            "ORDER BY j.created_at, f.position"
+        )
+
+
+class IngestJobs:
+    # Runs upload jobs on a worker pool, one file per task; reruns skip already upserted chunks
+    def __init__(self, store: JobStore, client: OpenAI, files_dir: str) -> None:
+        self.store = store
+        self.client = client
+        self.files_dir = Path(files_dir)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, env_int("INGEST_JOB_WORKERS", 2)),
+            thread_name_prefix="ingest-job",
+        )
+        self._lock = threading.Lock()
+        self._cancelled: set[str] = set()
+        # Workers per job still inside _upsert_chunks, which reads the copied uploads
+        self._running: Dict[str, int] = {}
+
+    def submit(
+        self, namespace: Optional[str], uploaded_files: Optional[List[object]]
+    ) -> Tuple[Optional[str], str]:
+        if namespace is None or namespace not in ALLOWED_NAMESPACES:
+            return None, "Select a namespace before uploading."
+        if not uploaded_files:
+            return None, "No files received."
+
+        job_id = uuid.uuid4().hex
+        files: List[Tuple[str, str, str, str]] = []
+        seen = set()
+        for item in uploaded_files:
+            entry = _extract_upload_entry(item)
+            if entry is None or entry[0] in seen:
+                continue
+            path, display = entry
+            seen.add(path)
+            if not path.exists():
+                files.append((str(path), display, "failed", "not found"))
+            elif path.suffix.lower() != ".txt":
+                files.append((str(path), display, "skipped", "unsupported file type"))
+            else:
+                # Uploads are copied so that the job can resume after a restart
+                copy = self.files_dir / job_id / str(len(files)) / path.name
+                copy.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(path, copy)
+                files.append((str(copy), display, "queued", ""))
+
+        if not files:
+            return None, "No valid files received."
+
+        self.store.create(job_id, namespace, files)
+        for position, (_, _, status, _) in enumerate(files):
+            if status == "queued":
+                self._executor.submit(self._run_file, job_id, position)
+        self._finish_if_done(job_id)
+        return job_id, self.render(job_id)
+
+    def resume(self) -> int:
+        pending = self.store.unfinished()
+        for row in pending:
+            self._executor.submit(self._run_file, row["job_id"], row["position"])
+        return len(pending)
+
+    def cancel(self, job_id: Optional[str]) -> str:
+        if not job_id:
+            return "No upload job to cancel."
+        job = self.store.job(job_id)
+        if job is not None and job["status"] in ACTIVE_STATES:
+            with self._lock:
+                self._cancelled.add(job_id)
+                idle = not self._running.get(job_id)
+            self.store.set_job_status(job_id, "cancelled")
+            for row in self.store.files(job_id):
+                if row["status"] in ACTIVE_STATES:
+                    self.store.update_file(job_id, row["position"], status="cancelled")
+            # Otherwise the last running worker removes the files when it returns
+            if idle:
+                self._cleanup(job_id)
+        return self.render(job_id)
+
+    def _is_cancelled(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancelled
+
+    def _run_file(self, job_id: str, position: int) -> None:
+        with self._lock:
+            if job_id in self._cancelled:
+                return
+            self._running[job_id] = self._running.get(job_id, 0) + 1
+        try:
+            self._process_file(job_id, position)
+        finally:
+            with self._lock:
+                self._running[job_id] -= 1
+                last = not self._running[job_id]
+                if last:
+                    del self._running[job_id]
+            if last and self._is_cancelled(job_id):
+                self._cleanup(job_id)
+
+    def _process_file(self, job_id: str, position: int) -> None:
+        job = self.store.job(job_id)
+        row = self.store.files(job_id)[position]
+        if job is None or job["status"] not in ACTIVE_STATES:
+            return
+        if row["status"] not in ACTIVE_STATES:
+            return
+
+        self.store.start_job(job_id)
+        self.store.update_file(job_id, position, status="running")
+
+        def on_progress(done: int, total: int) -> bool:
+            self.store.update_file(
+                job_id, position, chunks_done=done, chunks_total=total
+            )
+            return not self._is_cancelled(job_id)
+
+        started = time.perf_counter()
+        try:
+            result = _upsert_chunks(
+                job["namespace"],
+                Path(row["path"]),
+                self.client,
+                on_progress=on_progress,
+                should_stop=lambda: self._is_cancelled(job_id),
+            )
+        except Exception as ex:
+            if self._is_cancelled(job_id):
+                return
+            logger.warning(f"Ingest job {job_id} failed on {row['display_name']}: {ex}")
+            self.store.update_file(job_id, position, status="failed", message=str(ex))
+            self._finish_if_done(job_id)
+            return
+
+        if result.upserted or result.removed:
+            answer_cache.invalidate(job["namespace"])
+        if self._is_cancelled(job_id):
+            return
+        elapsed = time.perf_counter() - started
+        self.store.update_file(
+            job_id,
+            position,
+            status="done",
+            message=_describe_result(result, elapsed),
+        )
+        self._finish_if_done(job_id)
+
+    def _finish_if_done(self, job_id: str) -> None:
+        job = self.store.job(job_id)
+        if job is None or job["status"] == "cancelled":
+            return
+        files = self.store.files(job_id)
+        if any(row["status"] in ACTIVE_STATES for row in files):
+            return
+        failed = any(row["status"] == "failed" for row in files)
+        self.store.set_job_status(job_id, "failed" if failed else "done")
+        self._cleanup(job_id)
+
+    def _cleanup(self, job_id: str) -> None:
+        shutil.rmtree(self.files_dir / job_id, ignore_errors=True)
+
+    def render(self, job_id: Optional[str]) -> str:
+        job = self.store.job(job_id) if job_id else None
+        if job is None:
+            return ""
+
+        lines = [f"Job {job_id[:8]} ({job['namespace']}): {job['status']}"]
+        total = 0
+        for row in self.store.files(job_id):
+            total += row["chunks_done"]
+            name = row["display_name"]
+            if row["status"] in ("skipped", "failed") and not row["chunks_done"]:
+                lines.append(f"- {name}: {row['status']} ({row['message']})")
+                continue
+            progress = f"{row['chunks_done']}/{row['chunks_total'] or '?'} chunk(s)"
+            detail = f", {row['message']}" if row["message"] else ""
+            lines.append(f"- {name}: {progress} uploaded ({row['status']}{detail})")
+
+        if job["status"] not in ACTIVE_STATES:
+            lines.append(f"Done. Total chunks uploaded: {total}")
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,70 @@
-import uuid
+import asyncio
+import hashlib
+import json
+import logging
+import queue
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Sequence, Tuple
-from openai import OpenAI
-from core.embeddings import get_embedding
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from openai import AsyncOpenAI, OpenAI
+from core.cache import answer_cache
+from core.embeddings import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL,
+    embedding_dimensions,
+    get_embeddings,
+    shorten_embedding,
+)
+from core.metrics import metrics
+from core.ratelimit import (
+    BACKGROUND,
+    COMPLETION_ESTIMATE,
+    RequestCancelled,
+    acall_with_retry,
+    call_with_retry,
+    get_limiter,
+    response_tokens,
+    stop_waiting_when,
+)
 from core.presets import (
     ALLOWED_NAMESPACES,
+    SITUATE_BATCH_SYSTEM_PROMPT,
     SITUATE_SYSTEM_PROMPT,
+    SUMMARIZE_DOCUMENT_PROMPT,
+    build_situated_batch_instructions,
     build_situated_chunk_instructions,
+    build_situated_chunk_window_instructions,
 )
+from core.utils import env_choice, env_int, estimate_tokens
+from ingest.chunk_cache import ChunkCache, content_hash, get_chunk_cache
+from ingest.chunker import iter_file_chunks
+from ingest.upsert import UpsertPipeline
 from retrieval.index import get_pinecone_index
+from retrieval.sparse import encode_documents, get_retrieval_mode, release_documents
+
+
+INGEST_MODES = ("sequential", "threads", "async")
+SITUATE_STRATEGIES = ("full", "window")
+SITUATE_MODEL = "gpt-4o-mini"
+# Situated chunks are embedded in groups of this size as they arrive
+EMBED_GROUP_SIZE = 64
+DELETE_BATCH_SIZE = 1000
+# Marks chunks stored without context because situating failed; these are never cached
+FALLBACK_PREFIX = "Document excerpt : "
+# Statuses for which OpenAI rejected this particular request, e.g. it was too long
+FALLBACK_STATUSES = (400, 422)
+
+logger = logging.getLogger(__name__)
+
+
+class IngestResult(NamedTuple):
+    upserted: int
+    unchanged: int
+    removed: int
 
 
 def _extract_upload_entry(item: object) -> Optional[Tuple[Path, str]]:
@@ -36,142 +92,697 @@ def _read_text(path: Path) -> str:
         raise RuntimeError(f"{path}: file must be UTF-8 encoded") from exc
 
 
-def _find_split_point(s: str, preferred_at: int) -> Optional[int]:
-    split_point = s.rfind("\n\n", 0, preferred_at)
-    if split_point != -1:
-        return split_point
-    split_point = s.rfind(". ", 0, preferred_at)
-    if split_point != -1:
-        return split_point + 1
-    split_point = s.rfind(" ", 0, preferred_at)
-    if split_point != -1:
-        return split_point
-    return None
-
-
-def _chunk_text(
-    text: str, chunk_size: int = 2000, overlap: int = 0
-) -> List[Tuple[str, int, int]]:
-    cleaned = (text or "").strip()
-    if not cleaned:
-        return []
-
-    chunks: List[Tuple[str, int, int]] = []
-    cursor = 0
-    text_length = len(cleaned)
-    min_chunk_length = int(chunk_size * 0.5)
-    tail_threshold = int(chunk_size * 0.2)
-
-    while cursor < text_length:
-        preferred_end = min(cursor + chunk_size, text_length)
-        window = cleaned[cursor:preferred_end]
-        relative_split = _find_split_point(window, len(window))
-        if relative_split is None or relative_split < min_chunk_length:
-            boundary = preferred_end
-        else:
-            boundary = cursor + relative_split
+def _situate_messages(user_prompt: str) -> List[dict]:
+    return [
+        {"role": "system", "content": SITUATE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
 
-        boundary = min(boundary, text_length)
-        chunk_text = cleaned[cursor:boundary].strip()
-        if chunk_text:
-            chunks.append((chunk_text, cursor, boundary))
 
-        next_cursor = max(0, boundary - overlap)
-        if 0 < (text_length - next_cursor) < tail_threshold:
-            tail_text = cleaned[next_cursor:text_length].strip()
-            if tail_text:
-                chunks.append((tail_text, next_cursor, text_length))
-            break
+def _clean_situated(content: Optional[str]) -> str:
+    text = (content or "").strip()
+    return " ".join(text.splitlines()).strip()
 
-        cursor = next_cursor
 
-    return chunks
+def _record_usage(stage: str, response) -> None:
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        metrics.observe("ingest_tokens", usage.total_tokens, stage=stage)
 
 
-def _char_index_to_line(index: int, n_positions: List[int]) -> int:
-    left, right = 0, len(n_positions) - 1
-    while left < right:
-        mid = (left + right + 1) // 2
-        if n_positions[mid] <= index:
-            left = mid
-        else:
-            right = mid - 1
-    return left + 1
+def _estimate_chat_tokens(messages: Sequence[dict], outputs: int = 1) -> int:
+    prompt = sum(estimate_tokens(m["content"]) for m in messages)
+    return prompt + COMPLETION_ESTIMATE * outputs
 
 
-def _generate_situated_chunk(client: OpenAI, document_text: str, chunk: str) -> str:
-    user_prompt = build_situated_chunk_instructions(document_text, chunk)
+def _chat(client: OpenAI, messages: List[dict], stage: str, outputs: int = 1, **kwargs):
+    # Ingestion shares the chat quota with interactive turns and yields to them
+    response = call_with_retry(
+        get_limiter("chat"),
+        lambda: client.chat.completions.create(
+            model=SITUATE_MODEL, messages=messages, **kwargs
+        ),
+        _estimate_chat_tokens(messages, outputs),
+        BACKGROUND,
+        response_tokens,
+    )
+    _record_usage(stage, response)
+    return response
 
+
+async def _achat(
+    client: AsyncOpenAI, messages: List[dict], stage: str, outputs: int = 1, **kwargs
+):
+    response = await acall_with_retry(
+        get_limiter("chat"),
+        lambda: client.chat.completions.create(
+            model=SITUATE_MODEL, messages=messages, **kwargs
+        ),
+        _estimate_chat_tokens(messages, outputs),
+        BACKGROUND,
+        response_tokens,
+    )
+    _record_usage(stage, response)
+    return response
+
+
+def _can_fall_back(ex: Exception, what: str) -> bool:
+    # Retries are exhausted or the error is not transient; only rejected requests degrade
+    status = getattr(ex, "status_code", None) or getattr(ex, "status", None)
+    if status not in FALLBACK_STATUSES:
+        return False
+    logger.warning(f"{what} was rejected ({ex}), continuing without it")
+    return True
+
+
+def _fallback_chunk(chunk: str) -> str:
+    metrics.inc("ingest_situate_fallbacks_total")
+    return f"{FALLBACK_PREFIX}{chunk.strip()}"
+
+
+def _generate_situated_chunk(client: OpenAI, user_prompt: str, chunk: str) -> str:
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SITUATE_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
+        response = _chat(client, _situate_messages(user_prompt), "situate")
+    except Exception as ex:
+        if not _can_fall_back(ex, "Situating a chunk"):
+            raise
+        return _fallback_chunk(chunk)
+    return _clean_situated(response.choices[0].message.content)
+
+
+async def _agenerate_situated_chunk(
+    client: AsyncOpenAI, user_prompt: str, chunk: str
+) -> str:
+    try:
+        response = await _achat(client, _situate_messages(user_prompt), "situate")
+    except Exception as ex:
+        if not _can_fall_back(ex, "Situating a chunk"):
+            raise
+        return _fallback_chunk(chunk)
+    return _clean_situated(response.choices[0].message.content)
+
+
+def _summarize_document(client: OpenAI, pieces: Sequence[str]) -> str:
+    # Evenly spaced chunks stand in for documents larger than the summary budget
+    budget = env_int("SITUATE_SUMMARY_SOURCE_CHARS", 48_000)
+    total = sum(len(p) for p in pieces)
+    step = max(1, -(-total // budget))
+    sample = "\n\n".join(pieces[::step])[:budget]
+    messages = [
+        {"role": "system", "content": SUMMARIZE_DOCUMENT_PROMPT},
+        {"role": "user", "content": sample},
+    ]
+    try:
+        response = _chat(client, messages, "summarize")
+    except Exception as ex:
+        if not _can_fall_back(ex, "Summarizing the document"):
+            raise
+        return ""
+    return (response.choices[0].message.content or "").strip()
+
+
+class _SituatePrompts:
+    # Builds per-chunk and per-batch situating prompts for one document
+    def __init__(self, client: OpenAI, file_path: Path, pieces: Sequence[str]) -> None:
+        self.client = client
+        self.file_path = file_path
+        self.pieces = pieces
+        self.strategy = env_choice("SITUATE_STRATEGY", "full", SITUATE_STRATEGIES)
+        # A document too large for one prompt is summarized instead of read in full
+        max_bytes = env_int("SITUATE_FULL_MAX_BYTES", 400_000)
+        if self.strategy == "full" and file_path.stat().st_size > max_bytes:
+            logger.info(f"{file_path.name} is over {max_bytes} bytes, using window")
+            self.strategy = "window"
+        self.neighbour_chars = env_int("SITUATE_NEIGHBOUR_CHARS", 1000)
+        self._lock = threading.Lock()
+        self._context: Optional[str] = None
+
+    @property
+    def context(self) -> str:
+        # The document text or its summary, loaded only once a chunk needs situating
+        with self._lock:
+            if self._context is None:
+                if self.strategy == "full":
+                    self._context = _read_text(self.file_path)
+                else:
+                    self._context = _summarize_document(self.client, self.pieces)
+            return self._context
+
+    def _before(self, i: int) -> str:
+        return self.pieces[i - 1][-self.neighbour_chars :] if i > 0 else ""
+
+    def _after(self, i: int) -> str:
+        if i + 1 >= len(self.pieces):
+            return ""
+        return self.pieces[i + 1][: self.neighbour_chars]
+
+    def single(self, i: int) -> str:
+        if self.strategy == "full":
+            return build_situated_chunk_instructions(self.context, self.pieces[i])
+        return build_situated_chunk_window_instructions(
+            self.context, self._before(i), self.pieces[i], self._after(i)
+        )
+
+    def batch(self, group: Sequence[int]) -> str:
+        chunks = [(i, self.pieces[i]) for i in group]
+        if self.strategy == "full":
+            return build_situated_batch_instructions(chunks, document_text=self.context)
+        return build_situated_batch_instructions(
+            chunks,
+            summary=self.context,
+            before=self._before(group[0]),
+            after=self._after(group[-1]),
+        )
+
+
+def _batch_messages(user_prompt: str) -> List[dict]:
+    return [
+        {"role": "system", "content": SITUATE_BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def _parse_situated_batch(content: Optional[str], group: Sequence[int]) -> dict:
+    # Keeps well-formed entries; anything missing is situated again on its own
+    try:
+        data = json.loads(content or "")
+    except ValueError:
+        return {}
+    items = data.get("chunks") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return {}
+
+    position = {chunk_id: pos for pos, chunk_id in enumerate(group)}
+    results: dict[int, str] = {}
+    last = -1
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        chunk_id = item.get("id")
+        text = item.get("situated")
+        if chunk_id not in position or not isinstance(text, str):
+            continue
+        if position[chunk_id] <= last:
+            # Out of order or repeated ids: the pairing cannot be trusted
+            return {}
+        last = position[chunk_id]
+        text = _clean_situated(text)
+        if " : " in text:
+            results[chunk_id] = text
+    return results
+
+
+def _situate_group(
+    client: OpenAI, prompts: _SituatePrompts, group: Sequence[int]
+) -> List[str]:
+    results: dict[int, str] = {}
+    if len(group) > 1:
+        try:
+            response = _chat(
+                client,
+                _batch_messages(prompts.batch(group)),
+                "situate_batch",
+                len(group),
+                response_format={"type": "json_object"},
+            )
+            results = _parse_situated_batch(response.choices[0].message.content, group)
+        except Exception as ex:
+            if not _can_fall_back(ex, "A batch situating request"):
+                raise
+    return [
+        results.get(i)
+        or _generate_situated_chunk(client, prompts.single(i), prompts.pieces[i])
+        for i in group
+    ]
+
+
+async def _asituate_group(
+    client: AsyncOpenAI, prompts: _SituatePrompts, group: Sequence[int]
+) -> List[str]:
+    results: dict[int, str] = {}
+    if len(group) > 1:
+        try:
+            response = await _achat(
+                client,
+                _batch_messages(prompts.batch(group)),
+                "situate_batch",
+                len(group),
+                response_format={"type": "json_object"},
+            )
+            results = _parse_situated_batch(response.choices[0].message.content, group)
+        except Exception as ex:
+            if not _can_fall_back(ex, "A batch situating request"):
+                raise
+    missing = [i for i in group if i not in results]
+    retried = await asyncio.gather(
+        *(
+            _agenerate_situated_chunk(client, prompts.single(i), prompts.pieces[i])
+            for i in missing
         )
-        text = (response.choices[0].message.content or "").strip()
-        return " ".join(text.splitlines()).strip()
-    except Exception:
-        return f"Document excerpt : {chunk.strip()}"
+    )
+    results.update(zip(missing, retried))
+    return [results[i] for i in group]
+
+
+def _situate_async(
+    client: OpenAI,
+    prompts: _SituatePrompts,
+    groups: Sequence[Sequence[int]],
+    max_in_flight: int,
+    should_stop: Callable[[], bool],
+) -> Iterator[List[str]]:
+    done: "queue.Queue[Tuple[int, object]]" = queue.Queue()
+    stop = threading.Event()
+    running: dict = {}
+
+    async def produce() -> None:
+        running["loop"] = asyncio.get_running_loop()
+        running["task"] = asyncio.current_task()
+        async_client = AsyncOpenAI(
+            api_key=client.api_key,
+            organization=client.organization,
+            base_url=client.base_url,
+            max_retries=0,
+        )
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def situate(g: int, group: Sequence[int]) -> None:
+            async with semaphore:
+                if stop.is_set() or should_stop():
+                    done.put((g, RequestCancelled("situating was stopped")))
+                    return
+                try:
+                    with stop_waiting_when(should_stop):
+                        texts = await _asituate_group(async_client, prompts, group)
+                except RequestCancelled as ex:
+                    done.put((g, ex))
+                    return
+            done.put((g, texts))
+
+        try:
+            await asyncio.gather(*(situate(g, grp) for g, grp in enumerate(groups)))
+        finally:
+            await async_client.close()
+
+    def run() -> None:
+        try:
+            asyncio.run(produce())
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            done.put((-1, ex))
+
+    threading.Thread(target=run, daemon=True).start()
+
+    # Completions arrive out of order; release them in chunk order. A cancelled
+    # group is raised in its place, so later groups never fill its slot.
+    pending: dict[int, object] = {}
+    next_group = 0
+    try:
+        while next_group < len(groups):
+            g, result = done.get()
+            if g < 0:
+                raise result
+            pending[g] = result
+            while next_group in pending:
+                result = pending.pop(next_group)
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+                next_group += 1
+    finally:
+        # A consumer that stops early cancels the requests still queued or in flight
+        stop.set()
+        if "task" in running:
+            try:
+                running["loop"].call_soon_threadsafe(running["task"].cancel)
+            except RuntimeError:
+                pass  # the loop has already finished
+
+
+def _never() -> bool:
+    return False
+
+
+def _situate_chunks(
+    client: OpenAI,
+    prompts: _SituatePrompts,
+    indices: Sequence[int],
+    should_stop: Callable[[], bool] = _never,
+) -> Iterator[str]:
+    # Once should_stop() is true the stream ends with RequestCancelled at the first
+    # group that was not situated, so every text yielded belongs to its chunk
+    mode = env_choice("INGEST_MODE", "threads", INGEST_MODES)
+    max_in_flight = max(1, env_int("INGEST_MAX_IN_FLIGHT", 8))
+    batch_size = max(1, env_int("SITUATE_BATCH_SIZE", 1))
+    groups = [
+        indices[first : first + batch_size]
+        for first in range(0, len(indices), batch_size)
+    ]
+
+    def situate(group: Sequence[int]) -> List[str]:
+        if should_stop():
+            raise RequestCancelled("situating was stopped")
+        with stop_waiting_when(should_stop):
+            return _situate_group(client, prompts, group)
+
+    if mode == "sequential" or max_in_flight == 1:
+        for group in groups:
+            yield from situate(group)
+    elif mode == "async":
+        for texts in _situate_async(
+            client, prompts, groups, max_in_flight, should_stop
+        ):
+            yield from texts
+    else:
+        executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="situate"
+        )
+        try:
+            for texts in executor.map(situate, groups):
+                yield from texts
+        finally:
+            # Groups not started yet are dropped when the consumer stops early
+            executor.shutdown(cancel_futures=True)
+
+
+def _grouped(items: Iterator, size: int) -> Iterator[list]:
+    group: list = []
+    for item in items:
+        group.append(item)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+class _VectorIds:
+    # Same namespace, file and chunk text give the same id; repeats get an ordinal.
+    # Shortened vectors get their own ids; an index holds one width, so changing it
+    # needs a new local namespace folder or Pinecone index
+    def __init__(self, namespace: str, file_name: str, dimensions: int) -> None:
+        file_key = f"{namespace}/{file_name}"
+        if dimensions != EMBEDDING_DIMENSIONS:
+            file_key = f"{file_key}/{dimensions}"
+        self.file_key = content_hash(file_key, 8)
+        self.seen: Dict[str, int] = {}
+
+    def __call__(self, piece: str) -> str:
+        chunk_key = content_hash(piece, 12)
+        n = self.seen.get(chunk_key, 0)
+        self.seen[chunk_key] = n + 1
+        if n:
+            return f"{self.file_key}-{chunk_key}-{n}"
+        return f"{self.file_key}-{chunk_key}"
+
+
+class _ChunkTexts(Sequence[str]):
+    # Chunk texts spilled to a temporary file, so memory holds only their offsets
+    def __init__(self) -> None:
+        self._file = tempfile.TemporaryFile()
+        self._offsets = array("q", [0])
+        self._lock = threading.Lock()
+
+    def append(self, text: str) -> None:
+        data = text.encode("utf-8")
+        with self._lock:
+            self._file.seek(self._offsets[-1])
+            self._file.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        with self._lock:
+            self._file.seek(self._offsets[i])
+            data = self._file.read(self._offsets[i + 1] - self._offsets[i])
+        return data.decode("utf-8")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _cached_embeddings(
+    client: OpenAI, cache: ChunkCache, texts: Sequence[str]
+) -> List[List[float]]:
+    embeddings = cache.get_embeddings(texts, EMBEDDING_MODEL)
+    missing = [i for i, e in enumerate(embeddings) if e is None]
+    metrics.inc(
+        "cache_requests_total",
+        len(texts) - len(missing),
+        cache="embedding",
+        result="hit",
+    )
+    metrics.inc("cache_requests_total", len(missing), cache="embedding", result="miss")
+    if missing:
+        fresh = get_embeddings(client, [texts[i] for i in missing])
+        for i, embedding in zip(missing, fresh):
+            embeddings[i] = embedding
+        cache.put_embeddings([texts[i] for i in missing], fresh, EMBEDDING_MODEL)
+    return embeddings
+
+
+def _release_unsent(
+    namespace: str,
+    cache: ChunkCache,
+    added: Dict[str, Tuple[int, List[int]]],
+    replaced: Dict[str, Tuple[int, List[int]]],
+    sent: set,
+) -> None:
+    # BM25 terms counted for vectors that never reached the index come back out;
+    # the stored vectors they were meant to overwrite are still live, so theirs go back in
+    unsent = [vector_id for vector_id in added if vector_id not in sent]
+    if not unsent:
+        return
+    cache.pop_terms(namespace, unsent)
+    restored = [(v, replaced[v]) for v in unsent if v in replaced]
+    release_documents(
+        namespace, [added[v] for v in unsent], [terms for _, terms in restored]
+    )
+    cache.put_terms(namespace, restored)
 
 
 def _upsert_chunks(
     namespace: str,
     file_path: Path,
     client: OpenAI,
-) -> int:
-    index = get_pinecone_index()
-
-    full_text = _read_text(file_path)
-    spans = _chunk_text(full_text)
-    if not spans:
-        return 0
-
-    total = 0
-    vectors_batch = []
-    n_positions: List[int] = [-1]
-    for idx, ch in enumerate(full_text):
-        if ch == "\n":
-            n_positions.append(idx)
-    n_positions.append(len(full_text))
-
-    for piece, start_char, end_char in spans:
-        material = _generate_situated_chunk(client, full_text, piece)
-        embedding = get_embedding(client, material)
-        try:
-            vector_id = str(uuid.uuid4())
-        except Exception:
-            vector_id = f"{file_path.stem}-{start_char}-{end_char}"
-
-        line_from = _char_index_to_line(start_char, n_positions)
-        line_to = _char_index_to_line(max(end_char - 1, start_char), n_positions)
-
-        vectors_batch.append(
-            {
-                "id": vector_id,
-                "values": embedding,
-                "metadata": {
-                    "text": material,
-                    "blobType": "text/plain",
-                    "source": "file",
-                    "file": file_path.name,
-                    "file_path": str(file_path),
-                    "loc.lines.from": line_from,
-                    "loc.lines.to": line_to,
-                },
-            }
+    on_progress: Optional[Callable[[int, int], bool]] = None,
+    should_stop: Callable[[], bool] = _never,
+) -> IngestResult:
+    # on_progress(done, total) runs after every upserted batch; returning False stops early.
+    # should_stop() is checked before every chunk, so situating stops without waiting
+    # for a batch to fill.
+    pieces = _ChunkTexts()
+    try:
+        return _upsert_pieces(
+            namespace, file_path, client, pieces, on_progress, should_stop
         )
-        if len(vectors_batch) >= 32:
-            index.upsert(namespace=namespace, vectors=vectors_batch)
-            total += len(vectors_batch)
-            vectors_batch = []
+    finally:
+        pieces.close()
 
-    if vectors_batch:
-        index.upsert(namespace=namespace, vectors=vectors_batch)
-        total += len(vectors_batch)
 
-    return total
+def _upsert_pieces(
+    namespace: str,
+    file_path: Path,
+    client: OpenAI,
+    pieces: _ChunkTexts,
+    on_progress: Optional[Callable[[int, int], bool]],
+    should_stop: Callable[[], bool],
+) -> IngestResult:
+    index = get_pinecone_index()
+    cache = get_chunk_cache()
+    file_name = file_path.name
+
+    # One pass over the chunker: texts go to disk, and only ids, hashes and line
+    # ranges stay in memory for the manifest diff and the vectors
+    dimensions = embedding_dimensions(namespace)
+    vector_id = _VectorIds(namespace, file_name, dimensions)
+    ids: List[str] = []
+    chunk_hashes: List[str] = []
+    lines: List[Tuple[int, int]] = []
+    for span in iter_file_chunks(file_path):
+        pieces.append(span.text)
+        ids.append(vector_id(span.text))
+        chunk_hashes.append(content_hash(span.text))
+        lines.append((span.line_from, span.line_to))
+    stored = cache.manifest(namespace, file_name)
+    todo = [i for i in range(len(ids)) if stored.get(ids[i]) != lines[i]]
+    unchanged = len(ids) - len(todo)
+    if on_progress and not on_progress(unchanged, len(ids)):
+        return IngestResult(0, unchanged, 0)
+
+    # Situated text is reused only for the same document version, chunk and prompt
+    prompts = _SituatePrompts(client, file_path, pieces)
+    situate_model = f"{SITUATE_MODEL}/{prompts.strategy}"
+    with file_path.open("rb") as f:
+        doc_hash = hashlib.file_digest(f, "sha256").hexdigest()
+    cached = cache.get_situated(
+        doc_hash, [chunk_hashes[i] for i in todo], situate_model
+    )
+    metrics.inc("cache_requests_total", unchanged, cache="manifest", result="hit")
+    metrics.inc("cache_requests_total", len(cached), cache="situated", result="hit")
+    metrics.inc(
+        "cache_requests_total", len(todo) - len(cached), cache="situated", result="miss"
+    )
+    fresh = _situate_chunks(
+        client,
+        prompts,
+        [i for i in todo if chunk_hashes[i] not in cached],
+        should_stop,
+    )
+
+    def situate_todo() -> Iterator[Tuple[int, str]]:
+        for i in todo:
+            if should_stop():
+                return
+            if chunk_hashes[i] in cached:
+                material = cached[chunk_hashes[i]]
+            else:
+                try:
+                    material = next(fresh, None)
+                except RequestCancelled:
+                    return
+            if material is None or should_stop():
+                return
+            yield i, material
+
+    # BM25 terms counted in this run and those of the stored vectors they overwrite
+    added: Dict[str, Tuple[int, List[int]]] = {}
+    replaced: Dict[str, Tuple[int, List[int]]] = {}
+    sent: set = set()
+
+    def on_upserted(batch: List[dict]) -> bool:
+        sent.update(v["id"] for v in batch)
+        cache.record(
+            namespace,
+            file_name,
+            [
+                (
+                    v["id"],
+                    v["metadata"]["loc.lines.from"],
+                    v["metadata"]["loc.lines.to"],
+                )
+                for v in batch
+            ],
+        )
+        if on_progress is None:
+            return True
+        return on_progress(unchanged + pipeline.upserted, len(ids))
+
+    pipeline = UpsertPipeline(index, namespace, on_upserted)
+    hybrid = get_retrieval_mode() == "hybrid"
+    try:
+        # Time spent waiting for a group is the situating that was not already cached
+        groups = metrics.timed(
+            _grouped(situate_todo(), EMBED_GROUP_SIZE),
+            "ingest_stage_seconds",
+            stage="situate",
+            namespace=namespace,
+        )
+        for group in groups:
+            if pipeline.stopped or should_stop():
+                break
+            materials = [material for _, material in group]
+            cache.put_situated(
+                doc_hash,
+                situate_model,
+                [
+                    (chunk_hashes[i], material)
+                    for i, material in group
+                    if not material.startswith(FALLBACK_PREFIX)
+                ],
+            )
+            with metrics.span(
+                "ingest_stage_seconds", stage="embed", namespace=namespace
+            ):
+                embeddings = _cached_embeddings(client, cache, materials)
+            sparse_values: List[Optional[dict]] = [None] * len(materials)
+            if hybrid:
+                group_ids = [ids[i] for i, _ in group]
+                previous = cache.pop_terms(namespace, group_ids)
+                sparse_values, documents = encode_documents(
+                    namespace, materials, list(previous.values())
+                )
+                cache.put_terms(namespace, list(zip(group_ids, documents)))
+                replaced.update(previous)
+                added.update(zip(group_ids, documents))
+
+            for (i, material), embedding, sparse in zip(
+                group, embeddings, sparse_values
+            ):
+                line_from, line_to = lines[i]
+                vector = {
+                    "id": ids[i],
+                    "values": shorten_embedding(embedding, dimensions),
+                    "metadata": {
+                        "text": material,
+                        "blobType": "text/plain",
+                        "source": "file",
+                        "file": file_name,
+                        "file_path": str(file_path),
+                        "loc.lines.from": line_from,
+                        "loc.lines.to": line_to,
+                    },
+                }
+                if sparse:
+                    vector["sparse_values"] = sparse
+                pipeline.add(vector)
+        if should_stop():
+            pipeline.abort()
+        else:
+            with metrics.span(
+                "ingest_stage_seconds", stage="drain", namespace=namespace
+            ):
+                pipeline.finish()
+    except BaseException:
+        pipeline.abort()
+        _release_unsent(namespace, cache, added, replaced, sent)
+        raise
+    finally:
+        # Stops situating chunks that will not be used after an early stop
+        fresh.close()
+    if pipeline.stopped:
+        _release_unsent(namespace, cache, added, replaced, sent)
+        return IngestResult(pipeline.upserted, unchanged, 0)
+
+    # Chunks that disappeared or changed in this version of the file
+    current = set(ids)
+    stale = [vector_id for vector_id in stored if vector_id not in current]
+    for start in range(0, len(stale), DELETE_BATCH_SIZE):
+        batch = stale[start : start + DELETE_BATCH_SIZE]
+        with metrics.span("ingest_stage_seconds", stage="delete", namespace=namespace):
+            index.delete(ids=batch, namespace=namespace)
+        cache.forget(namespace, file_name, batch)
+        release_documents(namespace, list(cache.pop_terms(namespace, batch).values()))
+
+    metrics.inc(
+        "ingest_chunks_total", pipeline.upserted, namespace=namespace, result="upserted"
+    )
+    metrics.inc(
+        "ingest_chunks_total", unchanged, namespace=namespace, result="unchanged"
+    )
+    metrics.inc(
+        "ingest_chunks_total", len(stale), namespace=namespace, result="removed"
+    )
+    return IngestResult(pipeline.upserted, unchanged, len(stale))
+
+
+def _describe_result(result: IngestResult, elapsed: float) -> str:
+    rate = result.upserted / elapsed if elapsed > 0 else 0.0
+    details = [f"{rate:.1f} chunks/s"]
+    if result.unchanged:
+        details.append(f"{result.unchanged} unchanged")
+    if result.removed:
+        details.append(f"{result.removed} removed")
+    return ", ".join(details)
 
 
 def _process_files(
@@ -191,14 +802,21 @@ def _process_files(
             log_messages.append(f"{file_path.name}: skipped (unsupported file type)")
             continue
 
+        started = time.perf_counter()
         try:
-            count = _upsert_chunks(namespace, file_path, client)
+            result = _upsert_chunks(namespace, file_path, client)
         except Exception as ex:
             log_messages.append(f"{file_path.name}: failed ({ex})")
             continue
-
-        total_vectors += count
-        log_messages.append(f"- {file_path.name}: {count} chunk(s) uploaded")
+        elapsed = time.perf_counter() - started
+        if result.upserted or result.removed:
+            answer_cache.invalidate(namespace)
+
+        total_vectors += result.upserted
+        log_messages.append(
+            f"- {file_path.name}: {result.upserted} chunk(s) uploaded "
+            f"({_describe_result(result, elapsed)})"
+        )
 
     return total_vectors, log_messages
 
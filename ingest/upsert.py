@@ -0,0 +1,128 @@
+import json
+import queue
+import random
+import threading
+import time
+from typing import Callable, List, Optional
+from core.metrics import metrics
+from core.ratelimit import is_transient
+from core.utils import env_int
+
+
+# Pinecone accepts at most 1000 vectors and 2 MB per upsert request
+MAX_UPSERT_VECTORS = 1000
+MAX_UPSERT_BYTES = 2_000_000
+MAX_ATTEMPTS = 4
+
+_STOP = object()
+
+
+class UpsertPipeline:
+    # Batches vectors by count and payload size and upserts them on worker threads
+    def __init__(
+        self,
+        index,
+        namespace: str,
+        on_upserted: Optional[Callable[[List[dict]], bool]] = None,
+    ) -> None:
+        self.index = index
+        self.namespace = namespace
+        self.on_upserted = on_upserted
+        self.max_vectors = min(
+            MAX_UPSERT_VECTORS, max(1, env_int("UPSERT_MAX_VECTORS", 100))
+        )
+        self.max_bytes = min(
+            MAX_UPSERT_BYTES, max(1, env_int("UPSERT_MAX_BYTES", MAX_UPSERT_BYTES))
+        )
+        # A full queue blocks add(), so generation never runs far ahead of the index
+        self._queue: "queue.Queue[object]" = queue.Queue(
+            maxsize=max(1, env_int("UPSERT_QUEUE_SIZE", 8))
+        )
+        self._batch: List[dict] = []
+        self._batch_bytes = 0
+        self._lock = threading.Lock()
+        self._error: Optional[Exception] = None
+        self.upserted = 0
+        self.requests = 0
+        self.retries = 0
+        self.stopped = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"upsert-{i}", daemon=True)
+            for i in range(max(1, env_int("UPSERT_WORKERS", 4)))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def add(self, vector: dict) -> None:
+        self._raise_error()
+        size = len(json.dumps(vector, separators=(",", ":")))
+        if self._batch and (
+            len(self._batch) >= self.max_vectors
+            or self._batch_bytes + size > self.max_bytes
+        ):
+            self._flush()
+        self._batch.append(vector)
+        self._batch_bytes += size
+
+    def _flush(self) -> None:
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+            self._batch_bytes = 0
+
+    def _send(self, batch: List[dict]) -> None:
+        # Retries resend the same vectors; nothing upstream is recomputed
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                with metrics.span(
+                    "ingest_stage_seconds", stage="upsert", namespace=self.namespace
+                ):
+                    self.index.upsert(namespace=self.namespace, vectors=batch)
+                return
+            except Exception as ex:
+                if attempt == MAX_ATTEMPTS - 1 or not is_transient(ex):
+                    raise
+                metrics.inc("ingest_upsert_retries_total", namespace=self.namespace)
+                with self._lock:
+                    self.retries += 1
+                time.sleep(2**attempt * (0.5 + random.random()))
+
+    def _work(self) -> None:
+        while True:
+            batch = self._queue.get()
+            if batch is _STOP:
+                return
+            if self.stopped or self._error is not None:
+                continue
+            try:
+                self._send(batch)
+            except Exception as ex:
+                with self._lock:
+                    self._error = self._error or ex
+                continue
+            with self._lock:
+                self.upserted += len(batch)
+                self.requests += 1
+                if self.on_upserted and not self.on_upserted(batch):
+                    self.stopped = True
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _join(self) -> None:
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    def finish(self) -> None:
+        if not self.stopped:
+            self._flush()
+        self._join()
+        self._raise_error()
+
+    def abort(self) -> None:
+        self.stopped = True
+        self._batch = []
+        self._join()
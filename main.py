@@ -1,130 +1,657 @@
 import functools
+import json
 import logging
 import os
 import asyncio
+import time
 import retrieval.models as models
-import gradio as gr
-from typing import List, Optional
-from agents import Agent, Runner, SQLiteSession
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+from agents import Agent, Runner
 from openai import OpenAI
-from core.session import ChatSession, reset_session
-from core.embeddings import get_embedding
-from retrieval.index import get_pinecone_index
-from ingest.uploader import ALLOWED_NAMESPACES, uploader
+from openai.types.responses import ResponseTextDeltaEvent
+from core.cache import answer_cache, depends_on_history
+from core.clients import get_openai_client
+from core.classifier import intent_classifier
+from core.metrics import add_tokens, metrics, start_metrics_exporter
+from core.ratelimit import (
+    BACKGROUND,
+    COMPLETION_ESTIMATE,
+    INTERACTIVE,
+    acall_with_retry,
+    get_limiter,
+)
+from core.session import (
+    SESSION_RUN_CONFIG,
+    WINDOW_SESSION_RUN_CONFIG,
+    SessionStore,
+    StoredSession,
+    reset_session,
+)
+from core.embeddings import embedding_dimensions, get_embedding, shorten_embedding
+from retrieval.index import index_manager
+from retrieval.rerank import rerank_matches, rerank_settings
+from retrieval.sparse import get_retrieval_mode, hybrid_query
+from ingest.jobs import IngestJobs, JobStore
+from ingest.uploader import ALLOWED_NAMESPACES
 from core.presets import (
     ENHANCER_PROMPTS,
+    HISTORY_SUMMARY_PROMPT,
     INSTRUCTION_CLASSIFIER,
-    SESSION_RUN_CONFIG,
+    INSTRUCTION_CLASSIFIER_BATCH,
     build_answer_instructions,
+    build_classifier_batch_input,
+)
+from core.utils import (
+    pack_context,
+    ensure_environment_ready,
+    env_choice,
+    env_float,
+    env_int,
+    estimate_tokens,
 )
-from core.utils import build_context, ensure_environment_ready
-from retrieval.query import query_pinecone
 
+if TYPE_CHECKING:
+    import gradio as gr
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CLASSIFIER_MODES = ("llm", "local")
+SPECULATIVE_MODES = ("off", "embed", "retrieve")
+
+# Strong references to fire-and-forget tasks, and sessions being summarized
+_background_tasks: Set[asyncio.Task] = set()
+_compacting: Set[str] = set()
+
+
+class _TurnPlan(NamedTuple):
+    agent: Optional[Agent]
+    agent_input: str
+    label: str
+    cache_namespace: Optional[str] = None
+    embedding: Optional[List[float]] = None
+    cached_answer: Optional[str] = None
+    intent: str = ""
+
+
+def _estimate_agent_tokens(agent: Agent, agent_input: str) -> int:
+    instructions = agent.instructions if isinstance(agent.instructions, str) else ""
+    return (
+        estimate_tokens(instructions)
+        + estimate_tokens(agent_input)
+        + COMPLETION_ESTIMATE
+    )
+
+
+async def _run_agent(
+    agent: Agent,
+    agent_input: str,
+    priority: str = INTERACTIVE,
+    session: Optional[StoredSession] = None,
+    run_config=None,
+):
+    # Every model call shares the chat quota with ingestion through one scheduler
+    keep = session.pending if session is not None else 0
+    return await acall_with_retry(
+        get_limiter("chat"),
+        lambda: Runner.run(agent, agent_input, session=session, run_config=run_config),
+        _estimate_agent_tokens(agent, agent_input),
+        priority,
+        lambda result: result.context_wrapper.usage.total_tokens,
+        on_retry=(lambda: session.discard_pending(keep)) if session else None,
+    )
+
 
 async def _enhance_query(intent: str, user_text: str):
     enhancer_instructions = ENHANCER_PROMPTS.get(intent)
     if enhancer_instructions:
         enhancer = Agent(name="Enhancer", instructions=enhancer_instructions)
-        enhance_response = await Runner.run(enhancer, user_text)
-        logger.info(
-            f"{enhance_response.context_wrapper.usage.total_tokens} tokens used for enhancement"
-        )
+        with metrics.span("stage_seconds", stage="enhance", intent=intent):
+            enhance_response = await _run_agent(enhancer, user_text)
+        _record_tokens("enhancement", "enhance", intent, enhance_response)
         return (enhance_response.final_output or user_text).strip()
     return user_text
 
 
+def _record_tokens(label: str, stage: str, intent: str, result) -> None:
+    tokens = result.context_wrapper.usage.total_tokens
+    logger.info(f"{tokens} tokens used for {label}")
+    metrics.observe("stage_tokens", tokens, stage=stage, intent=intent)
+    add_tokens(stage, tokens)
+
+
 async def _get_embedding_task(client: OpenAI, user_text: str):
     try:
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, get_embedding, client, user_text)
+        with metrics.span("stage_seconds", stage="embed", intent=""):
+            return await loop.run_in_executor(None, get_embedding, client, user_text)
     except Exception:
         return None
 
 
+async def _classify_with_llm(user_text: str) -> str:
+    classifier = Agent(name="Classifier", instructions=INSTRUCTION_CLASSIFIER)
+    with metrics.span("stage_seconds", stage="classify", intent="") as labels:
+        classify_res = await _run_agent(classifier, user_text)
+        intent = (
+            (classify_res.final_output or "other_unrelated")
+            .strip()
+            .lower()
+            .replace("-", "_")
+        )
+        labels["intent"] = intent
+    _record_tokens("classification", "classify", intent, classify_res)
+    return intent
+
+
+def _parse_intents(content: Optional[str], count: int) -> List[Optional[str]]:
+    # Keeps known categories; anything missing is classified again on its own
+    intents: List[Optional[str]] = [None] * count
+    try:
+        data = json.loads(content or "")
+    except ValueError:
+        return intents
+    items = data.get("queries") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return intents
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        query_id, category = item.get("id"), item.get("category")
+        if not isinstance(query_id, int) or not 0 <= query_id < count:
+            continue
+        if not isinstance(category, str):
+            continue
+        intent = category.strip().lower().replace("-", "_")
+        if intent in ALLOWED_NAMESPACES or intent == "other_unrelated":
+            intents[query_id] = intent
+    return intents
+
+
+async def _classify_group(questions: Sequence[str]) -> Tuple[List[Optional[str]], int]:
+    # One classifier call for many independent questions, e.g. a batch run
+    classifier = Agent(
+        name="BatchClassifier", instructions=INSTRUCTION_CLASSIFIER_BATCH
+    )
+    with metrics.span("stage_seconds", stage="classify_batch", intent=""):
+        result = await _run_agent(
+            classifier, build_classifier_batch_input(list(enumerate(questions)))
+        )
+    tokens = result.context_wrapper.usage.total_tokens
+    logger.info(f"{tokens} tokens used for classifying {len(questions)} question(s)")
+    metrics.observe("stage_tokens", tokens, stage="classify_batch", intent="")
+    return _parse_intents(result.final_output, len(questions)), tokens
+
+
+async def _classify_locally(
+    client: OpenAI, embedding: Optional[List[float]]
+) -> Optional[str]:
+    if not embedding:
+        return None
+    try:
+        await asyncio.to_thread(intent_classifier.ensure, client, index_manager.get())
+    except Exception as ex:
+        logger.warning(f"Local classifier unavailable: {ex}")
+        return None
+    with metrics.span("stage_seconds", stage="classify_local", intent="") as labels:
+        intent, margin = intent_classifier.classify(
+            embedding, env_float("CLASSIFIER_MARGIN", 0.03)
+        )
+        labels["intent"] = intent or ""
+    logger.info(f"Local classifier margin {margin:.3f} -> {intent or 'fallback'}")
+    return intent
+
+
+async def _retrieve(
+    embedding: List[float], namespace: str, query_text: str
+) -> List[models.Match]:
+    settings = rerank_settings(namespace)
+    rerank = settings.mode != "off"
+    top_k = settings.fetch_k if rerank else settings.top_k
+    embedding = shorten_embedding(embedding, embedding_dimensions(namespace))
+    with metrics.span("stage_seconds", stage="retrieve", intent=namespace):
+        if get_retrieval_mode() == "hybrid":
+            dense, sparse = hybrid_query(namespace, embedding, query_text)
+            matches = await index_manager.aquery(
+                dense, namespace, top_k, sparse, rerank
+            )
+        else:
+            matches = await index_manager.aquery(
+                embedding, namespace, top_k, include_values=rerank
+            )
+    if not rerank:
+        return matches
+
+    started = time.perf_counter()
+    reranked = rerank_matches(matches, embedding, settings)
+    metrics.observe(
+        "stage_seconds",
+        time.perf_counter() - started,
+        stage="rerank",
+        intent=namespace,
+    )
+    logger.info(
+        f"Reranked {len(matches)} -> {len(reranked)} match(es) in {namespace} "
+        f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return reranked
+
+
+class _Speculation:
+    # Intent-independent work started while the LLM classifier runs
+    def __init__(
+        self,
+        client: OpenAI,
+        user_text: str,
+        embedding: Optional[List[float]],
+        retrieve: bool,
+        namespace_limit: int,
+    ) -> None:
+        self.started = time.perf_counter()
+        self.finished: dict[str, float] = {}
+        self.namespace_limit = namespace_limit
+        self.client = client
+        self.namespaces: Optional[List[str]] = None
+        self.user_text = user_text
+        self.embedding_task = asyncio.create_task(
+            self._embed(client, user_text, embedding)
+        )
+        self.retrieval_task = (
+            asyncio.create_task(self._retrieve()) if retrieve else None
+        )
+
+    async def _embed(
+        self, client: OpenAI, user_text: str, embedding: Optional[List[float]]
+    ) -> Optional[List[float]]:
+        if embedding is None:
+            embedding = await _get_embedding_task(client, user_text)
+        self.finished["embedding"] = time.perf_counter()
+        return embedding
+
+    async def _plan(self, embedding: List[float]) -> List[str]:
+        if self.namespaces is not None:
+            return self.namespaces
+        # Prototypes are built on the first speculative turn, then rank the namespaces
+        if not intent_classifier.ready:
+            try:
+                await asyncio.to_thread(
+                    intent_classifier.ensure, self.client, index_manager.get()
+                )
+            except Exception as ex:
+                logger.warning(f"Local classifier unavailable: {ex}")
+        namespaces = list(ALLOWED_NAMESPACES)
+        if intent_classifier.ready:
+            ranked = intent_classifier.rank(embedding)
+            namespaces = [ns for ns in ranked if ns in ALLOWED_NAMESPACES]
+        self.namespaces = namespaces[: self.namespace_limit]
+        return self.namespaces
+
+    async def _retrieve(self) -> dict[str, List[models.Match]]:
+        embedding = await self.embedding_task
+        if not embedding:
+            return {}
+        namespaces = await self._plan(embedding)
+        results = await asyncio.gather(
+            *(_retrieve(embedding, ns, self.user_text) for ns in namespaces)
+        )
+        self.finished["retrieval"] = time.perf_counter()
+        return dict(zip(namespaces, results))
+
+    async def embedding(self) -> Optional[List[float]]:
+        return await self.embedding_task
+
+    async def results(self, namespace: str) -> Optional[List[models.Match]]:
+        if self.retrieval_task is None:
+            return None
+        embedding = await self.embedding_task
+        if not embedding or namespace not in await self._plan(embedding):
+            self.retrieval_task.cancel()
+            await asyncio.gather(self.retrieval_task, return_exceptions=True)
+            return None
+        return (await self.retrieval_task).get(namespace)
+
+    def saved(self, classified_at: float, used: List[str]) -> float:
+        # Work overlapped with classification is latency the turn no longer pays
+        overlaps = [
+            min(self.finished.get(stage, classified_at), classified_at) - self.started
+            for stage in used
+        ]
+        return max(overlaps, default=0.0)
+
+    async def cancel(self) -> None:
+        tasks = [t for t in (self.embedding_task, self.retrieval_task) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 async def _handle_message(
     user_message: str,
     chat_history: Optional[List[dict]],
-    chat_session: ChatSession,
+    session_id: Optional[str],
+    session_store: SessionStore,
     client: OpenAI,
 ):
-    session = chat_session.ensure()
-    response = await _run_turn(session, user_message, client)
-    history = chat_history or []
-    updated_history = history + [
-        {"role": "user", "content": user_message},
-        {"role": "assistant", "content": response},
-    ]
-    return updated_history, ""
+    # Each browser tab keeps its own session id in gr.State
+    session = session_store.session(session_id)
+    history = (chat_history or []) + [{"role": "user", "content": user_message}]
+    yield history, "", session.session_id
+    async for partial in _stream_turn(session, user_message, client):
+        yield (
+            history + [{"role": "assistant", "content": partial}],
+            "",
+            session.session_id,
+        )
 
 
-async def _run_turn(session: SQLiteSession, user_text: str, client: OpenAI) -> str:
-    # Classification
-    classifier = Agent(name="Classifier", instructions=INSTRUCTION_CLASSIFIER)
-    classify_res = await Runner.run(classifier, user_text)
-    intent = (
-        (classify_res.final_output or "other_unrelated")
-        .strip()
-        .lower()
-        .replace("-", "_")
+async def _use_answer_cache(session: StoredSession, user_text: str) -> bool:
+    if not answer_cache.enabled:
+        return False
+    if depends_on_history(user_text) and await session.get_items(limit=1):
+        answer_cache.bypass()
+        metrics.inc("cache_requests_total", cache="answer", result="bypass")
+        return False
+    return True
+
+
+async def _save_cached_turn(session: StoredSession, user_text: str, answer: str):
+    await session.add_items(
+        [
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": answer},
+        ]
     )
 
+
+def _remember_answer(plan: _TurnPlan, answer: str) -> None:
+    if plan.cache_namespace and plan.embedding and answer:
+        answer_cache.put(plan.cache_namespace, plan.embedding, answer)
+
+
+async def _prepare_turn(
+    session: StoredSession,
+    user_text: str,
+    client: OpenAI,
+    embedding: Optional[List[float]] = None,
+    intent: Optional[str] = None,
+) -> _TurnPlan:
+    # Classification; callers that embedded or classified in bulk pass the results in
+    speculation: Optional[_Speculation] = None
+    classified_at = 0.0
+    if (
+        intent is None
+        and env_choice("CLASSIFIER_MODE", "llm", CLASSIFIER_MODES) == "local"
+    ):
+        if embedding is None:
+            embedding = await _get_embedding_task(client, user_text)
+        intent = await _classify_locally(client, embedding)
+    if intent is None:
+        speculative_mode = env_choice("SPECULATIVE_MODE", "off", SPECULATIVE_MODES)
+        if speculative_mode != "off":
+            speculation = _Speculation(
+                client,
+                user_text,
+                embedding,
+                retrieve=speculative_mode == "retrieve",
+                namespace_limit=env_int("SPECULATIVE_NAMESPACES", 2),
+            )
+        try:
+            intent = await _classify_with_llm(user_text)
+        except BaseException:
+            if speculation is not None:
+                await speculation.cancel()
+            raise
+        classified_at = time.perf_counter()
+
     logger.info(f"Classified intent: {intent}")
-    logger.info(
-        f"{classify_res.context_wrapper.usage.total_tokens} tokens used for classification"
-    )
 
     if intent == "other_unrelated":
-        other_unrelated = Agent(name="other_unrelated")
-        final = await Runner.run(
-            other_unrelated,
+        if speculation is not None:
+            await speculation.cancel()
+        return _TurnPlan(
+            Agent(name="other_unrelated"),
             user_text,
-            session=session,
-            run_config=SESSION_RUN_CONFIG,
+            "other_unrelated",
+            intent=intent,
         )
-        logger.info(
-            f"{final.context_wrapper.usage.total_tokens} tokens used for other_unrelated"
+
+    # Answer cache
+    use_cache = await _use_answer_cache(session, user_text)
+    if use_cache:
+        if speculation is not None:
+            embedding = await speculation.embedding()
+        elif embedding is None:
+            embedding = await _get_embedding_task(client, user_text)
+        cached = answer_cache.get(intent, embedding) if embedding else None
+        metrics.inc(
+            "cache_requests_total",
+            cache="answer",
+            result="miss" if cached is None else "hit",
         )
-        return (final.final_output or "Something went wrong, please try again.").strip()
+        if cached is not None:
+            if speculation is not None:
+                await speculation.cancel()
+            logger.info(f"Answer cache hit: {answer_cache.stats()}")
+            return _TurnPlan(
+                None, user_text, "cached answer", cached_answer=cached, intent=intent
+            )
 
     # Parallel
-    enhanced_query, embedding = await asyncio.gather(
-        _enhance_query(intent, user_text), _get_embedding_task(client, user_text)
-    )
+    prefetched: Optional[List[models.Match]] = None
+    if speculation is not None:
+        try:
+            enhanced_query, embedding = await asyncio.gather(
+                _enhance_query(intent, user_text), speculation.embedding()
+            )
+            prefetched = await speculation.results(intent)
+        except BaseException:
+            await speculation.cancel()
+            raise
+        used = ["embedding"] if prefetched is None else ["retrieval"]
+        saved = speculation.saved(classified_at, used)
+        logger.info(f"Speculation saved {saved * 1000:.0f} ms ({', '.join(used)})")
+    elif embedding is None:
+        enhanced_query, embedding = await asyncio.gather(
+            _enhance_query(intent, user_text), _get_embedding_task(client, user_text)
+        )
+    else:
+        # The embedding is already known, so retrieval need not wait for the enhancer
+        enhanced_query, prefetched = await asyncio.gather(
+            _enhance_query(intent, user_text), _retrieve(embedding, intent, user_text)
+        )
 
-    index = get_pinecone_index()
     results: List[models.Match] = []
-    if index and embedding:
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(
-            None, query_pinecone, index, embedding, intent, 5
-        )
+    if prefetched is not None:
+        results = prefetched
+    elif embedding:
+        results = await _retrieve(embedding, intent, user_text)
 
-    concatenated = build_context(results)
-    instructions = build_answer_instructions(concatenated)
+    packed = pack_context(
+        results,
+        env_int("CONTEXT_TOKEN_BUDGET", 3000),
+        env_float("CONTEXT_DEDUP_SIMILARITY", 0.8),
+    )
+    logger.info(
+        f"Context: {packed.matches} match(es) packed into {packed.passages} passage(s), "
+        f"{packed.tokens} tokens ({packed.saved_tokens} saved)"
+    )
+    metrics.observe("stage_tokens", packed.tokens, stage="context", intent=intent)
+    instructions = build_answer_instructions(packed.text)
     answer_agent = Agent(name="Answer", instructions=instructions)
-    final = await Runner.run(
+    return _TurnPlan(
         answer_agent,
         enhanced_query,
+        "final answer",
+        cache_namespace=intent if use_cache else None,
+        embedding=embedding,
+        intent=intent,
+    )
+
+
+def _session_run_config(session: StoredSession):
+    return SESSION_RUN_CONFIG if session.window is None else WINDOW_SESSION_RUN_CONFIG
+
+
+async def _compact_session(session: StoredSession) -> None:
+    # Folds items that left the history window into the session's rolling summary
+    keep = session.window // 2
+    summary, items, through = await asyncio.to_thread(
+        session.store.unsummarized, session.session_id, keep
+    )
+    if len(items) <= session.window - keep:
+        return
+
+    lines = [
+        f"{item.get('role', 'message')}: {item.get('content')}"
+        for item in items
+        if isinstance(item, dict) and isinstance(item.get("content"), str)
+    ]
+    summarizer = Agent(name="Summarizer", instructions=HISTORY_SUMMARY_PROMPT)
+    with metrics.span("stage_seconds", stage="summarize", intent=""):
+        result = await _run_agent(
+            summarizer,
+            f"Previous summary:\n{summary or '(none)'}\n\nNew messages:\n"
+            + "\n".join(lines),
+            BACKGROUND,
+        )
+    _record_tokens("history summary", "summarize", "", result)
+    new_summary = (result.final_output or "").strip()
+    if new_summary:
+        await asyncio.to_thread(
+            session.store.save_summary, session.session_id, new_summary, through
+        )
+
+
+def _schedule_compaction(session: StoredSession) -> None:
+    if session.window is None or session.session_id in _compacting:
+        return
+    _compacting.add(session.session_id)
+
+    async def run() -> None:
+        try:
+            await _compact_session(session)
+        except Exception as ex:
+            logger.warning(f"History summary failed: {ex}")
+        finally:
+            _compacting.discard(session.session_id)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _run_turn(
+    session: StoredSession,
+    user_text: str,
+    client: OpenAI,
+    embedding: Optional[List[float]] = None,
+    intent: Optional[str] = None,
+) -> str:
+    try:
+        with metrics.span("stage_seconds", stage="turn", intent="") as labels:
+            plan = await _prepare_turn(session, user_text, client, embedding, intent)
+            labels["intent"] = plan.intent
+            if plan.cached_answer is not None:
+                await _save_cached_turn(session, user_text, plan.cached_answer)
+                return plan.cached_answer
+
+            with metrics.span("stage_seconds", stage="answer", intent=plan.intent):
+                final = await _run_agent(
+                    plan.agent,
+                    plan.agent_input,
+                    session=session,
+                    run_config=_session_run_config(session),
+                )
+        _record_tokens(plan.label, "answer", plan.intent, final)
+        answer = (final.final_output or "").strip()
+        _remember_answer(plan, answer)
+        return answer or "Something went wrong, please try again."
+    finally:
+        await session.flush()
+        _schedule_compaction(session)
+
+
+async def _stream_turn(
+    session: StoredSession, user_text: str, client: OpenAI
+) -> AsyncIterator[str]:
+    try:
+        with metrics.span("stage_seconds", stage="turn", intent="") as labels:
+            async for text in _stream_answer(session, user_text, client, labels):
+                yield text
+    finally:
+        await session.flush()
+        _schedule_compaction(session)
+
+
+async def _stream_answer(
+    session: StoredSession, user_text: str, client: OpenAI, turn_labels: dict
+) -> AsyncIterator[str]:
+    plan = await _prepare_turn(session, user_text, client)
+    turn_labels["intent"] = plan.intent
+    if plan.cached_answer is not None:
+        await _save_cached_turn(session, user_text, plan.cached_answer)
+        yield plan.cached_answer
+        return
+
+    # A stream cannot be replayed once text reached the user, so it is only rate limited
+    limiter = get_limiter("chat")
+    tokens = _estimate_agent_tokens(plan.agent, plan.agent_input)
+    await limiter.aacquire(tokens, INTERACTIVE)
+    started = time.perf_counter()
+    result = Runner.run_streamed(
+        plan.agent,
+        plan.agent_input,
         session=session,
-        run_config=SESSION_RUN_CONFIG,
+        run_config=_session_run_config(session),
     )
-    logger.info(
-        f"{final.context_wrapper.usage.total_tokens} tokens used for final answer"
+    text = ""
+    async for event in result.stream_events():
+        if event.type == "raw_response_event" and isinstance(
+            event.data, ResponseTextDeltaEvent
+        ):
+            if not text:
+                metrics.observe(
+                    "stage_seconds",
+                    time.perf_counter() - started,
+                    stage="first_token",
+                    intent=plan.intent,
+                )
+            text += event.data.delta
+            yield text
+    metrics.observe(
+        "stage_seconds",
+        time.perf_counter() - started,
+        stage="answer",
+        intent=plan.intent,
     )
-    return final.final_output or "Something went wrong, please try again."
+    limiter.settle(tokens, result.context_wrapper.usage.total_tokens)
+    _record_tokens(plan.label, "answer", plan.intent, result)
+    final = str(result.final_output or "").strip()
+    _remember_answer(plan, final)
+    if not final:
+        final = "Something went wrong, please try again."
+    if final != text:
+        yield final
 
 
-def _build_gradio_app(client: OpenAI, session_db: str):
-    chat_session = ChatSession(session_db)
+def _build_gradio_app(client: OpenAI, session_db: str, ingest_jobs: IngestJobs):
+    # Gradio takes seconds to import, so only the UI loads it
+    import gradio as gr
+
+    session_store = SessionStore(session_db)
     handle = functools.partial(
-        _handle_message, chat_session=chat_session, client=client
+        _handle_message, session_store=session_store, client=client
     )
-    reset = functools.partial(reset_session, chat_session=chat_session)
-    upload = functools.partial(uploader, client=client)
+    reset = functools.partial(reset_session, store=session_store)
 
     with gr.Blocks() as demo:
         with gr.Row():
@@ -137,6 +664,7 @@ def _build_gradio_app(client: OpenAI, session_db: str):
                 with gr.Row():
                     send_button = gr.Button("Send", variant="primary")
                     reset_button = gr.Button("Reset", variant="secondary")
+                session_id = gr.State(None)
 
             with gr.Column(scale=3):
                 gr.Markdown("### Document uploader")
@@ -150,45 +678,81 @@ def _build_gradio_app(client: OpenAI, session_db: str):
                     file_count="multiple",
                     file_types=[".txt"],
                 )
-                upload_button = gr.Button("Upload", variant="primary")
+                with gr.Row():
+                    upload_button = gr.Button("Upload", variant="primary")
+                    cancel_button = gr.Button("Cancel upload", variant="secondary")
                 upload_output = gr.Textbox(
                     label="Upload log",
                     show_copy_button=True,
                     lines=10,
                 )
+                upload_job = gr.State(None)
+                upload_poll = gr.Timer(1.0)
 
         message_box.submit(
             handle,
-            inputs=[message_box, chatbot],
-            outputs=[chatbot, message_box],
+            inputs=[message_box, chatbot, session_id],
+            outputs=[chatbot, message_box, session_id],
         )
         send_button.click(
             handle,
-            inputs=[message_box, chatbot],
-            outputs=[chatbot, message_box],
+            inputs=[message_box, chatbot, session_id],
+            outputs=[chatbot, message_box, session_id],
         )
         reset_button.click(
             reset,
-            outputs=[chatbot, message_box],
+            inputs=[session_id],
+            outputs=[chatbot, message_box, session_id],
         )
         upload_button.click(
-            upload,
+            ingest_jobs.submit,
             inputs=[namespace_input, file_input],
+            outputs=[upload_job, upload_output],
+        )
+        cancel_button.click(
+            ingest_jobs.cancel,
+            inputs=[upload_job],
             outputs=[upload_output],
         )
+        # Progress is polled from the job store; an idle tick leaves the log untouched
+        upload_poll.tick(
+            lambda job_id: ingest_jobs.render(job_id) if job_id else gr.skip(),
+            inputs=[upload_job],
+            outputs=[upload_output],
+            show_progress="hidden",
+        )
 
     return demo
 
 
-def _build_app() -> gr.Blocks:
+def _build_app() -> "gr.Blocks":
     ensure_environment_ready()
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    client = get_openai_client()
     session_db = "conversation.db"
-    return _build_gradio_app(client, session_db)
+    ingest_jobs = IngestJobs(
+        JobStore("ingest_jobs.db"),
+        client,
+        os.environ.get("INGEST_JOB_FILES_DIR") or "ingest_files",
+    )
+    start_metrics_exporter()
+    resumed = ingest_jobs.resume()
+    if resumed:
+        logger.info(f"Resuming {resumed} unfinished upload file(s)")
+    if index_manager.warm():
+        logger.info(f"Vector index ready: {index_manager.stats()}")
+    else:
+        logger.warning("Vector index unavailable, answers will have no context")
+    return _build_gradio_app(client, session_db, ingest_jobs)
 
 
-demo = _build_app()
+def __getattr__(name: str):
+    # `demo` is built on first access; importing main for turns or tooling stays cheap
+    if name == "demo":
+        demo = _build_app()
+        globals()["demo"] = demo
+        return demo
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    demo.launch()
+    _build_app().launch()
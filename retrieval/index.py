@@ -1,14 +1,194 @@
+import asyncio
+import logging
 import os
-from pinecone import Pinecone
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+import retrieval.models as models
+from core.embeddings import embedding_dimensions
+from core.presets import ALLOWED_NAMESPACES
+from core.utils import env_choice, env_int
+from retrieval.local_index import LocalIndex
+from retrieval.query import query_pinecone
 
 
-def get_pinecone_index():
+VECTOR_BACKENDS = ("pinecone", "local")
+
+logger = logging.getLogger(__name__)
+
+
+def get_vector_backend() -> str:
+    return env_choice("VECTOR_BACKEND", "pinecone", VECTOR_BACKENDS)
+
+
+def _build_index(pool_size: int):
+    if get_vector_backend() == "local":
+        return LocalIndex(os.environ.get("LOCAL_INDEX_DIR") or "local_index")
+
     index_name = os.environ.get("PINECONE_INDEX")
     api_key = os.environ.get("PINECONE_API_KEY")
     if not index_name or not api_key:
         return None
+    # Imported on first use; the local backend and tooling never load the Pinecone client
+    from pinecone import Pinecone
+
     try:
-        pc = Pinecone(api_key=api_key)
-        return pc.Index(index_name)
+        pc = Pinecone(api_key=api_key, pool_threads=pool_size)
+        return pc.Index(
+            index_name,
+            pool_threads=pool_size,
+            connection_pool_maxsize=pool_size,
+        )
     except Exception:
         return None
+
+
+def _stats_field(stats, name: str):
+    if isinstance(stats, dict):
+        return stats.get(name)
+    return getattr(stats, name, None)
+
+
+def check_dimensions(index, stats=None) -> None:
+    # Fails at startup when a namespace's configured width does not match what is stored
+    problems: List[str] = []
+    if isinstance(index, LocalIndex):
+        for namespace in ALLOWED_NAMESPACES:
+            stored, wanted = index.dimension(namespace), embedding_dimensions(namespace)
+            if stored and stored != wanted:
+                problems.append(
+                    f"{namespace} is stored at {stored} dimensions but configured for "
+                    f"{wanted}; delete {index.root / namespace} and upload its files "
+                    "again (cached embeddings are reused)"
+                )
+    else:
+        # A Pinecone index has one dimension shared by every namespace
+        dimension = _stats_field(stats, "dimension")
+        for namespace in ALLOWED_NAMESPACES:
+            wanted = embedding_dimensions(namespace)
+            if dimension and wanted != dimension:
+                problems.append(
+                    f"{namespace} is configured for {wanted} dimensions but the "
+                    f"Pinecone index has {dimension}; set EMBEDDING_DIMENSIONS to "
+                    f"{dimension} (per-namespace widths need VECTOR_BACKEND=local)"
+                )
+    if problems:
+        raise RuntimeError("Embedding width mismatch: " + "; ".join(problems))
+
+
+class IndexManager:
+    # One index handle per process, shared by every Gradio worker thread
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._index = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pool_size = 0
+        self.builds = 0
+        self.reuses = 0
+        self.queries = 0
+
+    def get(self):
+        index = self._index
+        if index is not None:
+            with self._lock:
+                self.reuses += 1
+            return index
+
+        with self._lock:
+            if self._index is None:
+                self.pool_size = max(1, env_int("PINECONE_POOL_SIZE", 16))
+                self._index = _build_index(self.pool_size)
+                if self._index is not None:
+                    self.builds += 1
+            else:
+                self.reuses += 1
+            return self._index
+
+    def warm(self) -> bool:
+        index = self.get()
+        if index is None:
+            return False
+        describe = getattr(index, "describe_index_stats", None)
+        stats = None
+        if callable(describe):
+            try:
+                stats = describe()
+            except Exception as ex:
+                logger.warning(f"Index warm-up failed: {ex}")
+                return False
+        check_dimensions(index, stats)
+        return True
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, self.pool_size),
+                    thread_name_prefix="index-query",
+                )
+            return self._executor
+
+    async def aquery(
+        self,
+        embedding: Sequence[float],
+        namespace: str,
+        top_k: int = 5,
+        sparse_vector: Optional[models.SparseValues] = None,
+        include_values: bool = False,
+    ) -> List[models.Match]:
+        index = self.get()
+        if index is None:
+            return []
+        executor = self._get_executor()
+        with self._lock:
+            self.queries += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor,
+            query_pinecone,
+            index,
+            embedding,
+            namespace,
+            top_k,
+            sparse_vector,
+            include_values,
+        )
+
+    def stats(self) -> dict:
+        connections = 0
+        requests = 0
+        rest_client = getattr(
+            getattr(self._index, "_api_client", None), "rest_client", None
+        )
+        pools = getattr(getattr(rest_client, "pool_manager", None), "pools", None)
+        if pools is not None:
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                connections += getattr(pool, "num_connections", 0)
+                requests += getattr(pool, "num_requests", 0)
+
+        with self._lock:
+            return {
+                "backend": get_vector_backend(),
+                "pool_size": self.pool_size,
+                "handle_builds": self.builds,
+                "handle_reuses": self.reuses,
+                "queries": self.queries,
+                "connections_opened": connections,
+                "http_requests": requests,
+                "connection_reuses": max(0, requests - connections),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self._index = None
+
+
+index_manager = IndexManager()
+
+
+def get_pinecone_index():
+    return index_manager.get()
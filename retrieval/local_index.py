@@ -0,0 +1,602 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from core.utils import env_float
+from retrieval.quantize import (
+    QUANTIZATION_MODES,
+    approximate_scores,
+    code_width,
+    quantization_settings,
+    quantize,
+)
+
+_Codes = Tuple[np.ndarray, Optional[np.ndarray]]
+# Rows copied at a time while compacting
+_COMPACT_ROWS = 1 << 14
+# Sibling folders a namespace is compacted into and moved out of
+_COMPACT_SUFFIXES = (".compact", ".old")
+
+
+def _truncate(path: Path, size: int) -> None:
+    if path.exists() and path.stat().st_size > size:
+        with path.open("r+b") as f:
+            f.truncate(size)
+
+
+class _Namespace:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.dimension = 0
+        self.count = 0
+        self.matrix: Optional[np.memmap] = None
+        self.offsets: Optional[np.ndarray] = None
+        self.rows_by_id: Optional[Dict[str, int]] = None
+        self.dead: Optional[np.ndarray] = None
+        self.postings: Optional[Dict[int, Tuple[np.ndarray, np.ndarray]]] = None
+        self.codes: Dict[str, _Codes] = {}
+        self._finish_compaction()
+        self._load_header()
+
+    @property
+    def vectors_file(self) -> Path:
+        return self.path / "vectors.f32"
+
+    @property
+    def metadata_file(self) -> Path:
+        return self.path / "metadata.jsonl"
+
+    @property
+    def offsets_file(self) -> Path:
+        return self.path / "offsets.i64"
+
+    @property
+    def ids_file(self) -> Path:
+        return self.path / "ids.txt"
+
+    @property
+    def sparse_file(self) -> Path:
+        return self.path / "sparse.jsonl"
+
+    @property
+    def deleted_file(self) -> Path:
+        return self.path / "deleted.i64"
+
+    @property
+    def header_file(self) -> Path:
+        return self.path / "namespace.json"
+
+    def _sibling(self, suffix: str) -> Path:
+        return self.path.with_name(self.path.name + suffix)
+
+    def code_files(self, mode: str) -> Tuple[Path, Optional[Path]]:
+        if mode == "int8":
+            return self.path / "vectors.i8", self.path / "scales.f32"
+        return self.path / "vectors.b1", None
+
+    def _load_header(self) -> None:
+        if self.header_file.exists():
+            header = json.loads(self.header_file.read_text(encoding="utf-8"))
+            self.dimension = int(header["dimension"])
+            self.count = int(header["count"])
+        if self.path.exists():
+            self._discard_unfinished()
+
+    def _discard_unfinished(self) -> None:
+        # Rows are appended before the header is written, so anything past count
+        # is from an upsert that never finished. Trailing metadata records are
+        # left in place: only offsets.i64 points into metadata.jsonl.
+        _truncate(self.vectors_file, self.count * self.dimension * 4)
+        _truncate(self.offsets_file, self.count * 8)
+        for mode in QUANTIZATION_MODES[1:]:
+            codes_file, scales_file = self.code_files(mode)
+            _truncate(codes_file, self.count * code_width(mode, self.dimension))
+            if scales_file is not None:
+                _truncate(scales_file, self.count * 4)
+
+        replaced: List[int] = []
+        if self.ids_file.exists():
+            with self.ids_file.open("rb") as f:
+                lines = f.readlines()
+            if len(lines) > self.count or (lines and not lines[-1].endswith(b"\n")):
+                lines = lines[: self.count]
+                with self.ids_file.open("wb") as f:
+                    f.writelines(lines)
+            rows: Dict[bytes, int] = {}
+            for row, line in enumerate(lines):
+                previous = rows.get(line)
+                if previous is not None:
+                    replaced.append(previous)
+                rows[line] = row
+
+        if self.deleted_file.exists():
+            _truncate(self.deleted_file, self.deleted_file.stat().st_size // 8 * 8)
+            deleted = np.fromfile(self.deleted_file, dtype=np.int64)
+            if (deleted >= self.count).any():
+                deleted = deleted[deleted < self.count]
+                deleted.tofile(self.deleted_file)
+        else:
+            deleted = np.empty(0, dtype=np.int64)
+        missing = np.setdiff1d(np.asarray(replaced, dtype=np.int64), deleted)
+        if len(missing):
+            with self.deleted_file.open("ab") as f:
+                f.write(missing.tobytes())
+
+        if self.sparse_file.exists():
+            kept: List[str] = []
+            changed = False
+            with self.sparse_file.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)["row"]
+                    except ValueError:
+                        row = self.count
+                    if row < self.count and line.endswith("\n"):
+                        kept.append(line)
+                    else:
+                        changed = True
+            if changed:
+                with self.sparse_file.open("w", encoding="utf-8") as f:
+                    f.writelines(kept)
+
+        self._invalidate()
+        self.rows_by_id = None
+        self.dead = None
+        self.postings = None
+        self.codes = {}
+
+    def _write_header(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        header = {"dimension": self.dimension, "count": self.count}
+        # Replaced in one step, so a crash leaves either the old count or the new
+        partial = self.header_file.with_suffix(".tmp")
+        partial.write_text(json.dumps(header), encoding="utf-8")
+        os.replace(partial, self.header_file)
+
+    def _invalidate(self) -> None:
+        self.matrix = None
+        self.offsets = None
+
+    def vectors(self) -> Optional[np.memmap]:
+        if self.count == 0:
+            return None
+        if self.matrix is None:
+            self.matrix = np.memmap(
+                self.vectors_file,
+                dtype=np.float32,
+                mode="r",
+                shape=(self.count, self.dimension),
+            )
+        return self.matrix
+
+    def metadata_offsets(self) -> np.ndarray:
+        if self.offsets is None:
+            self.offsets = np.fromfile(self.offsets_file, dtype=np.int64)
+        return self.offsets
+
+    def quantized(self, mode: str) -> _Codes:
+        # Compact codes for first-pass scoring, held in memory; vectors.f32 stays on disk
+        cached = self.codes.get(mode)
+        if cached is not None and len(cached[0]) == self.count:
+            return cached
+        codes_file, scales_file = self.code_files(mode)
+        width = code_width(mode, self.dimension)
+        dtype = np.int8 if mode == "int8" else np.uint8
+        if codes_file.exists() and codes_file.stat().st_size == self.count * width:
+            codes = np.fromfile(codes_file, dtype=dtype).reshape(self.count, width)
+            scales = np.fromfile(scales_file, dtype=np.float32) if scales_file else None
+            if scales is None or len(scales) == self.count:
+                self.codes[mode] = (codes, scales)
+                return self.codes[mode]
+
+        # Missing or stale: rebuilt from the full-precision vectors
+        codes, scales = quantize(self.vectors(), mode)
+        codes.tofile(codes_file)
+        if scales_file is not None and scales is not None:
+            scales.tofile(scales_file)
+        self.codes[mode] = (codes, scales)
+        return self.codes[mode]
+
+    def _update_codes(self, added: np.ndarray) -> None:
+        # Appended rows extend the code files; stale ones are left to be rebuilt
+        self.codes = {}
+        for mode in QUANTIZATION_MODES[1:]:
+            codes_file, scales_file = self.code_files(mode)
+            if not codes_file.exists():
+                continue
+            width = code_width(mode, self.dimension)
+            if codes_file.stat().st_size != self.count * width:
+                codes_file.unlink()
+                continue
+            codes, scales = quantize(added, mode)
+            with codes_file.open("ab") as f:
+                f.write(codes.tobytes())
+            if scales_file is not None and scales is not None:
+                with scales_file.open("ab") as f:
+                    f.write(scales.tobytes())
+
+    def dead_rows(self) -> np.ndarray:
+        # Deleted rows stay in the files and are masked out of every query
+        if self.dead is None or len(self.dead) != self.count:
+            dead = np.zeros(self.count, dtype=bool)
+            if self.deleted_file.exists():
+                dead[np.fromfile(self.deleted_file, dtype=np.int64)] = True
+            self.dead = dead
+        return self.dead
+
+    def ids(self) -> Dict[str, int]:
+        if self.rows_by_id is None:
+            rows: Dict[str, int] = {}
+            dead = self.dead_rows()
+            if self.ids_file.exists():
+                with self.ids_file.open(encoding="utf-8") as f:
+                    for row, line in enumerate(f):
+                        if not dead[row]:
+                            rows[line.rstrip("\n")] = row
+            self.rows_by_id = rows
+        return self.rows_by_id
+
+    def inverted_index(self) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        if self.postings is None:
+            rows_terms: Dict[int, Tuple[list, list]] = {}
+            if self.sparse_file.exists():
+                with self.sparse_file.open(encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        rows_terms[entry["row"]] = (entry["indices"], entry["values"])
+            lists: Dict[int, Tuple[List[int], List[float]]] = {}
+            for row, (indices, values) in rows_terms.items():
+                for idx, value in zip(indices, values):
+                    rows, weights = lists.setdefault(idx, ([], []))
+                    rows.append(row)
+                    weights.append(value)
+            self.postings = {
+                idx: (np.asarray(rows, np.int64), np.asarray(weights, np.float32))
+                for idx, (rows, weights) in lists.items()
+            }
+        return self.postings
+
+    def read_records(self, f, offsets: np.ndarray, rows: Sequence[int]) -> List[dict]:
+        # f is metadata.jsonl opened with the snapshot, so compaction cannot move it
+        records: List[dict] = []
+        for row in rows:
+            f.seek(int(offsets[row]))
+            records.append(json.loads(f.readline()))
+        return records
+
+    def needs_compaction(self, ratio: float) -> bool:
+        if self.count == 0 or ratio <= 0:
+            return False
+        return int(self.dead_rows().sum()) > ratio * self.count
+
+    def compact(self) -> None:
+        # Live rows are rewritten into a sibling folder that then replaces this one.
+        # Running queries keep the old files through the handles they already hold.
+        live = np.flatnonzero(~self.dead_rows())
+        new_rows = np.full(self.count, -1, dtype=np.int64)
+        new_rows[live] = np.arange(len(live))
+        target = _Namespace(self._sibling(".compact"))
+        if target.path.exists():
+            shutil.rmtree(target.path)
+        target.path.mkdir(parents=True)
+
+        matrix = self.vectors()
+        with target.vectors_file.open("wb") as f:
+            for start in range(0, len(live), _COMPACT_ROWS):
+                rows = live[start : start + _COMPACT_ROWS]
+                f.write(np.ascontiguousarray(matrix[rows]).tobytes())
+
+        with self.ids_file.open("rb") as src, target.ids_file.open("wb") as dst:
+            dst.writelines(line for row, line in enumerate(src) if new_rows[row] >= 0)
+
+        offsets = self.metadata_offsets()
+        new_offsets = np.empty(len(live), dtype=np.int64)
+        with self.metadata_file.open("rb") as src:
+            with target.metadata_file.open("wb") as dst:
+                for new_row, row in enumerate(live.tolist()):
+                    src.seek(int(offsets[row]))
+                    new_offsets[new_row] = dst.tell()
+                    dst.write(src.readline())
+        new_offsets.tofile(target.offsets_file)
+
+        if self.sparse_file.exists():
+            with self.sparse_file.open(encoding="utf-8") as src:
+                with target.sparse_file.open("w", encoding="utf-8") as dst:
+                    for line in src:
+                        entry = json.loads(line)
+                        if new_rows[entry["row"]] >= 0:
+                            entry["row"] = int(new_rows[entry["row"]])
+                            dst.write(json.dumps(entry) + "\n")
+
+        for mode in QUANTIZATION_MODES[1:]:
+            if not self.code_files(mode)[0].exists():
+                continue
+            codes, scales = self.quantized(mode)
+            codes_file, scales_file = target.code_files(mode)
+            codes[live].tofile(codes_file)
+            if scales is not None and scales_file is not None:
+                scales[live].tofile(scales_file)
+
+        target.dimension = self.dimension
+        target.count = len(live)
+        target._write_header()
+
+        old = self._sibling(".old")
+        if old.exists():
+            shutil.rmtree(old)
+        self.path.rename(old)
+        target.path.rename(self.path)
+        shutil.rmtree(old, ignore_errors=True)
+        self._load_header()
+
+    def _finish_compaction(self) -> None:
+        # A crash between the two renames leaves only the compacted folder
+        compacted, old = self._sibling(".compact"), self._sibling(".old")
+        if compacted.exists():
+            if self.path.exists():
+                shutil.rmtree(compacted)
+            else:
+                compacted.rename(self.path)
+        if old.exists():
+            shutil.rmtree(old)
+
+    def upsert(self, vectors: Sequence[dict]) -> int:
+        if not vectors:
+            return 0
+
+        dimension = len(vectors[0]["values"])
+        if self.dimension == 0:
+            self.dimension = dimension
+        matrix = np.array([v["values"] for v in vectors], dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[1] != self.dimension:
+            raise ValueError(
+                f"Vector dimension {matrix.shape[-1]} does not match namespace dimension "
+                f"{self.dimension}; delete {self.path} and upload its files again"
+            )
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+
+        # Last write wins for ids repeated within one batch
+        latest: Dict[str, int] = {}
+        for i, v in enumerate(vectors):
+            latest[str(v["id"])] = i
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        rows_by_id = self.ids()
+        offsets = self.metadata_offsets() if self.count else np.empty(0, np.int64)
+        self._invalidate()
+
+        # Replaced ids get a new row and their old one is deleted, so stored rows
+        # never change and queries can read them without the lock. New rows join
+        # rows_by_id only once the header counts them.
+        added: Dict[str, int] = {}
+        replaced_rows: List[int] = []
+        new_items: List[int] = []
+        new_offsets: List[int] = []
+        try:
+            with self.metadata_file.open("ab") as meta_f:
+                for vector_id, i in latest.items():
+                    record = {
+                        "id": vector_id,
+                        "metadata": vectors[i].get("metadata") or {},
+                    }
+                    new_offsets.append(meta_f.tell())
+                    meta_f.write(json.dumps(record).encode("utf-8") + b"\n")
+                    row = rows_by_id.get(vector_id)
+                    if row is not None:
+                        replaced_rows.append(row)
+                    added[vector_id] = self.count + len(added)
+                    new_items.append(i)
+
+            sparse_rows = [
+                (added[vector_id], vectors[i].get("sparse_values"))
+                for vector_id, i in latest.items()
+            ]
+            sparse_rows = [(row, sparse) for row, sparse in sparse_rows if sparse]
+            if sparse_rows:
+                with self.sparse_file.open("a", encoding="utf-8") as f:
+                    for row, sparse in sparse_rows:
+                        entry = {"row": row, **sparse}
+                        f.write(json.dumps(entry) + "\n")
+                self.postings = None
+
+            self._update_codes(matrix[new_items])
+            with self.vectors_file.open("ab") as f:
+                f.write(matrix[new_items].tobytes())
+            with self.ids_file.open("a", encoding="utf-8") as f:
+                f.writelines(f"{vector_id}\n" for vector_id in added)
+            offsets = np.concatenate([offsets, np.asarray(new_offsets, dtype=np.int64)])
+            offsets.tofile(self.offsets_file)
+
+            self.count += len(added)
+            self._write_header()
+        except BaseException:
+            # Back to what the header on disk counts, without the partial rows
+            self.dimension, self.count = 0, 0
+            self._load_header()
+            raise
+
+        # Replaced rows are marked deleted after the header; if that write is lost
+        # the next load deletes them again from the repeated ids
+        if replaced_rows:
+            with self.deleted_file.open("ab") as f:
+                f.write(np.asarray(replaced_rows, dtype=np.int64).tobytes())
+        rows_by_id.update(added)
+        self.dead = None
+        return len(latest)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        rows_by_id = self.ids()
+        rows = [rows_by_id.pop(str(i)) for i in ids if str(i) in rows_by_id]
+        if not rows:
+            return 0
+        with self.deleted_file.open("ab") as f:
+            f.write(np.asarray(rows, dtype=np.int64).tobytes())
+        # Replace rather than mutate: running queries hold the previous mask
+        dead = self.dead_rows().copy()
+        dead[rows] = True
+        self.dead = dead
+        return len(rows)
+
+
+class LocalIndex:
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.RLock()
+
+    def _namespace(self, namespace: str) -> _Namespace:
+        if (
+            not namespace
+            or "/" in namespace
+            or "\\" in namespace
+            or namespace in (".", "..")
+            or namespace.endswith(_COMPACT_SUFFIXES)
+        ):
+            raise ValueError(f"Invalid namespace: {namespace!r}")
+        ns = self._namespaces.get(namespace)
+        if ns is None:
+            ns = _Namespace(self.root / namespace)
+            self._namespaces[namespace] = ns
+            self._compact(ns)
+        return ns
+
+    def _compact(self, ns: _Namespace) -> None:
+        # Replaced and deleted rows are rewritten away once they are this share of rows
+        if ns.needs_compaction(env_float("LOCAL_INDEX_COMPACT_RATIO", 0.3)):
+            ns.compact()
+
+    def dimension(self, namespace: str) -> int:
+        # 0 until the namespace stores its first vector
+        with self._lock:
+            return self._namespace(namespace).dimension
+
+    def upsert(self, *, namespace: str, vectors: Sequence[dict], **kwargs) -> dict:
+        with self._lock:
+            ns = self._namespace(namespace)
+            count = ns.upsert(vectors)
+            self._compact(ns)
+        return {"upserted_count": count}
+
+    def delete(self, *, ids: Sequence[str], namespace: str, **kwargs) -> dict:
+        with self._lock:
+            ns = self._namespace(namespace)
+            ns.delete(ids)
+            self._compact(ns)
+        return {}
+
+    def query(
+        self,
+        *,
+        namespace: str,
+        vector: Sequence[float],
+        top_k: int,
+        include_values: bool = False,
+        include_metadata: bool = True,
+        sparse_vector: Optional[dict] = None,
+        quantization: Optional[str] = None,
+        rescore_factor: Optional[int] = None,
+        **kwargs,
+    ) -> dict:
+        settings = quantization_settings(namespace)
+        mode = quantization or settings.mode
+        # Stored rows never change, so a snapshot stays valid while upserts run
+        with self._lock:
+            ns = self._namespace(namespace)
+            matrix = ns.vectors()
+            if matrix is None or top_k <= 0:
+                return {"matches": [], "namespace": namespace}
+            offsets = ns.metadata_offsets()
+            postings = ns.inverted_index() if sparse_vector else None
+            dead = ns.dead_rows()
+            codes = ns.quantized(mode) if mode != "off" else None
+            metadata = ns.metadata_file.open("rb")
+
+        with metadata:
+            q = np.asarray(vector, dtype=np.float32)
+            if postings is None:
+                norm = float(np.linalg.norm(q))
+                if norm > 0:
+                    q = q / norm
+            if codes is None:
+                scores = matrix @ q
+            else:
+                scores = approximate_scores(codes[0], codes[1], q, mode)
+
+            # Sparse-dense queries score like a dotproduct index: dense + sparse
+            sparse_scores: Optional[np.ndarray] = None
+            if postings is not None and sparse_vector is not None:
+                sparse_scores = np.zeros(len(scores), dtype=np.float32)
+                for idx, weight in zip(
+                    sparse_vector["indices"], sparse_vector["values"]
+                ):
+                    posting = postings.get(int(idx))
+                    if posting is not None:
+                        rows, weights = posting
+                        in_snapshot = rows < len(scores)
+                        sparse_scores[rows[in_snapshot]] += (
+                            weight * weights[in_snapshot]
+                        )
+                scores += sparse_scores
+
+            alive = len(scores)
+            if dead.any():
+                scores[dead[: len(scores)]] = -np.inf
+                alive -= int(dead[: len(scores)].sum())
+            k = min(top_k, alive)
+            if k <= 0:
+                return {"matches": [], "namespace": namespace}
+
+            candidates: Optional[np.ndarray] = None
+            if codes is not None:
+                # Exact scores for a shortlist of the best approximate ones
+                factor = rescore_factor or settings.rescore_factor
+                shortlist = min(alive, k * max(1, factor))
+                candidates = np.sort(
+                    np.argpartition(-scores, shortlist - 1)[:shortlist]
+                )
+                scores = matrix[candidates] @ q
+                if sparse_scores is not None:
+                    scores += sparse_scores[candidates]
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            picked = top if candidates is None else candidates[top]
+            records = ns.read_records(metadata, offsets, picked.tolist())
+
+            matches = []
+            for pos, row, record in zip(top.tolist(), picked.tolist(), records):
+                match = {"id": record["id"], "score": float(scores[pos])}
+                if include_metadata:
+                    match["metadata"] = record["metadata"]
+                if include_values:
+                    match["values"] = matrix[row].tolist()
+                matches.append(match)
+            return {"matches": matches, "namespace": namespace}
+
+    def export(self, namespace: str) -> Tuple[List[str], np.ndarray]:
+        # Live ids with their stored vectors, e.g. for offline evaluation
+        with self._lock:
+            ns = self._namespace(namespace)
+            matrix = ns.vectors()
+            rows_by_id = dict(ns.ids())
+        if matrix is None or not rows_by_id:
+            return [], np.empty((0, ns.dimension), dtype=np.float32)
+        ids = list(rows_by_id)
+        return ids, np.asarray(matrix[[rows_by_id[i] for i in ids]])
+
+    def centroid(self, namespace: str) -> Optional[List[float]]:
+        with self._lock:
+            ns = self._namespace(namespace)
+            matrix = ns.vectors()
+            dead = ns.dead_rows()
+        if matrix is None or dead.all():
+            return None
+        rows = matrix[~dead] if dead.any() else matrix
+        mean = rows.mean(axis=0, dtype=np.float64)
+        norm = float(np.linalg.norm(mean))
+        if norm == 0:
+            return None
+        return (mean / norm).astype(np.float32).tolist()
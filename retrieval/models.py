@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Protocol, Sequence, TypedDict
+from typing import Any, Protocol, Sequence, TypedDict
 
 
 class PageDocument(TypedDict, total=False):
@@ -13,10 +13,16 @@ class Metadata(TypedDict, total=False):
     content: str
 
 
+class SparseValues(TypedDict):
+    indices: list[int]
+    values: list[float]
+
+
 class Match(TypedDict, total=False):
     id: str
     score: float
     metadata: Metadata
+    values: list[float]
 
 
 class PineconeIndex(Protocol):
@@ -28,4 +34,9 @@ class PineconeIndex(Protocol):
         top_k: int,
         include_values: bool,
         include_metadata: bool,
+        sparse_vector: SparseValues | None = None,
     ) -> object: ...
+
+    def upsert(self, *, namespace: str, vectors: Sequence[Any]) -> object: ...
+
+    def delete(self, *, ids: Sequence[str], namespace: str) -> object: ...
@@ -0,0 +1,88 @@
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+from core.utils import env_choice, env_int, namespace_env
+
+
+QUANTIZATION_MODES = ("off", "int8", "binary")
+
+# Rows converted at a time, so temporaries stay around 16 MB whatever the namespace size
+_BLOCK_ELEMENTS = 1 << 22
+# int8 rows are widened through a cache-sized buffer before the matrix-vector product
+_CAST_ELEMENTS = 1 << 17
+
+
+class QuantizationSettings(NamedTuple):
+    mode: str
+    rescore_factor: int
+
+
+def quantization_settings(namespace: str) -> QuantizationSettings:
+    # Both settings can be overridden per namespace, e.g. VECTOR_QUANTIZATION_HOTEL_POLICIES
+    mode = env_choice(
+        namespace_env("VECTOR_QUANTIZATION", namespace),
+        env_choice("VECTOR_QUANTIZATION", "off", QUANTIZATION_MODES),
+        QUANTIZATION_MODES,
+    )
+    factor = env_int(
+        namespace_env("RESCORE_FACTOR", namespace), env_int("RESCORE_FACTOR", 4)
+    )
+    return QuantizationSettings(mode=mode, rescore_factor=max(1, factor))
+
+
+def code_width(mode: str, dimension: int) -> int:
+    # Bytes per row; binary rows are padded to whole 64-bit words
+    if mode == "int8":
+        return dimension
+    return -(-dimension // 64) * 8
+
+
+def _blocks(rows: int, dimension: int, elements: int = _BLOCK_ELEMENTS):
+    step = max(1, elements // max(1, dimension))
+    for start in range(0, rows, step):
+        yield start, min(rows, start + step)
+
+
+def quantize(matrix: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    # int8 keeps one scale per row; binary keeps only the signs
+    rows, dimension = matrix.shape
+    if mode == "int8":
+        codes = np.empty((rows, dimension), dtype=np.int8)
+        scales = np.empty(rows, dtype=np.float32)
+        for start, end in _blocks(rows, dimension):
+            block = np.asarray(matrix[start:end], dtype=np.float32)
+            peak = np.abs(block).max(axis=1)
+            scale = np.where(peak > 0, peak / 127, 1.0).astype(np.float32)
+            codes[start:end] = np.rint(block / scale[:, None])
+            scales[start:end] = scale
+        return codes, scales
+
+    codes = np.zeros((rows, code_width(mode, dimension)), dtype=np.uint8)
+    for start, end in _blocks(rows, dimension):
+        packed = np.packbits(np.asarray(matrix[start:end]) > 0, axis=1)
+        codes[start:end, : packed.shape[1]] = packed
+    return codes, None
+
+
+def approximate_scores(
+    codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray, mode: str
+) -> np.ndarray:
+    scores = np.empty(len(codes), dtype=np.float32)
+    if mode == "int8":
+        step = max(1, _CAST_ELEMENTS // codes.shape[1])
+        buffer = np.empty((min(step, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start, end in _blocks(len(codes), codes.shape[1], _CAST_ELEMENTS):
+            block = buffer[: end - start]
+            np.copyto(block, codes[start:end], casting="unsafe")
+            np.matmul(block, query, out=scores[start:end])
+        return scores * scales
+
+    # Sign agreement on the same scale as a cosine: 1 - 2 * hamming / dimension
+    query_bits = np.zeros(codes.shape[1], dtype=np.uint8)
+    packed = np.packbits(query > 0)
+    query_bits[: len(packed)] = packed
+    words = codes.view(np.uint64)
+    query_words = query_bits.view(np.uint64)
+    for start, end in _blocks(len(codes), codes.shape[1]):
+        distance = np.bitwise_count(words[start:end] ^ query_words).sum(axis=1)
+        scores[start:end] = 1 - 2 * distance / len(query)
+    return scores
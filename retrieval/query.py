@@ -1,5 +1,5 @@
 import retrieval.models as models
-from typing import Sequence, List
+from typing import List, Optional, Sequence
 
 
 def query_pinecone(
@@ -7,15 +7,19 @@ def query_pinecone(
     embedding: Sequence[float],
     namespace: str,
     top_k: int = 5,
+    sparse_vector: Optional[models.SparseValues] = None,
+    include_values: bool = False,
 ) -> List[models.Match]:
 
+    extra = {"sparse_vector": sparse_vector} if sparse_vector else {}
     try:
         res = index.query(
             namespace=namespace,
             vector=embedding,
             top_k=top_k,
-            include_values=False,
+            include_values=include_values,
             include_metadata=True,
+            **extra,
         )
     except Exception:
         return []
@@ -27,19 +31,20 @@ def query_pinecone(
     normalized_matches: List[models.Match] = []
     for m in response_matches or []:
         if isinstance(m, dict):
-            normalized_matches.append(
-                {
-                    "id": m.get("id"),
-                    "score": m.get("score"),
-                    "metadata": m.get("metadata"),
-                }
-            )
+            match: models.Match = {
+                "id": m.get("id"),
+                "score": m.get("score"),
+                "metadata": m.get("metadata"),
+            }
+            values = m.get("values")
         else:
-            normalized_matches.append(
-                {
-                    "id": getattr(m, "id", None),
-                    "score": getattr(m, "score", None),
-                    "metadata": getattr(m, "metadata", None),
-                }
-            )
+            match = {
+                "id": getattr(m, "id", None),
+                "score": getattr(m, "score", None),
+                "metadata": getattr(m, "metadata", None),
+            }
+            values = getattr(m, "values", None)
+        if include_values and values:
+            match["values"] = list(values)
+        normalized_matches.append(match)
     return normalized_matches
@@ -0,0 +1,92 @@
+import time
+from typing import List, NamedTuple, Sequence
+import numpy as np
+import retrieval.models as models
+from core.utils import env_choice, env_float, env_int, namespace_env
+
+
+RERANK_MODES = ("off", "mmr")
+
+
+class RerankSettings(NamedTuple):
+    mode: str
+    top_k: int
+    fetch_k: int
+    mmr_lambda: float
+    budget_ms: float
+
+
+def rerank_settings(namespace: str) -> RerankSettings:
+    # Every setting can be overridden per namespace, e.g. MMR_LAMBDA_HOTEL_POLICIES
+    def _int(name: str, default: int) -> int:
+        return env_int(namespace_env(name, namespace), env_int(name, default))
+
+    def _float(name: str, default: float) -> float:
+        return env_float(namespace_env(name, namespace), env_float(name, default))
+
+    mode = env_choice(
+        namespace_env("RERANK_MODE", namespace),
+        env_choice("RERANK_MODE", "off", RERANK_MODES),
+        RERANK_MODES,
+    )
+    top_k = max(1, _int("RETRIEVAL_TOP_K", 5))
+    return RerankSettings(
+        mode=mode,
+        top_k=top_k,
+        fetch_k=max(top_k, _int("RERANK_FETCH_K", 30)),
+        mmr_lambda=min(1.0, max(0.0, _float("MMR_LAMBDA", 0.7))),
+        budget_ms=_float("RERANK_BUDGET_MS", 5.0),
+    )
+
+
+def mmr_select(
+    query: Sequence[float],
+    vectors: np.ndarray,
+    k: int,
+    mmr_lambda: float,
+    deadline: float = float("inf"),
+) -> List[int]:
+    # Greedy MMR; once the deadline passes the rest is filled by plain relevance
+    q = np.asarray(query, dtype=np.float32)
+    q /= max(float(np.linalg.norm(q)), 1e-12)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+    relevance = unit @ q
+    similarity = unit @ unit.T
+
+    k = min(k, len(unit))
+    selected: List[int] = []
+    available = np.ones(len(unit), dtype=bool)
+    redundancy = np.full(len(unit), -np.inf, dtype=np.float32)
+    while len(selected) < k and time.perf_counter() < deadline:
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * np.maximum(redundancy, 0)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+
+    if len(selected) < k:
+        rest = [i for i in np.argsort(-relevance, kind="stable") if available[i]]
+        selected.extend(int(i) for i in rest[: k - len(selected)])
+    return selected
+
+
+def rerank_matches(
+    matches: List[models.Match], query: Sequence[float], settings: RerankSettings
+) -> List[models.Match]:
+    # Values are only needed here, so they are dropped from what is returned
+    stripped = [
+        {key: value for key, value in m.items() if key != "values"} for m in matches
+    ]
+    if (
+        settings.mode != "mmr"
+        or len(matches) <= settings.top_k
+        or any(not m.get("values") for m in matches)
+    ):
+        return stripped[: settings.top_k]
+
+    deadline = time.perf_counter() + settings.budget_ms / 1000
+    vectors = np.asarray([m["values"] for m in matches], dtype=np.float32)
+    order = mmr_select(query, vectors, settings.top_k, settings.mmr_lambda, deadline)
+    return [stripped[i] for i in order]
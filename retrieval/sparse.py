@@ -0,0 +1,168 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from core.utils import env_choice, env_float
+
+
+RETRIEVAL_MODES = ("dense", "hybrid")
+
+# Keeps prices, times and room numbers such as 12.50, 11:00 or 4b intact
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.,:/-][a-z0-9]+)*")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def get_retrieval_mode() -> str:
+    return env_choice("RETRIEVAL_MODE", "dense", RETRIEVAL_MODES)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def term_index(term: str) -> int:
+    digest = hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFF
+
+
+def document_terms(text: str) -> Tuple[int, List[int]]:
+    # What one document contributes to the statistics: its length and distinct terms
+    terms = tokenize(text)
+    return len(terms), sorted({term_index(t) for t in terms})
+
+
+class BM25Stats:
+    # Corpus statistics for one namespace, persisted as JSON
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.doc_count = 0
+        self.total_length = 0
+        self.doc_freq: Dict[int, int] = {}
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            self.doc_count = int(data["doc_count"])
+            self.total_length = int(data["total_length"])
+            self.doc_freq = {int(k): int(v) for k, v in data["doc_freq"].items()}
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / self.doc_count if self.doc_count else 1.0
+
+    def add_documents(self, documents: Sequence[Tuple[int, Sequence[int]]]) -> None:
+        for length, indices in documents:
+            self.doc_count += 1
+            self.total_length += length
+            for idx in indices:
+                self.doc_freq[idx] = self.doc_freq.get(idx, 0) + 1
+
+    def remove_documents(self, documents: Sequence[Tuple[int, Sequence[int]]]) -> None:
+        for length, indices in documents:
+            self.doc_count = max(0, self.doc_count - 1)
+            self.total_length = max(0, self.total_length - length)
+            for idx in indices:
+                df = self.doc_freq.get(idx, 0) - 1
+                if df > 0:
+                    self.doc_freq[idx] = df
+                else:
+                    self.doc_freq.pop(idx, None)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "doc_count": self.doc_count,
+            "total_length": self.total_length,
+            "doc_freq": self.doc_freq,
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def idf(self, idx: int) -> float:
+        df = self.doc_freq.get(idx, 0)
+        return math.log((self.doc_count - df + 0.5) / (df + 0.5) + 1.0)
+
+    def encode_document(self, text: str) -> Optional[dict]:
+        counts = Counter(term_index(t) for t in tokenize(text))
+        if not counts:
+            return None
+        length = sum(counts.values())
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length)
+        indices = sorted(counts)
+        values = [counts[i] * (BM25_K1 + 1) / (counts[i] + norm) for i in indices]
+        return {"indices": indices, "values": values}
+
+    def encode_query(self, text: str) -> Optional[dict]:
+        indices = sorted({term_index(t) for t in tokenize(text)})
+        weighted = [(i, self.idf(i)) for i in indices if i in self.doc_freq]
+        if not weighted:
+            return None
+        return {
+            "indices": [i for i, _ in weighted],
+            "values": [w for _, w in weighted],
+        }
+
+
+_stats: Dict[str, BM25Stats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_bm25_stats(namespace: str) -> BM25Stats:
+    root = Path(os.environ.get("BM25_STATS_DIR") or "bm25_stats")
+    path = root / f"{namespace}.json"
+    with _stats_lock:
+        stats = _stats.get(str(path))
+        if stats is None:
+            stats = BM25Stats(path)
+            _stats[str(path)] = stats
+        return stats
+
+
+def encode_documents(
+    namespace: str,
+    texts: Sequence[str],
+    replaced: Sequence[Tuple[int, Sequence[int]]] = (),
+) -> Tuple[List[Optional[dict]], List[Tuple[int, List[int]]]]:
+    # replaced holds the terms of stored documents these texts overwrite
+    documents = [document_terms(text) for text in texts]
+    stats = get_bm25_stats(namespace)
+    with _stats_lock:
+        stats.remove_documents(replaced)
+        stats.add_documents(documents)
+        stats.save()
+        return [stats.encode_document(text) for text in texts], documents
+
+
+def release_documents(
+    namespace: str,
+    documents: Sequence[Tuple[int, Sequence[int]]],
+    restored: Sequence[Tuple[int, Sequence[int]]] = (),
+) -> None:
+    # Takes deleted (or never stored) documents out of the statistics
+    if not documents and not restored:
+        return
+    stats = get_bm25_stats(namespace)
+    with _stats_lock:
+        stats.remove_documents(documents)
+        stats.add_documents(restored)
+        stats.save()
+
+
+def hybrid_query(
+    namespace: str, embedding: Sequence[float], text: str
+) -> Tuple[List[float], Optional[dict]]:
+    # Convex combination: alpha weights dense, 1 - alpha weights sparse
+    alpha = min(1.0, max(0.0, env_float("HYBRID_ALPHA", 0.7)))
+    stats = get_bm25_stats(namespace)
+    with _stats_lock:
+        sparse = stats.encode_query(text)
+    dense = [v * alpha for v in embedding]
+    if sparse is not None:
+        sparse["values"] = [v * (1 - alpha) for v in sparse["values"]]
+    return dense, sparse
@@ -0,0 +1,43 @@
+import json
+from batch import _completed_lines, _read_questions
+
+
+def _write(path, records, tail: str = "") -> None:
+    lines = [json.dumps(record) + "\n" for record in records]
+    path.write_text("".join(lines) + tail, encoding="utf-8")
+
+
+def _records(path) -> list:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_resuming_skips_answered_lines_and_drops_a_truncated_record(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    _write(
+        output,
+        [{"line": 1, "answer": "7am"}, {"line": 3, "error": "RateLimitError"}],
+        tail='{"line": 2, "answ',
+    )
+
+    assert _completed_lines(output, retry_errors=False) == {1, 3}
+    assert [r["line"] for r in _records(output)] == [1, 3]
+
+
+def test_retrying_errors_removes_their_records(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    _write(
+        output,
+        [
+            {"line": 1, "answer": "7am"},
+            {"line": 2, "error": "RateLimitError"},
+            {"line": 3, "answer": "Yes"},
+        ],
+    )
+
+    assert _completed_lines(output, retry_errors=True) == {1, 3}
+    assert [r["line"] for r in _records(output)] == [1, 3]
+
+    questions = tmp_path / "questions.jsonl"
+    _write(questions, [{"question": q} for q in ("Pool?", "Spa?", "Gym?")])
+    skip = _completed_lines(output, retry_errors=True)
+    assert [q.line for q in _read_questions(questions, skip)] == [2]
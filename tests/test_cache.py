@@ -0,0 +1,29 @@
+from core.cache import SemanticAnswerCache, depends_on_history
+
+
+def test_standalone_questions_with_common_pronouns_are_cached():
+    questions = [
+        "What time does the pool open and is it heated?",
+        "Does the hotel have parking, and is it free?",
+        "Is breakfast included in the room rate or do I pay for it?",
+        "Can guests bring their dogs?",
+        "Which rooms have a balcony that faces the sea?",
+        "Do you also offer airport transfers?",
+    ]
+    assert [q for q in questions if depends_on_history(q)] == []
+
+    cache = SemanticAnswerCache(max_entries=8, ttl_seconds=60, threshold=0.95)
+    cache.put("hotel_policies", [1.0, 0.0], "The pool opens at 7:00 and is heated.")
+    assert cache.get("hotel_policies", [1.0, 0.01]) is not None
+
+
+def test_follow_ups_are_not_answered_from_the_cache():
+    questions = [
+        "Is it heated?",
+        "How much does it cost?",
+        "And those rooms, do they have a balcony?",
+        "What about breakfast?",
+        "Is that the same as the previous price?",
+        "Can you say that again?",
+    ]
+    assert all(depends_on_history(q) for q in questions)
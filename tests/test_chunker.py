@@ -0,0 +1,129 @@
+import io
+import random
+import pytest
+from typing import List, Optional, Tuple
+from ingest.chunker import iter_chunks
+
+
+# The chunker that iter_chunks replaced, kept as the reference for its boundaries
+def _reference_split_point(s: str, preferred_at: int) -> Optional[int]:
+    split_point = s.rfind("\n\n", 0, preferred_at)
+    if split_point != -1:
+        return split_point
+    split_point = s.rfind(". ", 0, preferred_at)
+    if split_point != -1:
+        return split_point + 1
+    split_point = s.rfind(" ", 0, preferred_at)
+    if split_point != -1:
+        return split_point
+    return None
+
+
+def _reference_chunks(
+    text: str, chunk_size: int, overlap: int
+) -> List[Tuple[str, int, int]]:
+    cleaned = text.strip()
+    if not cleaned:
+        return []
+
+    chunks: List[Tuple[str, int, int]] = []
+    cursor = 0
+    text_length = len(cleaned)
+    min_chunk_length = int(chunk_size * 0.5)
+    tail_threshold = int(chunk_size * 0.2)
+
+    while cursor < text_length:
+        preferred_end = min(cursor + chunk_size, text_length)
+        window = cleaned[cursor:preferred_end]
+        relative_split = _reference_split_point(window, len(window))
+        if relative_split is None or relative_split < min_chunk_length:
+            boundary = preferred_end
+        else:
+            boundary = cursor + relative_split
+
+        boundary = min(boundary, text_length)
+        chunk_text = cleaned[cursor:boundary].strip()
+        if chunk_text:
+            chunks.append((chunk_text, cursor, boundary))
+
+        next_cursor = max(0, boundary - overlap)
+        if 0 < (text_length - next_cursor) < tail_threshold:
+            tail_text = cleaned[next_cursor:text_length].strip()
+            if tail_text:
+                chunks.append((tail_text, next_cursor, text_length))
+            break
+
+        cursor = next_cursor
+
+    return chunks
+
+
+def _reference_line(text: str, index: int) -> int:
+    # Offsets are into the stripped text; lines count from the top of the file
+    lead = len(text) - len(text.lstrip())
+    return text.count("\n", 0, lead + index + 1) + 1
+
+
+def _reference_spans(text: str, chunk_size: int, overlap: int) -> list:
+    return [
+        (
+            chunk,
+            start,
+            end,
+            _reference_line(text, start),
+            _reference_line(text, max(end - 1, start)),
+        )
+        for chunk, start, end in _reference_chunks(text, chunk_size, overlap)
+    ]
+
+
+def _streamed_spans(text: str, chunk_size: int, overlap: int, block_size: int):
+    spans = iter_chunks(io.StringIO(text), chunk_size, overlap, block_size)
+    return [tuple(span) for span in spans]
+
+
+def _random_text(rng: random.Random) -> str:
+    words = ["pool", "opens", "at", "seven", "breakfast", "is", "served", "daily"]
+    parts = ["\n" * rng.randint(0, 3), " " * rng.randint(0, 2)]
+    for _ in range(rng.randint(0, 400)):
+        parts.append(rng.choice(words))
+        parts.append(rng.choice([" ", " ", " ", ". ", "\n", "\n\n", "  \n"]))
+    parts.append(rng.choice(["", "\n", "\n\n  \n"]))
+    return "".join(parts)
+
+
+def test_leading_blank_lines_count_towards_line_numbers():
+    text = "\n\n  \nCheckout is at 11:00.\nLate checkout costs 20 EUR.\n"
+    spans = _streamed_spans(text, 2000, 0, 1 << 20)
+    assert spans == _reference_spans(text, 2000, 0)
+    assert [(span[3], span[4]) for span in spans] == [(4, 5)]
+
+
+def test_streaming_matches_the_reference_chunker():
+    rng = random.Random(7)
+    for _ in range(300):
+        text = _random_text(rng)
+        chunk_size = rng.choice([40, 100, 250])
+        # The reference never finishes once overlap reaches the tail threshold
+        overlap = rng.choice([0, 0, 1, chunk_size // 5 - 1])
+        # Small blocks make the buffer refill and compact within a chunk
+        block_size = rng.choice([1, 7, 64, 1 << 20])
+        expected = _reference_spans(text, chunk_size, overlap)
+        assert _streamed_spans(text, chunk_size, overlap, block_size) == expected, (
+            text,
+            chunk_size,
+            overlap,
+            block_size,
+        )
+
+
+def test_overlap_past_the_tail_threshold_terminates():
+    text = "breakfast is served daily " * 20
+    spans = _streamed_spans(text, 100, 40, 1 << 20)
+    assert spans[-1][2] == len(text.strip())
+    assert len(spans) < len(text) // 40
+
+
+def test_overlap_of_half_a_chunk_is_rejected():
+    with pytest.raises(ValueError):
+        _streamed_spans("pool opens at seven " * 20, 100, 50, 1 << 20)
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from retrieval.local_index import LocalIndex
+
+
+def _vector(vector_id: str, values, text: str) -> dict:
+    return {"id": vector_id, "values": values, "metadata": {"text": text}}
+
+
+def test_replacing_a_vector_leaves_earlier_snapshots_intact(tmp_path):
+    index = LocalIndex(tmp_path)
+    index.upsert(
+        namespace="ns",
+        vectors=[_vector("a", [1, 0, 0], "old"), _vector("b", [0, 1, 0], "other")],
+    )
+    snapshot = index._namespace("ns").vectors()
+    before = np.array(snapshot)
+
+    index.upsert(namespace="ns", vectors=[_vector("a", [0, 0, 1], "new")])
+
+    # A query that took its snapshot before the upsert still reads the old rows
+    assert np.array_equal(np.array(snapshot), before)
+    result = index.query(namespace="ns", vector=[0, 0, 1], top_k=3)
+    assert [m["id"] for m in result["matches"]] == ["a", "b"]
+    assert result["matches"][0]["metadata"]["text"] == "new"
+    assert result["matches"][0]["score"] == 1.0
+
+
+def test_replaced_rows_stay_deleted_after_reopening(tmp_path):
+    index = LocalIndex(tmp_path)
+    index.upsert(namespace="ns", vectors=[_vector("a", [1, 0], "old")])
+    index.upsert(namespace="ns", vectors=[_vector("a", [0, 1], "new")])
+
+    ids, matrix = LocalIndex(tmp_path).export("ns")
+    assert ids == ["a"]
+    assert np.array_equal(matrix, [[0, 1]])
+
+
+def test_rows_past_the_header_count_are_discarded_on_load(tmp_path):
+    index = LocalIndex(tmp_path)
+    index.upsert(
+        namespace="ns",
+        vectors=[_vector("a", [1, 0], "first"), _vector("b", [0, 1], "second")],
+    )
+    # An upsert that crashed before writing its header
+    with (tmp_path / "ns" / "ids.txt").open("a", encoding="utf-8") as f:
+        f.write("c\n")
+    with (tmp_path / "ns" / "vectors.f32").open("ab") as f:
+        f.write(np.asarray([1, 1], dtype=np.float32).tobytes())
+
+    index = LocalIndex(tmp_path)
+    index.upsert(namespace="ns", vectors=[_vector("d", [1, 1], "third")])
+    index.delete(ids=["a"], namespace="ns")
+    result = index.query(namespace="ns", vector=[1, 0], top_k=5)
+    assert [m["id"] for m in result["matches"]] == ["d", "b"]
+    assert result["matches"][0]["metadata"]["text"] == "third"
+
+
+def test_a_failed_upsert_leaves_the_namespace_usable(tmp_path, monkeypatch):
+    index = LocalIndex(tmp_path)
+    index.upsert(namespace="ns", vectors=[_vector("a", [1, 0], "old")])
+    ns = index._namespace("ns")
+
+    def fail() -> None:
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(ns, "_write_header", fail)
+        with pytest.raises(OSError):
+            index.upsert(namespace="ns", vectors=[_vector("a", [0, 1], "new")])
+
+    assert ns.count == 1
+    index.delete(ids=["a"], namespace="ns")
+    index.upsert(namespace="ns", vectors=[_vector("b", [0, 1], "other")])
+    result = index.query(namespace="ns", vector=[0, 1], top_k=5)
+    assert [m["id"] for m in result["matches"]] == ["b"]
+    assert LocalIndex(tmp_path).export("ns")[0] == ["b"]
+
+
+def test_a_lost_delete_of_a_replaced_row_is_redone_on_load(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOCAL_INDEX_COMPACT_RATIO", "0")
+    index = LocalIndex(tmp_path)
+    index.upsert(namespace="ns", vectors=[_vector("a", [1, 0], "old")])
+    index.upsert(namespace="ns", vectors=[_vector("a", [0, 1], "new")])
+    (tmp_path / "ns" / "deleted.i64").unlink()
+
+    result = LocalIndex(tmp_path).query(namespace="ns", vector=[1, 0], top_k=5)
+    assert [m["metadata"]["text"] for m in result["matches"]] == ["new"]
+
+
+def test_reupserting_the_same_ids_does_not_grow_the_files(tmp_path):
+    index = LocalIndex(tmp_path)
+    vectors = [_vector(str(i), [float(i), 1.0, 0.0], f"chunk {i}") for i in range(10)]
+    sparse = {"indices": [1, 2], "values": [0.5, 0.5]}
+    for version in range(5):
+        index.upsert(
+            namespace="ns",
+            vectors=[
+                {**v, "metadata": {"text": f"v{version}"}, "sparse_values": sparse}
+                for v in vectors
+            ],
+        )
+    index.delete(ids=["0", "1", "2", "3"], namespace="ns")
+
+    folder = tmp_path / "ns"
+    assert (folder / "vectors.f32").stat().st_size == 6 * 3 * 4
+    assert len((folder / "ids.txt").read_text().splitlines()) == 6
+    assert not (tmp_path / "ns.compact").exists()
+    assert not (tmp_path / "ns.old").exists()
+
+    for reopened in (index, LocalIndex(tmp_path)):
+        result = reopened.query(
+            namespace="ns", vector=[9, 1, 0], top_k=10, sparse_vector=sparse
+        )
+        assert [m["id"] for m in result["matches"]] == ["9", "8", "7", "6", "5", "4"]
+        assert {m["metadata"]["text"] for m in result["matches"]} == {"v4"}
+
+
+def test_an_interrupted_compaction_is_finished_on_load(tmp_path):
+    index = LocalIndex(tmp_path)
+    index.upsert(namespace="ns", vectors=[_vector("a", [1, 0], "kept")])
+    # Crash after the old folder was moved aside, before the new one took its place
+    (tmp_path / "ns").rename(tmp_path / "ns.compact")
+    (tmp_path / "ns.old").mkdir()
+
+    assert LocalIndex(tmp_path).export("ns")[0] == ["a"]
+    assert not (tmp_path / "ns.old").exists()
@@ -0,0 +1,128 @@
+import threading
+import time
+import httpx
+import openai
+import pytest
+from core import ratelimit
+from core.ratelimit import (
+    BACKGROUND,
+    INTERACTIVE,
+    RateLimiter,
+    RequestCancelled,
+    call_with_retry,
+    is_transient,
+    stop_waiting_when,
+)
+
+
+_REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _status_error(cls, status: int, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=_REQUEST)
+    return cls("failed", response=response, body=None)
+
+
+@pytest.mark.parametrize(
+    "ex",
+    [
+        _status_error(openai.RateLimitError, 429),
+        _status_error(openai.InternalServerError, 503),
+        _status_error(openai.ConflictError, 409),
+        openai.APIConnectionError(request=_REQUEST),
+        openai.APITimeoutError(request=_REQUEST),
+        ConnectionResetError(),
+        TimeoutError(),
+    ],
+)
+def test_transient_errors_are_retried(ex):
+    assert is_transient(ex)
+
+
+@pytest.mark.parametrize(
+    "ex",
+    [
+        _status_error(openai.BadRequestError, 400),
+        _status_error(openai.AuthenticationError, 401),
+        _status_error(openai.NotFoundError, 404),
+        ValueError("bad json"),
+        KeyError("choices"),
+        RuntimeError(),
+    ],
+)
+def test_other_errors_are_raised_at_once(ex):
+    assert not is_transient(ex)
+
+
+def test_retry_after_is_honoured(monkeypatch):
+    slept = []
+    sleep = time.sleep
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda s: slept.append(s) or sleep(s))
+    limiter = RateLimiter("test", 0, 0, 0.2)
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise _status_error(openai.RateLimitError, 429, {"retry-after-ms": "100"})
+        return "ok"
+
+    assert call_with_retry(limiter, fn, 10) == "ok"
+    assert 0.1 <= slept[0] <= 0.11
+    assert calls[1] - calls[0] >= 0.1
+
+    # Seconds are used over the exponential backoff, even on the first attempt
+    ex = _status_error(openai.RateLimitError, 429, {"retry-after": "3"})
+    assert 3.0 <= ratelimit._retry_delay(ex, 0) <= 3.3
+
+
+def test_a_429_pauses_every_caller():
+    limiter = RateLimiter("test", 0, 0, 0.2)
+    limiter.throttle(0.2)
+    started = time.monotonic()
+    limiter.acquire(1)
+    assert time.monotonic() - started >= 0.19
+
+
+def test_background_leaves_the_reserve_for_interactive_callers():
+    limiter = RateLimiter("test", 10, 0, 0.2)
+    for _ in range(8):
+        limiter.acquire(1, BACKGROUND)
+    assert limiter._try_acquire(1, BACKGROUND) > 0
+    assert limiter._try_acquire(1, INTERACTIVE) == 0
+
+
+def test_background_waits_while_an_interactive_caller_is_queued():
+    limiter = RateLimiter("test", 0, 0, 0.2)
+    limiter.throttle(0.2)
+    order = []
+
+    def acquire(priority: str) -> None:
+        limiter.acquire(1, priority)
+        order.append(priority)
+
+    interactive = threading.Thread(target=acquire, args=(INTERACTIVE,))
+    interactive.start()
+    while not limiter._interactive_waiting:
+        time.sleep(0.001)
+    background = threading.Thread(target=acquire, args=(BACKGROUND,))
+    background.start()
+    interactive.join()
+    background.join()
+    assert order == [INTERACTIVE, BACKGROUND]
+
+
+def test_settle_returns_unused_tokens():
+    limiter = RateLimiter("test", 0, 1000, 0.0)
+    limiter.acquire(300)
+    limiter.settle(300, 100)
+    assert limiter._tokens.level == pytest.approx(900, abs=1)
+
+
+def test_a_stopped_caller_gives_up_waiting():
+    limiter = RateLimiter("test", 0, 0, 0.2)
+    limiter.throttle(30)
+    started = time.monotonic()
+    with stop_waiting_when(lambda: True), pytest.raises(RequestCancelled):
+        limiter.acquire(1, BACKGROUND)
+    assert time.monotonic() - started < 1
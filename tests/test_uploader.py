@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import threading
+import pytest
+from core.ratelimit import RequestCancelled
+from ingest import uploader
+from ingest.chunk_cache import ChunkCache, content_hash
+from ingest.chunker import iter_file_chunks
+
+
+class _Index:
+    def upsert(self, **kwargs) -> dict:
+        return {"upserted_count": len(kwargs["vectors"])}
+
+    def delete(self, **kwargs) -> dict:
+        return {}
+
+
+class _Client:
+    api_key = "test"
+    organization = None
+    base_url = "http://localhost"
+
+
+class _AsyncClient:
+    async def close(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize("mode", ["threads", "async"])
+def test_cancelling_behind_a_blocked_group_caches_no_shifted_text(
+    tmp_path, monkeypatch, mode
+):
+    path = tmp_path / "policies.txt"
+    path.write_text(
+        "\n\n".join(word * 300 for word in ("AAA ", "BBB ", "CCC ")), encoding="utf-8"
+    )
+    pieces = [span.text for span in iter_file_chunks(path)]
+    assert len(pieces) == 3
+    cache = ChunkCache(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(uploader, "get_chunk_cache", lambda: cache)
+    monkeypatch.setattr(uploader, "get_pinecone_index", _Index)
+    monkeypatch.setenv("INGEST_MODE", mode)
+    monkeypatch.setenv("SITUATE_BATCH_SIZE", "1")
+
+    # The first group waits for quota until the job is cancelled, which happens
+    # once the later groups have finished
+    cancelled = threading.Event()
+    finished = []
+    lock = threading.Lock()
+
+    def later_group_done() -> None:
+        with lock:
+            finished.append(1)
+            if len(finished) == 2:
+                cancelled.set()
+
+    def situate_group(client, prompts, group):
+        if group[0] == 0:
+            cancelled.wait(5)
+            raise RequestCancelled("stopped while waiting for rate limit quota")
+        later_group_done()
+        return [f"ctx : {prompts.pieces[i]}" for i in group]
+
+    async def asituate_group(client, prompts, group):
+        if group[0] == 0:
+            while not cancelled.is_set():
+                await asyncio.sleep(0.01)
+            raise RequestCancelled("stopped while waiting for rate limit quota")
+        later_group_done()
+        return [f"ctx : {prompts.pieces[i]}" for i in group]
+
+    monkeypatch.setattr(uploader, "_situate_group", situate_group)
+    monkeypatch.setattr(uploader, "_asituate_group", asituate_group)
+    monkeypatch.setattr(uploader, "AsyncOpenAI", lambda **kwargs: _AsyncClient())
+
+    result = uploader._upsert_chunks(
+        "hotel_policies", path, _Client(), should_stop=cancelled.is_set
+    )
+
+    assert result.upserted == 0
+    doc_hash = hashlib.sha256(path.read_bytes()).hexdigest()
+    expected = {content_hash(piece): f"ctx : {piece}" for piece in pieces}
+    for model in ("gpt-4o-mini/full", "gpt-4o-mini/window"):
+        for chunk_hash, text in cache.get_situated(
+            doc_hash, list(expected), model
+        ).items():
+            assert text == expected[chunk_hash]
@@ -0,0 +1,68 @@
+from core.utils import pack_context
+
+
+def _match(score: float, lines, text: str, file: str = "policies.txt") -> dict:
+    return {
+        "id": f"{file}-{lines[0]}-{lines[1]}-{score}",
+        "score": score,
+        "metadata": {
+            "text": text,
+            "file": file,
+            "loc.lines.from": lines[0],
+            "loc.lines.to": lines[1],
+        },
+    }
+
+
+def test_chunks_of_the_same_line_are_all_kept():
+    # One long line split into two chunks, and a chunk ending mid-line 5
+    matches = [
+        _match(0.9, (1, 1), "Checkout is at 11:00 and late checkout costs 20 EUR."),
+        _match(0.8, (1, 1), "The pool is open from 7:00 to 22:00 every day."),
+        _match(0.7, (3, 5), "Parking is free for guests staying two nights."),
+        _match(0.6, (5, 5), "Breakfast is served from 6:30 to 10:30."),
+    ]
+    packed = pack_context(matches)
+    for match in matches:
+        assert match["metadata"]["text"] in packed.text
+    assert packed.passages == 2
+
+
+def test_repeated_and_contained_text_is_kept_once():
+    text = "Pets up to 10 kg are welcome for a fee of 15 EUR per night."
+    matches = [
+        _match(0.9, (2, 4), text),
+        _match(0.8, (3, 3), text),
+        _match(0.7, (2, 2), "Pets up to 10 kg are welcome"),
+    ]
+    packed = pack_context(matches)
+    assert packed.text == text
+    assert packed.passages == 1
+
+
+def test_overlapping_chunks_share_their_overlap_once():
+    first = "Room service runs until midnight. Orders after 23:00 carry a surcharge."
+    second = "Orders after 23:00 carry a surcharge. The minibar is restocked daily."
+    packed = pack_context([_match(0.9, (1, 2), first), _match(0.8, (2, 3), second)])
+    assert packed.text == (
+        "Room service runs until midnight. Orders after 23:00 carry a surcharge."
+        " The minibar is restocked daily."
+    )
+
+
+def test_separate_files_and_distant_ranges_stay_apart():
+    matches = [
+        _match(0.9, (1, 2), "Checkout is at 11:00."),
+        _match(0.8, (10, 12), "Spa bookings open a week ahead."),
+        _match(0.7, (1, 2), "Room service runs until midnight.", file="rooms.txt"),
+    ]
+    assert pack_context(matches).passages == 3
+
+
+def test_an_oversized_best_passage_is_cut_within_the_budget():
+    text = "Guests may cancel free of charge until 48 hours before arrival. " * 10
+    packed = pack_context([_match(0.9, (1, 1), text)], token_budget=20)
+    assert packed.passages == 1
+    assert packed.tokens <= 20
+    assert text.startswith(packed.text)
+    assert text[len(packed.text)] == " "